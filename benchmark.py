@@ -0,0 +1,1571 @@
+import os, sys, time, tracemalloc, tempfile, cProfile, pstats, copy
+import toil_final
+from toil_final import Interpreter, Scanner, Parser, Expander, Compiler, Evaluator, Environment, VM, InlineCache, Matcher, Switch, \
+    Ident, Node, Module, MacroTable, to_node, is_ident, is_ident_first, is_ident_rest, \
+    Scope, Seq, If, Match, While, Func, ContinueException, BreakException
+
+
+class CharScanner:
+    def __init__(self, src):
+        self._src = src
+        self._pos = 0
+        self._tokens = []
+
+    def tokenize(self):
+        while True:
+            while self._current_char().isspace(): self._advance()
+
+            if self._current_char() == "#":
+                while self._current_char() not in ("\n", "$EOF"):
+                    self._advance()
+                continue
+
+            match self._current_char():
+                case "$EOF":
+                    self._tokens.append(Ident("$EOF"))
+                    break
+                case c if c.isnumeric(): self._number()
+                case "'": self._raw_string()
+                case "\"": self._string()
+                case c if is_ident_first(c): self._ident()
+                case "-": self._two_char_operator(">")
+                case "!": self._two_char_operator("!=")
+                case c if c in "=<>:": self._two_char_operator("=")
+                case c if c in "+*/%()[]{}|.,;":
+                    self._tokens.append(Ident(c))
+                    self._advance()
+                case invalid:
+                    assert False, f"Invalid character @ tokenize(): {invalid}"
+
+        return self._tokens
+
+    def _number(self):
+        start = self._pos
+        while self._current_char().isnumeric(): self._advance()
+        self._tokens.append(int(self._src[start:self._pos]))
+
+    def _raw_string(self):
+        self._advance()
+        start = self._pos
+        while (c := self._current_char()) != "'":
+            assert c != "$EOF", f"Unterminated string @ _raw_string()"
+            self._advance()
+        self._tokens.append(self._src[start:self._pos])
+        self._advance()
+
+    def _string(self):
+        self._advance()
+        s = []
+        while (c := self._current_char()) != '"':
+            assert c != "$EOF", f"Unterminated string @ _string()"
+            if c == "\\":
+                self._advance()
+                c = self._current_char()
+                assert c != "$EOF", f"Unterminated string @ _string()"
+                match c:
+                    case "n": s.append("\n")
+                    case _: s.append(c)
+            else:
+                s.append(c)
+            self._advance()
+        self._advance()
+        self._tokens.append("".join(s))
+
+    def _ident(self):
+        start = self._pos
+        self._advance()
+        while is_ident_rest(self._current_char()): self._advance()
+        token = self._src[start:self._pos]
+        match token:
+            case "None": self._tokens.append(None)
+            case "True": self._tokens.append(True)
+            case "False": self._tokens.append(False)
+            case _: self._tokens.append(Ident(token))
+
+    def _two_char_operator(self, successors):
+        start = self._pos
+        self._advance()
+        if self._current_char() in successors: self._advance()
+        self._tokens.append(Ident(self._src[start:self._pos]))
+
+    def _advance(self): self._pos += 1
+
+    def _current_char(self):
+        if self._pos < len(self._src):
+            return self._src[self._pos]
+        else:
+            return "$EOF"
+
+
+def read(path):
+    with open(path, "r") as f: return f.read()
+
+def repeat_to(src, size):
+    return (src + "\n") * (size // (len(src) + 1) + 1)
+
+def best_of(f, n=3):
+    best = None
+    for _ in range(n):
+        t0 = time.perf_counter(); f(); t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best
+
+def report(label, base_time, new_time, unit=""):
+    print(f"{label:24} {base_time * 1000:9.2f}ms {new_time * 1000:9.2f}ms "
+          f"{base_time / new_time:6.2f}x {unit}")
+
+
+def bench_scanner():
+    sources = {
+        "toil.toil": read("toil.toil"),
+        "1MB toil.toil": repeat_to(read("toil.toil"), 1 << 20),
+        "1MB arithmetic": repeat_to("a_1 := (b + 23) * c_4 - d / 5 % 67 <= x;", 1 << 20),
+        "1MB strings": repeat_to(r"""s := "a\"b\nc" + 'raw # text'; # note""", 1 << 20),
+    }
+    print(f"{'source':24} {'char loop':>11} {'regex':>11} {'speedup':>7}")
+    for label, src in sources.items():
+        assert CharScanner(src).tokenize() == Scanner(src).tokenize()
+        report(label,
+               best_of(lambda: CharScanner(src).tokenize()),
+               best_of(lambda: Scanner(src).tokenize()))
+
+def peak_memory(f):
+    tracemalloc.start()
+    try:
+        f(); return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_stream():
+    toil = Interpreter().init_env().stdlib()
+    print(f"{'source':24} {'list':>11} {'stream':>11} {'ratio':>7}")
+    for n in (1000, 5000, 20000):
+        with tempfile.NamedTemporaryFile("w", suffix=".toil") as f:
+            for i in range(n): f.write(f"a_{i} := [{i}, 'item {i}', b * {i} + c];\n")
+            f.write("None\n"); f.flush()
+            with open(f.name) as g: interned = toil.scan(g.read())
+
+            def tokens_list():
+                with open(f.name) as g: len(toil.scan(g.read()))
+            def tokens_stream():
+                with open(f.name) as g: sum(1 for _ in toil.stream(g))
+            def parse_list():
+                with open(f.name) as g: toil.parse(toil.scan(g.read()))
+            def parse_stream():
+                with open(f.name) as g: toil.parse(toil.stream(g))
+
+            for label, base, new in (("tokens", tokens_list, tokens_stream),
+                                     ("parse", parse_list, parse_stream)):
+                base_peak, new_peak = peak_memory(base), peak_memory(new)
+                print(f"{label + ' ' + str(n) + ' lines':24} {base_peak / 1024:9.0f}KB "
+                      f"{new_peak / 1024:9.0f}KB {base_peak / new_peak:6.2f}x")
+
+class PlainIdent:
+    __match_args__ = ("name",)
+
+    def __init__(self, name): self.name = name
+    def __hash__(self): return hash(self.name)
+    def __eq__(self, other):
+        return isinstance(other, PlainIdent) and self.name == other.name
+
+def bench_ident():
+    toil = Interpreter().init_env().stdlib()
+    tokens = toil.scan(read("toil.toil"))
+    names = [str(t) for t in tokens if type(t) is Ident] * 10
+
+    def per_token_memory(cls):
+        tracemalloc.start()
+        idents = [cls(name) for name in names]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size / len(idents)
+
+    plain = {PlainIdent(name): None for name in names}
+    interned = {Ident(name): None for name in names}
+    plain_idents = [PlainIdent(name) for name in names]
+    interned_idents = [Ident(name) for name in names]
+    semicolon = Ident(";")
+
+    print(f"{len(names)} identifier tokens from toil.toil")
+    print(f"{'':24} {'plain':>11} {'interned':>11} {'speedup':>7}")
+    report("construct", best_of(lambda: [PlainIdent(n) for n in names]),
+           best_of(lambda: [Ident(n) for n in names]))
+    report("dict lookup", best_of(lambda: [plain[i] for i in plain_idents]),
+           best_of(lambda: [interned[i] for i in interned_idents]))
+    report("compare with ;", best_of(lambda: [i == PlainIdent(";") for i in plain_idents]),
+           best_of(lambda: [i is semicolon for i in interned_idents]))
+    print(f"{'bytes per token':24} {per_token_memory(PlainIdent):9.1f}B  "
+          f"{per_token_memory(Ident):9.1f}B")
+
+    toil.walk("def fib(n) do if n < 2 then n else fib(n - 1) + fib(n - 2) end end")
+    print(f"{'parse toil.toil':24} {best_of(lambda: toil.parse(tokens)) * 1000:9.2f}ms")
+    print(f"{'walk fib(15)':24} {best_of(lambda: toil.walk('fib(15)')) * 1000:9.2f}ms")
+    print(f"{'run fib(15)':24} {best_of(lambda: toil.run('fib(15)')) * 1000:9.2f}ms")
+
+def bench_columns():
+    toil = Interpreter().init_env().stdlib()
+    sources = {
+        "toil.toil": read("toil.toil"),
+        "1MB toil.toil": repeat_to(read("toil.toil"), 1 << 20),
+        "1MB literals": repeat_to(r"""push(a, [12345, "string", 'raw', x]);""", 1 << 20),
+        "1MB escaped strings": repeat_to(r"""push(a, [12345, "str\"ing", 'raw', x]);""", 1 << 20),
+    }
+    print(f"{'bytes per token':24} {'list':>11} {'columns':>11} {'ratio':>7}")
+    for label, src in sources.items():
+        tracemalloc.start()
+        tokens = toil.scan(src); list_size = tracemalloc.get_traced_memory()[0]
+        del tokens; tracemalloc.stop(); tracemalloc.start()
+        buffer = toil.scan_columns(src); buffer_size = tracemalloc.get_traced_memory()[0]
+        del buffer; tracemalloc.stop()
+        n = len(toil.scan(src))
+        print(f"{label:24} {list_size / n:10.1f}B {buffer_size / n:10.1f}B "
+              f"{list_size / buffer_size:6.2f}x")
+
+    src = sources["toil.toil"]
+    tokens, buffer = toil.scan(src), toil.scan_columns(src)
+    report("scan toil.toil", best_of(lambda: toil.scan(src)),
+           best_of(lambda: toil.scan_columns(src)))
+    report("parse toil.toil", best_of(lambda: toil.parse(tokens)),
+           best_of(lambda: toil.parse(buffer)))
+
+class RecursiveParser(Parser):
+    def parse(self):
+        expr = self._expression()
+        assert self._current_token() is self._eof, \
+            f"Extra token @ parse(): {self._current_token()}"
+        return expr
+
+    def _expression(self):
+        exprs = [self._binary(1)]
+        while self._current_token() is self._semicolon:
+            self._current_and_advance()
+            exprs.append(self._binary(1))
+        return exprs[0] if len(exprs) == 1 else (Ident("seq"), exprs)
+
+    def _binary(self, min_level):
+        if (prefix := self._prefix_ops.get(self._current_token())) and \
+                prefix[0] >= min_level:
+            self._current_and_advance()
+            left = (prefix[1], [self._binary(prefix[0])])
+        else:
+            left = self._call_index_dot()
+        while (binary := self._binary_ops.get(self._current_token())) and \
+                binary[0] >= min_level:
+            level, right_level, op = binary
+            self._current_and_advance()
+            right = self._binary(right_level)
+            if op is self._func:
+                left = (op, [left if isinstance(left, list) else [left], right])
+            else:
+                left = (op, [left, right])
+        return left
+
+    def _call_index_dot(self):
+        target = self._primary()
+        while (op := self._current_token()) in self._postfix_ops:
+            self._current_and_advance()
+            match op:
+                case Ident("("):
+                    target = (target, self._comma_separated_exprs(Ident(")")))
+                    self._consume(Ident(")"))
+                case Ident("["):
+                    index = self._expression()
+                    self._consume(Ident("]"))
+                    target = (Ident("index"), [target, index])
+                case Ident("."):
+                    attr_name = self._current_and_advance()
+                    assert type(attr_name) is Ident, \
+                        f"Invalid attribute @ _call_index_dot(): {self._current_token()}"
+                    target = (Ident("dot"), [target, str(attr_name)])
+        return target
+
+    def _primary(self):
+        match self._current_token():
+            case None | bool() | int() | str(): return self._current_and_advance()
+            case Ident("("): return self._group()
+            case Ident("["): return self._list()
+            case Ident("{"): return self._dict()
+            case Ident("syntax"): return self._syntax()
+            case Ident() as keyword  if keyword in self._syntax_rules:
+                return self._syntax_rules[keyword](self)
+            case Ident(name) if is_ident(name): return self._current_and_advance()
+            case unexpected:
+                assert False, f"Unexpected token @ _primary(): {unexpected}"
+
+    def _group(self):
+        self._current_and_advance()
+        expr = self._expression()
+        self._consume(Ident(")"))
+        return expr
+
+    def _list(self):
+        self._current_and_advance()
+        exprs = self._comma_separated_exprs(Ident("]"))
+        self._consume(Ident("]"))
+        return exprs
+
+    def _dict(self):
+        def _parse_key_value(dic):
+            match self._current_token():
+                case Ident("*"):
+                    self._current_and_advance()
+                    dic["*"] = self._current_and_advance()
+                case Ident(key):
+                    self._current_and_advance()
+                    if self._current_token() == Ident(":"):
+                        self._current_and_advance()
+                        dic[key] = self._expression()
+                    else:
+                        dic[key] = Ident(key)
+                case str():
+                    key = self._current_and_advance()
+                    self._consume(Ident(":"))
+                    dic[key] = self._expression()
+                case invalid:
+                    assert False, f"Invalid key @ _dict(): {invalid}"
+
+        self._current_and_advance()
+        dic = {}
+        if self._current_token() != Ident("}"):
+            _parse_key_value(dic)
+            while self._current_token() != Ident("}"):
+                self._consume(Ident(","))
+                _parse_key_value(dic)
+        self._current_and_advance()
+        return dic
+
+    def _syntax(self):
+        self._current_and_advance()
+        syntax = self._comma_separated_exprs(Ident("call"))
+        keyword, *form = syntax
+        assert isinstance(keyword, Ident), f"Invalid keyword @ _syntax(): {keyword}"
+        self._consume(Ident("call"))
+        op = self._expression()
+        assert isinstance(op, Ident), f"Invalid operator @ _syntax(): {op}"
+        self._consume(Ident("end"))
+        self._syntax_rules[keyword] = self._compile_syntax(op, form)
+        return None
+
+    def _compile_syntax(self, operator, form):
+        match_args = self._compile_form(form)
+        def apply_syntax(parser):
+            parser._current_and_advance()
+            return (operator, match_args(parser))
+        return apply_syntax
+
+    def _compile_form(self, form):
+        steps = [self._compile_element(current, next)
+                 for current, next in zip(form, form[1:] + [None])]
+        def match_args(parser):
+            args = []
+            for step in steps: step(parser, args)
+            return args
+        return match_args
+
+    def _compile_element(self, element, next):
+        match element:
+            case Ident("EXPR"):
+                return lambda parser, args: args.append(parser._expression())
+            case Ident("EXPRS"):
+                return lambda parser, args: \
+                    args.append(parser._comma_separated_exprs(next))
+            case (Ident("*"), [subform]):
+                first, match_subform = subform[0], self._compile_form(subform)
+                def repeat(parser, args):
+                    subargs = []
+                    while parser._current_token() is first:
+                        subargs.append(match_subform(parser))
+                    args.append(subargs)
+                return repeat
+            case (Ident("+"), [subform]):
+                first, match_subform = subform[0], self._compile_form(subform)
+                return lambda parser, args: args.append(
+                    match_subform(parser) if parser._current_token() is first else [])
+            case delimiter:
+                return lambda parser, args: parser._consume(delimiter)
+
+    def _comma_separated_exprs(self, terminator):
+        cse = []
+        if self._current_token() != terminator:
+            cse.append(self._expression())
+            while self._current_token() is self._comma:
+                self._current_and_advance()
+                cse.append(self._expression())
+        return cse
+
+class ChainParser(RecursiveParser):
+    def _expression(self): return self._sequence()
+
+    def _sequence(self):
+        exprs = [self._define_assign()]
+        while self._current_token() == Ident(";"):
+            self._current_and_advance()
+            exprs.append(self._define_assign())
+        return exprs[0] if len(exprs) == 1 else (Ident("seq"), exprs)
+
+    def _define_assign(self):
+        return self._binary_right({
+            Ident(":="): Ident("define"), Ident("="): Ident("assign")
+        }, self._arrow)
+
+    def _arrow(self):
+        left = self._and_or()
+        if self._current_token() == Ident("->"):
+            self._current_and_advance()
+            body_expr = self._arrow()
+            params = left if isinstance(left, list) else [left]
+            return (Ident("func"), [params, body_expr])
+        return left
+
+    def _and_or(self):
+        return self._binary_left({
+            Ident("and"): Ident("and"), Ident("or"): Ident("or"),
+        }, self._not)
+
+    def _not(self):
+        return self._unary({ Ident("not"): Ident("not") }, self._comparison)
+
+    def _comparison(self):
+        return self._binary_left({
+            Ident("=="): Ident("equal"), Ident("!="): Ident("not_equal"),
+            Ident("<"): Ident("less"), Ident(">"): Ident("greater"),
+            Ident("<="): Ident("less_equal"), Ident(">="): Ident("greater_equal"),
+            Ident("|"): Ident("|")
+        }, self._add_sub)
+
+    def _add_sub(self):
+        return self._binary_left({
+            Ident("+"): Ident("add"), Ident("-"): Ident("sub")
+        }, self._mul_div_mod)
+
+    def _mul_div_mod(self):
+        return self._binary_left({
+            Ident("*"): Ident("mul"), Ident("/"): Ident("div"), Ident("%"): Ident("mod")
+        }, self._unaries)
+
+    def _unaries(self):
+        return self._unary({
+            Ident("-"): Ident("neg"), Ident("+"): Ident("+"), Ident("*"): Ident("*"),
+            Ident("!"): Ident("!"), Ident("!!"): Ident("!!")
+        }, self._call_index_dot)
+
+    def _binary_left(self, ops, sub_elem):
+        left = sub_elem()
+        while type(op := self._current_token()) is Ident and op in ops:
+            self._current_and_advance()
+            right = sub_elem()
+            left = (ops[op], [left, right])
+        return left
+
+    def _binary_right(self, ops, sub_elem):
+        left = sub_elem()
+        if type(self._current_token()) is Ident and \
+                (op := self._current_token()) in ops:
+            self._current_and_advance()
+            right = self._binary_right(ops, sub_elem)
+            return (ops[op], [left, right])
+        return left
+
+    def _unary(self, ops, sub_elem):
+        if type(self._current_token()) is Ident and \
+                (op := self._current_token()) in ops:
+            self._current_and_advance()
+            return (ops[op], [self._unary(ops, sub_elem)])
+        else:
+            return sub_elem()
+
+def total_calls(f):
+    profiler = cProfile.Profile()
+    profiler.runcall(f)
+    return pstats.Stats(profiler).total_calls
+
+def bench_parser():
+    toil = Interpreter().init_env().stdlib()
+    rules = {}
+    RecursiveParser(toil.scan(CORE_SYNTAX), rules).parse()
+    deep = "a"
+    for i in range(200): deep = f"({deep} + {i}) * {i} - x{i}"
+    sources = {
+        "toil.toil": read("toil.toil"),
+        "deep arithmetic": deep,
+        "flat arithmetic": " + ".join(f"a * {i} - b / {i}" for i in range(200)),
+        "unary and logic": "; ".join(f"x := not -a{i} == b or c and -d" for i in range(2000)),
+    }
+    print(f"{'':24} {'chain':>11} {'climbing':>11} {'speedup':>7}")
+    for label, src in sources.items():
+        tokens = toil.scan(src)
+        chain = lambda: ChainParser(tokens, dict(rules)).parse()
+        climbing = lambda: Parser(tokens, dict(toil._syntax_rules)).parse()
+        assert chain() == climbing()
+        report(label, best_of(chain), best_of(climbing))
+        chain_calls, climbing_calls = total_calls(chain), total_calls(climbing)
+        print(f"{'  calls per token':24} {chain_calls / len(tokens):10.1f}  "
+              f"{climbing_calls / len(tokens):10.1f}  "
+              f"{chain_calls / climbing_calls:6.2f}x")
+
+class InterpretingParser(RecursiveParser):
+    def _primary(self):
+        if (keyword := self._current_token()) in self._syntax_rules:
+            return self._apply_syntax(self._syntax_rules[keyword])
+        return super()._primary()
+
+    def _syntax(self):
+        self._current_and_advance()
+        keyword, *form = self._comma_separated_exprs(Ident("call"))
+        self._consume(Ident("call"))
+        op = self._expression()
+        self._consume(Ident("end"))
+        self._syntax_rules[keyword] = (op, form)
+
+    def _apply_syntax(self, rule):
+        def match_args(form):
+            args = []
+            for current, next in zip(form, form[1:] + [None]):
+                match current:
+                    case Ident("EXPR"):
+                        args.append(self._expression())
+                    case Ident("EXPRS"):
+                        args.append(self._comma_separated_exprs(next))
+                    case (Ident("*"), [subform]):
+                        subargs = []
+                        while self._current_token() == subform[0]:
+                            subargs.append(match_args(subform))
+                        args.append(subargs)
+                    case (Ident("+"), [subform]):
+                        if self._current_token() == subform[0]:
+                            args.append(match_args(subform))
+                        else:
+                            args.append([])
+                    case delimiter:
+                        self._consume(delimiter)
+            return args
+
+        self._current_and_advance()
+        operator, form = rule
+        return (operator, match_args(form))
+
+CORE_SYNTAX = r"""
+    syntax quote, EXPR, end call quote end;
+    syntax func, EXPRS, do, EXPR, end call func end;
+    syntax macro, EXPRS, do, EXPR, end call macro end;
+    syntax scope, EXPR, end call scope end;
+    syntax match, EXPR, *[case, EXPR, then, EXPR], end call match end;
+    syntax while, EXPR, do, EXPR, +[then, EXPR], +[else, EXPR], end call while end;
+    syntax try, EXPR, *[except, EXPR, then, EXPR], end call try end;
+    syntax defmacro, EXPR, do, EXPR, end call defmacro_ end;
+    syntax def, EXPR, do, EXPR, end call def_ end;
+    syntax if, EXPR, then, EXPR, *[elif, EXPR, then, EXPR], +[else, EXPR], end call if_ end;
+    syntax for, EXPR, in, EXPR, do, EXPR, +[then, EXPR], +[else, EXPR], end call for_ end;
+    syntax assert, EXPR, else, EXPR, end call assert_ end;
+    syntax defclass, EXPR, +[inherits, EXPR], do, EXPR, end call defclass_ end;
+    syntax defmethod, EXPR, do, EXPR, end call defmethod_ end
+"""
+
+def bench_syntax():
+    toil = Interpreter()
+    core = toil.scan(CORE_SYNTAX)
+    rules, compiled_rules = {}, {}
+    InterpretingParser(core, rules).parse(); Parser(core, compiled_rules).parse()
+    macro_heavy = "; ".join(
+        f"def f{i}(a) do if a then for x in a do match x case 2 then x end end "
+        f"elif a == {i} then while a do a = a - 1 then a else 0 end "
+        f"else try a except e then e end end end" for i in range(300))
+    sources = {"toil.toil": read("toil.toil"), "macro heavy": macro_heavy}
+    print(f"{'':24} {'interpret':>11} {'compiled':>11} {'speedup':>7}")
+    for label, src in sources.items():
+        tokens = toil.scan(src)
+        interpret = lambda: InterpretingParser(tokens, dict(rules)).parse()
+        compiled = lambda: Parser(tokens, dict(compiled_rules)).parse()
+        assert interpret() == compiled()
+        report(label, best_of(interpret, 10), best_of(compiled, 10))
+
+class RecursiveExpander(Expander):
+    def expand(self, expr, env):
+        # print(expr)
+        match expr:
+            case None | bool() | int() | str() | Ident(): return expr
+            case list() as exprs:
+                return [self.expand(expr, env) for expr in exprs]
+            case dict() as exprs:
+                return {key: self.expand(val, env) for key, val in exprs.items()}
+            case (Ident("quote"), [expr]):
+                return self._quote(expr, env)
+            case (Ident("macro"), [params, body_expr]):
+                return (Ident("macro"), [params, self.expand(body_expr, env)])
+            case (Ident("func"), [params, body_expr]):
+                return (Ident("func"), [params, self.expand(body_expr, Environment(env))])
+            case (Ident("define"), [pat, expr]):
+                return self._define(pat, expr, env)
+            case (Ident("assign"), [pat, expr]):
+                return (Ident("assign"), [pat, self.expand(expr, env)])
+            case (Ident("scope"), [body_expr]):
+                return (Ident("scope"), [self.expand(body_expr, Environment(env))])
+            case (Ident("match"), [val_expr, cases]):
+                return self._match(val_expr, cases, env)
+            case (Ident("try"), [body_expr, clauses]):
+                return self._try(body_expr, clauses, env)
+            case (Ident("dot"), [target_expr, attr_name]):
+                return (Ident("dot"), [self.expand(target_expr, env), attr_name])
+            case (op_expr, args_expr):
+                return self._op(op_expr, args_expr, env)
+            case unexpected:
+                assert False, f"Unexpected expression @ expand(): {unexpected}"
+
+    def _quote(self, expr, env):
+        match expr:
+            case list() as exprs:
+                res = []
+                for e in exprs:
+                    match e:
+                        case (Ident("!!"), [unq]) if isinstance(e, tuple):
+                            res = (Ident("add"), [res, self.expand(unq, env)])
+                        case _:
+                            res = (Ident("add"), [res, [self._quote(e, env)]])
+                return res
+            case dict() as exprs:
+                return {key: self._quote(val, env) for key, val in exprs.items()}
+            case Ident(name):
+                return (Ident("Ident"), [name])
+            case (Ident("!"), [unquote_expr]):
+                return self.expand(unquote_expr, env)
+            case (op, args):
+                return (Ident("tuple"), [self._quote(op, env), self._quote(args, env)])
+            case _:
+                return expr
+
+    def _define(self, pat, expr, env):
+        expanded = self.expand(expr, env)
+        match expanded:
+            case (Ident("macro"), [params, body_expr]):
+                env.define(str(pat), (Ident("macro"), [params, body_expr]))
+                return None
+            case _:
+                return (Ident("define"), [pat, expanded])
+
+    def _match(self, val_expr, cases, env):
+        return (Ident("match"), [
+            self.expand(val_expr, env),
+            [(pat, self.expand(body_expr, env)) for pat, body_expr in cases]
+        ])
+
+    def _try(self, body_expr, clauses, env):
+        return (Ident("try"), [
+            self.expand(body_expr, env),
+            [(pat, self.expand(expr, env)) for pat, expr in clauses]
+        ])
+
+    def _op(self, op_expr, args_expr, env):
+        op_expanded = self.expand(op_expr, env)
+
+        target_node = op_expanded
+        match op_expanded:
+            case Ident(name):
+                if (vars := env.lookup(name)) is not None:
+                    target_node = vars[name]
+                elif (macro := self._macros.lookup(name)) is not None:
+                    target_node = macro
+
+        match target_node:
+            case (Ident("macro"), [params, body_expr, *_]):
+                new_env = Environment(env)
+                if new_env.bind(params, args_expr):
+                    expanded_ast = Evaluator().eval(body_expr, new_env)
+                    return self.expand(expanded_ast, env)
+                else:
+                    assert False, f"Pattern mismatch @ apply(): {params}, {args_expr}"
+            case _:
+                args_expanded = [self.expand(expr, env) for expr in args_expr]
+                return (op_expanded, args_expanded)
+
+class AddChainExpander(Expander):
+    def _quote_root(self, expr, env):
+        return self._quote(expr, env)
+
+    def _quote(self, expr, env):
+        match expr:
+            case list() as exprs: return self._quote_list(exprs, env)
+            case dict() as exprs: return self._quote_dict(exprs, env)
+            case Ident(name): return (Ident("Ident"), [name])
+            case (Ident("!"), [unquote_expr]): return self._expand(unquote_expr, env)
+            case (op, args): return self._quote_tuple(op, args, env)
+            case _: return expr
+
+    def _quote_list(self, exprs, env):
+        res = []
+        for e in exprs:
+            match e:
+                case (Ident("!!"), [unq]) if isinstance(e, tuple):
+                    res = (Ident("add"), [res, (yield self._expand(unq, env))])
+                case _:
+                    res = (Ident("add"), [res, [(yield self._quote(e, env))]])
+        return res
+
+    def _quote_dict(self, exprs, env):
+        dic = {}
+        for key, val in exprs.items(): dic[key] = yield self._quote(val, env)
+        return dic
+
+    def _quote_tuple(self, op, args, env):
+        return (Ident("tuple"), [(yield self._quote(op, env)), (yield self._quote(args, env))])
+
+class ChainLookupExpander(Expander):
+    def _expand_scoped(self, op, args, expr, env):
+        return self._expand_last(op, args, expr, Environment(env))
+
+    def _define(self, pat, expr, env):
+        expanded = yield self._expand(expr, env)
+        match expanded:
+            case (Ident("macro"), [params, body_expr]):
+                env.define(str(pat), (Ident("macro"), [params, to_node(body_expr), None]))
+                return None
+            case _:
+                return (Ident("define"), [pat, expanded])
+
+    def _op(self, op_expr, args_expr, env):
+        op_expanded = yield self._expand(op_expr, env)
+
+        target_node = op_expanded
+        match op_expanded:
+            case Ident(name):
+                if (vars := env.lookup(name)) is not None:
+                    target_node = vars[name]
+
+        match target_node:
+            case (Ident("macro"), _):
+                expanded_ast = yield self._apply_macro(target_node, args_expr, env)
+                return (yield self._expand(expanded_ast, env))
+            case _:
+                return (op_expanded, (yield self._expand_all(args_expr, env)))
+
+class RecursiveCompiler:
+    def __init__(self, expr):
+        self._expr = expr
+        self._code = []
+        self._control_stack = []
+
+    def compile(self):
+        self._expression(self._expr)
+        self._code.append(("ret",))
+        assert self._control_stack == [], \
+            f"Invalid control stack state @ compile(): {self._control_stack}"
+        return self._code
+
+    def _expression(self, expr):
+        match expr:
+            case None | bool() | int() | str(): self._code.append(("const", expr))
+            case list() as lst: self._list(lst)
+            case dict() as dic: self._dict(dic)
+            case Ident("continue"): self._continue()
+            case Ident("break"): self._break()
+            case Ident(name): self._code.append(("get", name))
+            case (Ident("func"), [params, body_expr]): self._func(params, body_expr)
+            case (Ident("return"), args): self._return(args)
+            case (Ident("define"), [pat, expr]):
+                self._expression(expr)
+                self._code.append(("def", pat))
+            case (Ident("assign"), [left_expr, right_expr]):
+                self._assign(left_expr, right_expr)
+            case (Ident("scope"), [body_expr]): self._scope(body_expr)
+            case (Ident('seq'), exprs): self._seq(exprs)
+            case (Ident('if'), [cond_expr, then_expr, else_expr]):
+                self._if(cond_expr, then_expr, else_expr)
+            case (Ident("while"), [cond_expr, body_expr, then_expr, else_expr]):
+                self._while(cond_expr, body_expr, then_expr, else_expr)
+            case (Ident("match"), [val_expr, cases]):
+                self._match(val_expr, cases)
+            case (Ident("try"), [body_expr, clauses]):
+                self._try(body_expr, clauses)
+            case (Ident("raise"), args):
+                self._raise(args)
+            case (Ident("dot"), [target_expr, attr_name]):
+                self._dot(target_expr, attr_name)
+            case (op_expr, args_expr) if isinstance(expr, tuple):
+                self._op(op_expr, args_expr)
+            case _: assert False, f"Unsupported expression @ compile(): {expr}"
+
+    def _list(self, lst):
+        for elem in lst: self._expression(elem)
+        self._code.append(("get", "list"))
+        self._code.append(("call", len(lst)))
+
+    def _dict(self, dic):
+        for key, val in dic.items(): self._list([key, val])
+        self._code.append(("get", "dict"))
+        self._code.append(("call", len(dic)))
+
+    def _func(self, params, body_expr):
+        body_code = RecursiveCompiler(body_expr).compile()
+        self._code.append(("make_closure", params, body_expr, body_code))
+
+    def _return(self, args):
+        if args: self._expression(args[0])
+        else: self._code.append(("const", None))
+        self._code.append(("ret",))
+
+    def _assign(self, left_expr, right_expr):
+        match left_expr:
+            case Ident(name):
+                self._expression(right_expr)
+                self._code.append(("set", name))
+            case (Ident("index"), [coll_expr, index_expr]):
+                self._expression(coll_expr)
+                self._expression(index_expr)
+                self._expression(right_expr)
+                self._code.append(("set_index",))
+            case (Ident("dot"), [coll_expr, attr_name]):
+                self._expression(coll_expr)
+                self._code.append(("const", attr_name))
+                self._expression(right_expr)
+                self._code.append(("set_index",))
+            case unexpected:
+                assert False, f"Invalid assign target @ compile(): {unexpected}"
+
+    def _scope(self, body_expr):
+        self._control_stack.append(("scope",))
+        self._code.append(("enter_scope",))
+        self._expression(body_expr)
+        self._code.append(("leave_scope",))
+        self._control_stack.pop()
+
+    def _seq(self, exprs):
+        assert len(exprs) > 0, f"Empty sequence @ compile(): {exprs}"
+        for expr in exprs[:-1]:
+            self._expression(expr)
+            self._code.append(("pop",))
+        self._expression(exprs[-1])
+
+    def _if(self, cond_expr, then_expr, else_expr):
+        self._expression(cond_expr)
+        else_jump = self._current_addr()
+        self._code.append(("jump_if_false", None))
+        self._expression(then_expr)
+        end_jump = self._current_addr()
+        self._code.append(("jump", None))
+        self._set_operand(else_jump, self._current_addr())
+        self._expression(else_expr)
+        self._set_operand(end_jump, self._current_addr())
+
+    def _while(self, cond_expr, body_expr, then_expr, else_expr):
+        loop_jump = self._current_addr()
+        break_addrs = []
+        self._control_stack.append(("while", loop_jump, break_addrs))
+        self._expression(cond_expr)
+        cond_jump = self._current_addr()
+        self._code.append(("jump_if_false", None))
+        self._expression(body_expr)
+        self._code.append(("pop",))
+        self._code.append(("jump", loop_jump))
+        self._set_operand(cond_jump, self._current_addr())
+
+        self._control_stack.pop()
+        self._expression(then_expr[0] if then_expr else None)
+        then_jump = self._current_addr()
+        self._code.append(("jump", None))
+        for break_addr in break_addrs:
+            self._set_operand(break_addr, self._current_addr())
+        self._expression(else_expr[0] if else_expr else None)
+        self._set_operand(then_jump, self._current_addr())
+
+    def _match(self, val_expr, cases):
+        self._expression(val_expr)
+        end_jumps = []
+        for pat, body_expr in cases:
+            self._code.append(("match", pat))
+            next_case_jump = self._current_addr()
+            self._code.append(("jump_if_false", None))
+
+            self._code.append(("pop",))
+            self._expression(body_expr)
+            end_jumps.append(self._current_addr())
+            self._code.append(("jump", None))
+
+            self._set_operand(next_case_jump, self._current_addr())
+
+        self._code.append(("pop",))
+        self._code.append(("const", None))
+        for jmp in end_jumps:
+            self._set_operand(jmp, self._current_addr())
+
+    def _try(self, body_expr, clauses):
+        handler_jump = self._current_addr()
+        self._code.append(("enter_try", None))
+        self._control_stack.append(("try",))
+        self._expression(body_expr)
+        self._control_stack.pop()
+        self._code.append(("leave_try",))
+
+        end_jump = self._current_addr()
+        self._code.append(("jump", None))
+
+        self._set_operand(handler_jump, self._current_addr())
+        clause_end_jumps = []
+        for pat, expr in clauses:
+            self._code.append(("match", pat))
+            next_clause_jump = self._current_addr()
+            self._code.append(("jump_if_false", None))
+
+            self._code.append(("pop",))
+            self._expression(expr)
+            clause_end_jumps.append(self._current_addr())
+            self._code.append(("jump", None))
+
+            self._set_operand(next_clause_jump, self._current_addr())
+
+        self._code.append(("raise",))
+
+        for jmp in clause_end_jumps:
+            self._set_operand(jmp, self._current_addr())
+        self._set_operand(end_jump, self._current_addr())
+
+    def _raise(self, args):
+        if args: self._expression(args[0])
+        else: self._code.append(("const", None))
+        self._code.append(("raise",))
+
+    def _dot(self, target_expr, attr_name):
+        self._expression(target_expr)
+        self._code.append(("dot", attr_name))
+
+    def _op(self, op, args):
+        for arg in args: self._expression(arg)
+        self._expression(op)
+        self._code.append(("call", len(args)))
+
+    def _continue(self):
+        for ctrl in reversed(self._control_stack):
+            match ctrl:
+                case ("scope",):
+                    self._code.append(("leave_scope",))
+                case ("try",):
+                    self._code.append(("leave_try",))
+                case ("while", loop_jump, _):
+                    self._code.append(("jump", loop_jump))
+                    return
+        assert False, "Continue outside of loop @ _continue()"
+
+    def _break(self):
+        for ctrl in reversed(self._control_stack):
+            match ctrl:
+                case ("scope",):
+                    self._code.append(("leave_scope",))
+                case ("try",):
+                    self._code.append(("leave_try",))
+                case ("while", _, break_addrs):
+                    break_addrs.append(self._current_addr())
+                    self._code.append(("jump", None))
+                    return
+        assert False, "Break outside of loop @ _break()"
+
+    def _set_operand(self, ip, operand):
+        inst = self._code[ip]
+        self._code[ip] = (inst[0], operand)
+
+    def _current_addr(self):
+        return len(self._code)
+
+def depth(expr):
+    n = 0
+    while isinstance(expr, list) and expr: expr, n = expr[0], n + 1
+    return n
+
+def closures(code):
+    return [(repr(inst[1]), repr(inst[2]), closures(inst[3])) for inst in code if inst[0] == "make_closure"]
+
+def bench_frontend():
+    toil = Interpreter().init_env().stdlib()
+    rules = {}
+    RecursiveParser(toil.scan(CORE_SYNTAX), rules).parse()
+    sources = {
+        "toil.toil": read("toil.toil"),
+        "macro heavy": "; ".join(
+            f"def f{i}(a) do if a then for x in a do match x case 2 then x end end "
+            f"elif a == {i} then while a do a = a - 1 then a else 0 end "
+            f"else try a except e then e end end end" for i in range(300)),
+    }
+    print(f"{'':24} {'recursive':>11} {'trampoline':>11} {'speedup':>7}")
+    for label, src in sources.items():
+        tokens = toil.scan(src)
+        ast = RecursiveParser(tokens, dict(rules)).parse()
+        assert ast == Parser(tokens, dict(toil._syntax_rules)).parse()
+        report(label + " parse",
+               best_of(lambda: RecursiveParser(tokens, dict(rules)).parse()),
+               best_of(lambda: Parser(tokens, dict(toil._syntax_rules)).parse()))
+        toil._gensym_counter = 0
+        expanded = RecursiveExpander(MacroTable(toil._macros)).expand(ast, Environment(toil._env))
+        toil._gensym_counter = 0
+        assert expanded == Expander(MacroTable(toil._macros)).expand(ast, Environment(toil._env))
+        report(label + " expand",
+               best_of(lambda: RecursiveExpander(MacroTable(toil._macros)).expand(ast, Environment(toil._env))),
+               best_of(lambda: Expander(MacroTable(toil._macros)).expand(ast, Environment(toil._env))))
+        assert closures(RecursiveCompiler(expanded).compile()) == closures(Compiler(expanded).compile())
+        report(label + " compile",
+               best_of(lambda: RecursiveCompiler(expanded).compile()),
+               best_of(lambda: Compiler(expanded).compile()))
+
+    sys.setrecursionlimit(1000)
+    print(f"{'nesting':24} {'recursive':>11} {'trampoline':>11}")
+    for n in (100, 1000, 10000, 100000):
+        src = "[" * n + "1" + "]" * n
+        try:
+            RecursiveCompiler(RecursiveExpander(MacroTable(toil._macros)).expand(
+                RecursiveParser(toil.scan(src), {}).parse(), toil._env)).compile()
+            recursive = "ok"
+        except RecursionError:
+            recursive = "RecursionError"
+        ast = toil.ast(src)
+        assert depth(ast) == n and toil.compile(ast)[-1] == ("ret",)
+        print(f"{str(n) + ' deep list':24} {recursive:>11} {'ok':>11}")
+    sys.setrecursionlimit(200000)
+
+def retained_memory(f):
+    tracemalloc.start()
+    try:
+        result = f(); return tracemalloc.get_traced_memory()[0], result
+    finally:
+        tracemalloc.stop()
+
+def count_nodes(node):
+    count, stack = 0, [node]
+    while stack:
+        node = stack.pop(); count += 1
+        for name in node.__slots__:
+            match getattr(node, name):
+                case Node() as child: children = [child]
+                case list() as children:
+                    children = [c[1] if isinstance(c, tuple) else c for c in children]
+                case dict() as children: children = children.values()
+                case _: children = []
+            stack.extend(c for c in children if isinstance(c, Node))
+    return count
+
+def bench_nodes():
+    toil = Interpreter().init_env().stdlib()
+    ast = toil.ast(read("toil.toil"))
+    tuple_size, _ = retained_memory(lambda: copy.deepcopy(ast))
+    node_size, nodes = retained_memory(lambda: to_node(copy.deepcopy(ast)))
+    n = count_nodes(nodes)
+    print(f"{'toil.toil':24} {'tuples':>11} {'nodes':>11} {'ratio':>7}")
+    print(f"{'  bytes per node':24} {tuple_size / n:10.1f}B {node_size / n:10.1f}B "
+          f"{tuple_size / node_size:6.2f}x  ({n} nodes)")
+    report("compile", best_of(lambda: RecursiveCompiler(ast).compile(), 10),
+           best_of(lambda: Compiler(nodes).compile(), 10))
+    report("to_node + compile", best_of(lambda: RecursiveCompiler(ast).compile(), 10),
+           best_of(lambda: Compiler(ast).compile(), 10))
+
+def bench_reload():
+    toil = Interpreter().init_env().stdlib()
+    large = "; ".join(
+        f"def f{i}(a) do if a then for x in a do x + {i} end else f{i}([a]) end end"
+        for i in range(2000)) + "; {f0, f1999}"
+    sources = {"toil.toil": read("toil.toil"), "2000 defs": large}
+    edits = {"toil.toil": ("c <= '9' end", "c <= '8' end"), "2000 defs": ("x + 1000 end", "x + 1 end")}
+    print(f"{'':24} {'full':>11} {'reload':>11} {'speedup':>7}")
+    for label, src in sources.items():
+        old, new = edits[label]
+        edited = src.replace(old, new, 1)
+        assert edited != src
+
+        def full():
+            Module(toil._syntax_rules, MacroTable(toil._macros), Environment(toil._env)).load(edited)
+        module = Module(toil._syntax_rules, MacroTable(toil._macros), Environment(toil._env))
+        module.load(src)
+        def reload():
+            module.load(edited); module.load(src)
+        report(label, best_of(full), best_of(reload, 10) / 2)
+        module.load(edited)
+        print(f"{'  forms reanalyzed':24} {len(module._forms):11} {len(module.analyzed):11}")
+
+def bench_modules():
+    toil = Interpreter().init_env().stdlib()
+    with tempfile.TemporaryDirectory() as dir:
+        paths = []
+        for i in range(8):
+            paths.append(f"{dir}/m{i}.toil")
+            with open(paths[-1], "w") as f: f.write(read("toil.toil"))
+        print(f"{'8 x toil.toil':24} {'serial':>11} {'parallel':>11} {'speedup':>7}")
+        report("compile", best_of(lambda: [toil.code(read(p)) for p in paths]),
+               best_of(lambda: toil.compile_modules(paths)), f"({os.cpu_count()} cores)")
+
+def bench_macros():
+    repeated = "; ".join(f"def f{i}(a, b) do if a and b then a or b elif b then "
+                         f"for x in a do x end else a end end" for i in range(500))
+    print(f"{'expand':24} {'plain':>11} {'memoized':>11} {'speedup':>7}")
+    for label, src in {"toil.toil": read("toil.toil"), "500 repeated idioms": repeated}.items():
+        toil = Interpreter(memoize_macros=True).init_env().stdlib()
+        ast = toil.parse(toil.scan(src))
+        stats = toil.macro_stats()
+        cold = best_of(lambda: toil.expand(ast), 1)
+        hits, misses = toil.macro_stats()["hits"] - stats["hits"], toil.macro_stats()["misses"] - stats["misses"]
+        report(label, best_of(lambda: Expander(toil._macros).expand(ast, toil._env), 10),
+               best_of(lambda: toil.expand(ast), 10), f"(cold {cold * 1000:.2f}ms, {hits} hits, {misses} misses)")
+
+def with_compiled_macros(f):
+    walked, Expander._eval_macro = Expander._eval_macro, Expander._run_macro
+    try: return f()
+    finally: Expander._eval_macro = walked
+
+def bench_macro_code():
+    src = read("toil.toil")
+    print(f"{'':24} {'walked':>11} {'compiled':>11} {'speedup':>7}")
+    init = lambda: Interpreter().init_env().stdlib()
+    report("init_env + stdlib", best_of(init, 20), with_compiled_macros(lambda: best_of(init, 20)))
+    toil = Interpreter().init_env().stdlib()
+    report("expand toil.toil", best_of(lambda: toil.ast(src), 20),
+           with_compiled_macros(lambda: best_of(lambda: toil.ast(src), 20)))
+    report("load toil.toil", best_of(lambda: toil.run(src), 20),
+           with_compiled_macros(lambda: best_of(lambda: toil.run(src), 20)))
+
+def bench_quote():
+    toil = Interpreter().init_env().stdlib()
+    print(f"{'':24} {'add chain':>11} {'segments':>11} {'speedup':>7}")
+    for n in [100, 1000, 5000]:
+        elems = ", ".join(f"!x, g(y, {i})" for i in range(n // 2))
+        build = toil.parse(toil.scan(f"def build(x) do quote [{elems}, !!x] end end"))
+        macro = toil.parse(toil.scan(f"defmacro big(x) do quote scope {elems.replace(', ', '; ')} end end end; big(1)"))
+        call = toil.compile(toil.ast("build([1, 2])"))
+        times = {}
+        for expander in [AddChainExpander(MacroTable(toil._macros)), Expander(MacroTable(toil._macros))]:
+            env = Environment(toil._env)
+            VM(Compiler(expander.expand(build, env)).compile(), env).execute()
+            times[type(expander)] = (best_of(lambda: VM(call, env).execute(), 5),
+                                     best_of(lambda: expander.expand(macro, Environment(toil._env)), 5))
+        old, new = times[AddChainExpander], times[Expander]
+        report(f"build {n} elements", old[0], new[0])
+        report(f"expand {n}-form macro", old[1], new[1])
+
+def bench_macro_table():
+    toil = Interpreter().init_env().stdlib()
+    corelib_env = toil._env._parent._parent
+    for name, macro in toil._macros._macros.items(): corelib_env.define(name, macro)
+    nested = "x := 1; " + "".join(f"def f{i}(x) do " + "add(x, 1); " * 20 for i in range(200)) + "x" + " end" * 200
+    sources = {"toil.toil": read("toil.toil"), "200 nested funcs": nested}
+    print(f"{'expand':24} {'env chain':>11} {'table':>11} {'speedup':>7}")
+    for label, src in sources.items():
+        ast = toil.parse(toil.scan(src))
+        toil._gensym_counter = 0
+        chained = ChainLookupExpander(MacroTable()).expand(ast, Environment(toil._env))
+        toil._gensym_counter = 0
+        assert chained == Expander(MacroTable(toil._macros)).expand(ast, Environment(toil._env))
+        report(label, best_of(lambda: ChainLookupExpander(MacroTable()).expand(ast, Environment(toil._env)), 20),
+               best_of(lambda: Expander(MacroTable(toil._macros)).expand(ast, Environment(toil._env)), 20))
+
+class RecordingInterpreter(Interpreter):
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.asts = []
+
+    def ast(self, src):
+        self.asts.append(super().ast(src))
+        return self.asts[-1]
+
+def ast_bytes(expr):
+    seen, stack, size = set(), [expr], 0
+    while stack:
+        expr = stack.pop()
+        if type(expr) not in (list, tuple, dict) or id(expr) in seen: continue
+        seen.add(id(expr)); size += sys.getsizeof(expr)
+        stack.extend(expr.values() if type(expr) is dict else expr)
+    return size
+
+def bench_hash_cons():
+    print(f"{'AST bytes':24} {'plain':>11} {'shared':>11} {'ratio':>7}")
+    plain = RecordingInterpreter().init_env().stdlib()
+    toil = RecordingInterpreter(hash_cons=True).init_env().stdlib()
+    print(f"{'corelib + stdlib':24} {ast_bytes(plain.asts) / 1024:9.1f}KB {ast_bytes(toil.asts) / 1024:9.1f}KB "
+          f"{ast_bytes(plain.asts) / ast_bytes(toil.asts):6.2f}x")
+    src = read("toil.toil")
+    plain_size, plain_ast = retained_memory(lambda: plain.ast(src))
+    shared_size, shared_ast = retained_memory(lambda: toil.ast(src))
+    print(f"{'toil.toil':24} {ast_bytes(plain_ast) / 1024:9.1f}KB {ast_bytes(shared_ast) / 1024:9.1f}KB "
+          f"{ast_bytes(plain_ast) / ast_bytes(shared_ast):6.2f}x")
+    print(f"{'  retained':24} {plain_size / 1024:9.1f}KB {shared_size / 1024:9.1f}KB "
+          f"{plain_size / shared_size:6.2f}x")
+    print(f"{'  peak':24} {peak_memory(lambda: plain.ast(src)) / 1024:9.1f}KB "
+          f"{peak_memory(lambda: toil.ast(src)) / 1024:9.1f}KB")
+    report("  scan + parse + expand", best_of(lambda: plain.ast(src), 10), best_of(lambda: toil.ast(src), 10))
+
+def bench_fold():
+    plain = Interpreter().init_env().stdlib()
+    toil = Interpreter(fold=True).init_env().stdlib()
+    loop = r"""
+        i := 0; s := 0;
+        while i < 20000 do
+            s = s + (60 * 60 * 24) % 7 + len([1, 2, 3]) * 2;
+            if 1 < 2 then i = i + 1 else i = i - 1 end
+        end;
+        s
+    """
+    print(f"{'fold':24} {'plain':>11} {'folded':>11} {'speedup':>7}")
+    assert plain.walk(loop) == toil.walk(loop) == plain.run(loop) == toil.run(loop)
+    report("constant loop walk", best_of(lambda: plain.walk(loop), 5), best_of(lambda: toil.walk(loop), 5))
+    report("constant loop run", best_of(lambda: plain.run(loop), 5), best_of(lambda: toil.run(loop), 5))
+    src = read("toil.toil")
+    report("toil.toil compile", best_of(lambda: plain.code(src), 10), best_of(lambda: toil.code(src), 10))
+
+def bench_specialize():
+    toil = Interpreter().init_env().stdlib()
+    toil.walk(r""" {Interpreter, Evaluator} := load('toil.toil'); tot := Interpreter().init_env().stdlib() """)
+    programs = {
+        "loop": "i := 0; s := 0; while i < 300 do s = s + i * i % 7; i = i + 1 end; s",
+        "loop calling a func": "def sq(x) do x * x end; i := 0; s := 0; while i < 300 do s = s + sq(i) % 7; i = i + 1 end; s",
+    }
+    print(f"{'specialize':24} {'tot':>11} {'residual':>11} {'speedup':>7}")
+    for label, program in programs.items():
+        toil.walk(f""" ast := tot.ast('{program}'); residual := specialize(Evaluator().eval, ast) """)
+        assert toil.walk(f""" tot.walk('{program}') """) == toil.walk(r""" residual(tot._env) """)
+        residual = best_of(lambda: toil.walk(r""" residual(tot._env) """), 5)
+        print(label)
+        report("  tot.walk(program)", best_of(lambda: toil.walk(f""" tot.walk('{program}') """), 5), residual)
+        report("  tot.eval(ast)", best_of(lambda: toil.walk(r""" tot.eval(ast) """), 5), residual)
+        specialize = best_of(lambda: toil.walk(r""" specialize(Evaluator().eval, ast) """), 5)
+        print(f"{'  specialize()':24} {specialize * 1000:9.2f}ms")
+
+def bench_engines():
+    toil = Interpreter().init_env().stdlib()
+    toil.walk(r""" {Interpreter} := load('toil.toil'); tot := Interpreter().init_env().stdlib() """)
+    programs = {
+        "fib(18)": "def fib(n) do if n < 2 then n else fib(n - 1) + fib(n - 2) end end; fib(18)",
+        "gcd x 2000": """
+            def gcd(a, b) do while b > 0 do tmp := b; b = a % b; a = tmp end; a end;
+            s := 0; for i in range(1, 2001, 1) do s = s + gcd(i * 7919, 104729) end; s
+        """,
+        "toil-on-toil fib(8)": """
+            tot.walk('def fib(n) do if n < 2 then n else fib(n - 1) + fib(n - 2) end end; fib(8)')
+        """,
+    }
+    print(f"{'engine':24} {'walk':>11} {'run':>11} {'cwalk':>11} {'vs walk':>7} {'vs run':>7}")
+    for label, src in programs.items():
+        assert toil.walk(src) == toil.run(src) == toil.cwalk(src)
+        walk, run, cwalk = (best_of(lambda: go(src), 3) for go in (toil.walk, toil.run, toil.cwalk))
+        print(f"{label:24} {walk * 1000:9.2f}ms {run * 1000:9.2f}ms {cwalk * 1000:9.2f}ms "
+              f"{walk / cwalk:6.2f}x {run / cwalk:6.2f}x")
+
+class RaisingEvaluator(Evaluator):
+    def _scope(self, node, env):
+        return self._eval(node.body, Environment(env))
+
+    def _seq(self, node, env):
+        val = None
+        for expr in node.exprs: val = self._eval(expr, env)
+        return val
+
+    def _if(self, node, env):
+        if self._eval(node.cond, env):
+            return self._eval(node.then, env)
+        else:
+            return self._eval(node.else_, env)
+
+    def _match(self, node, env):
+        val = self._eval(node.value, env)
+        for pattern, body_expr in node.cases:
+            if env.bind(pattern, val): return self._eval(body_expr, env)
+
+    def _while(self, node, env):
+        while self._eval(node.cond, env):
+            try: self._eval(node.body, env)
+            except ContinueException: continue
+            except BreakException: return self._eval_optional(node.else_, env)
+        return self._eval_optional(node.then, env)
+
+    exec = Evaluator.eval
+
+    _handlers = {
+        **Evaluator._handlers, Scope: _scope, Seq: _seq, If: _if, Match: _match, While: _while,
+    }
+
+def with_raised_exits(f):
+    signalled, toil_final.Evaluator = toil_final.Evaluator, RaisingEvaluator
+    try: return f()
+    finally: toil_final.Evaluator = signalled
+
+def bench_exits():
+    toil = Interpreter().init_env().stdlib()
+    toil.walk(r""" fib := load('scripts/fib.toil') """)
+    programs = {
+        "scripts/fib.toil fib(15)": "fib(15)",
+        "return-heavy fib(15)": """
+            def rfib(n) do if n < 2 then return(n) end; return(rfib(n - 1) + rfib(n - 2)) end; rfib(15)
+        """,
+        "early_return x 20000": """
+            def early_return() do 2 + return(3) end;
+            s := 0; for i in range(0, 20000, 1) do s = s + early_return() + 4 end; s
+        """,
+        "all/any x 2000": """
+            a := range(0, 20, 1); n := 0;
+            for i in range(0, 2000, 1) do
+                if all(a, func x do x < 10 end) then n = n + 1 end;
+                if any(a, func x do x > 10 end) then n = n + 1 end
+            end; n
+        """,
+        "break/continue loop": """
+            s := 0; i := 0;
+            while True do
+                i = i + 1; if i > 30000 then break end; if i % 3 == 0 then continue end; s = s + i
+            end; s
+        """,
+    }
+    print(f"{'exits':24} {'raised':>11} {'signalled':>11} {'speedup':>7}")
+    for label, src in programs.items():
+        assert with_raised_exits(lambda: toil.walk(src)) == toil.walk(src)
+        ast, raised, signalled = toil.ast(src), [], []
+        for _ in range(10):
+            raised.append(with_raised_exits(lambda: best_of(lambda: toil.eval(ast), 1)))
+            signalled.append(best_of(lambda: toil.eval(ast), 1))
+        report(label, min(raised), min(signalled))
+
+def bench_tail_calls():
+    toil = Interpreter().init_env().stdlib()
+    toil.walk(r"""
+        {recur} := load('scripts/gcd_dict.toil');
+        def count(n) do if n then count(n - 1) else 0 end end;
+        def count_up(n) do if n then 0 + count_up(n - 1) else 0 end end;
+        def recur_up(a, b) do if a == 0 then b else 0 + recur_up(b % a, a) end end;
+        a := 1; b := 1; for _ in range(0, 3000, 1) do [a, b] := [a + b, a] end
+    """)
+    programs = {"count(20000)": ("count_up(20000)", "count(20000)"),
+                "recur 3000 deep": ("recur_up(a, b)", "recur(a, b)")}
+    print(f"{'tail calls':24} {'non-tail':>11} {'tail':>11} {'speedup':>7}")
+    for name, go in (("walk", toil.walk), ("run", toil.run)):
+        for label, (non_tail, tail) in programs.items():
+            assert go(non_tail) == go(tail)
+            report(f"{label} {name}", best_of(lambda: go(non_tail), 3), best_of(lambda: go(tail), 3))
+        print(f"{'  peak at depth 1000':24} {peak_memory(lambda: go('count_up(1000)')) / 1024:9.1f}KB "
+              f"{peak_memory(lambda: go('count(1000)')) / 1024:9.1f}KB")
+        print(f"{'  count(1000000)':24} {'-':>11} {best_of(lambda: go('count(1000000)'), 1):10.2f}s")
+
+def bench_trampoline():
+    toil = Interpreter().init_env().stdlib()
+    toil.walk(r""" {Interpreter} := load('toil.toil'); tot := Interpreter().init_env().stdlib() """)
+    programs = {
+        "fib(18)": "def fib(n) do if n < 2 then n else fib(n - 1) + fib(n - 2) end end; fib(18)",
+        "gcd x 2000": """
+            def gcd(a, b) do while b > 0 do tmp := b; b = a % b; a = tmp end; a end;
+            s := 0; for i in range(1, 2001, 1) do s = s + gcd(i * 7919, 104729) end; s
+        """,
+        "toil-on-toil fib(8)": """
+            tot.walk('def fib(n) do if n < 2 then n else fib(n - 1) + fib(n - 2) end end; fib(8)')
+        """,
+    }
+    print(f"{'trampoline':24} {'walk':>11} {'twalk':>11} {'speedup':>7}")
+    for label, src in programs.items():
+        assert toil.walk(src) == toil.twalk(src)
+        report(label, best_of(lambda: toil.walk(src), 3), best_of(lambda: toil.twalk(src), 3))
+
+    toil.walk(r""" def up(n) do if n == 0 then 0 else 1 + up(n - 1) end end """)
+    sys.setrecursionlimit(1000)
+    print(f"{'depth':24} {'walk':>11} {'twalk':>11}")
+    for n in (100, 1000, 10000, 100000):
+        try:
+            toil.walk(f"up({n})"); recursive = "ok"
+        except RecursionError:
+            recursive = "RecursionError"
+        assert toil.twalk(f"up({n})") == n
+        print(f"{f'up({n})':24} {recursive:>11} {'ok':>11}")
+    print(f"{'  peak at up(10000)':24} {'':>11} {peak_memory(lambda: toil.twalk('up(10000)')) / 1024:9.1f}KB")
+    sys.setrecursionlimit(200000)
+
+
+class DynamicCompiler(Compiler):
+    def _func(self, node):
+        frame = self._frame(node.body, node.params)
+        body_code = yield DynamicCompiler(node.body, self._frames + [frame], node.params)._compile()
+        self._code.append(("make_closure", node.params, node.body, body_code))
+
+    def _get(self, name): return ("get", name)
+    def _set(self, name): return ("set", name)
+
+    _handlers = {**Compiler._handlers, Func: _func}
+
+def lookups(f):
+    profiler = cProfile.Profile()
+    profiler.runcall(f)
+    return sum(stat[1] for (_, _, func), stat in pstats.Stats(profiler).stats.items() if func == "lookup")
+
+def bench_lexical():
+    toil = Interpreter().init_env().stdlib()
+    programs = {
+        "fib(18)": "def fib(n) do if n < 2 then n else fib(n - 1) + fib(n - 2) end end; fib(18)",
+        "gcd x 2000": """
+            def gcd(a, b) do while b > 0 do tmp := b; b = a % b; a = tmp end; a end;
+            s := 0; for i in range(1, 2001, 1) do s = s + gcd(i * 7919, 104729) end; s
+        """,
+        "locals loop": """
+            def f(n) do i := 0; s := 0; while i < n do s = s + i * i; i = i + 1 end; s end; f(30000)
+        """,
+        "closure counter": """
+            def mk() do c := 0; func do c = c + 1 end end;
+            def g(n) do f := mk(); while n > 0 do f(); n = n - 1 end; f() end; g(20000)
+        """,
+    }
+    print(f"{'lexical addressing':24} {'by name':>11} {'addressed':>11} {'speedup':>7}")
+    for label, src in programs.items():
+        ast = toil._optimized(toil.ast(src))
+        by_name, addressed = DynamicCompiler(ast).compile(), Compiler(ast).compile()
+        assert toil.execute(by_name) == toil.execute(addressed)
+        base, new = [], []
+        for _ in range(5):
+            base.append(best_of(lambda: toil.execute(by_name), 1))
+            new.append(best_of(lambda: toil.execute(addressed), 1))
+        report(label, min(base), min(new),
+               f"lookups {lookups(lambda: toil.execute(by_name))} -> {lookups(lambda: toil.execute(addressed))}")
+
+class UncachedInlineCache(InlineCache):
+    def fill(self, env, name): return env.val(name)
+
+def with_uncached_globals(f):
+    cached, toil_final.InlineCache = toil_final.InlineCache, UncachedInlineCache
+    try: return f()
+    finally: toil_final.InlineCache = cached
+
+def bench_inline_caches():
+    programs = {
+        "fib(18)": "def fib(n) do if n < 2 then n else fib(n - 1) + fib(n - 2) end end; fib(18)",
+        "gcd x 2000": """
+            def gcd(a, b) do while b > 0 do tmp := b; b = a % b; a = tmp end; a end;
+            s := 0; for i in range(1, 2001, 1) do s = s + gcd(i * 7919, 104729) end; s
+        """,
+        "toil.toil load": "load('toil.toil')",
+        "toil-on-toil fib(8)": """
+            {Interpreter} := load('toil.toil'); tot := Interpreter().init_env().stdlib();
+            tot.walk('def fib(n) do if n < 2 then n else fib(n - 1) + fib(n - 2) end end; fib(8)')
+        """,
+    }
+    toil, plain = Interpreter().init_env().stdlib(), with_uncached_globals(lambda: Interpreter().init_env().stdlib())
+    print(f"{'inline caches':24} {'uncached':>11} {'cached':>11} {'speedup':>7}")
+    for label, src in programs.items():
+        uncached, cached = [], []
+        for _ in range(5):
+            uncached.append(with_uncached_globals(lambda: best_of(lambda: plain.run(src), 1)))
+            cached.append(best_of(lambda: toil.run(src), 1))
+        report(label, min(uncached), min(cached), f"lookups "
+               f"{with_uncached_globals(lambda: lookups(lambda: plain.run(src)))} -> {lookups(lambda: toil.run(src))}")
+
+class InterpretedMatcher(Matcher):
+    def __init__(self, pattern, frame=None):
+        self.pattern, self.frame = pattern, frame
+        self.bind = lambda env, value: env.bind(pattern, value)
+
+def with_interpreted_patterns(f):
+    compiled, toil_final.Matcher = toil_final.Matcher, InterpretedMatcher
+    try: return f()
+    finally: toil_final.Matcher = compiled
+
+def bench_patterns():
+    toil = Interpreter().init_env().stdlib()
+    programs = {
+        "list destructure": """
+            def f(n) do s := 0; while n > 0 do [a, b, *r] := [n, 1, 2, 3]; s = s + a + b + len(r); n = n - 1 end; s end;
+            f(20000)
+        """,
+        "dict destructure": """
+            def f(n) do s := 0; while n > 0 do {x, y: b, *r} := {x: n, y: 1, z: 2}; s = s + x + b; n = n - 1 end; s end;
+            f(20000)
+        """,
+        "match cases": """
+            def kind(v) do match v case [0, x] then x case [1, *xs] then len(xs) case {k} then k case _ then 0 end end;
+            def f(n) do s := 0; while n > 0 do s = s + kind([1, n, n]) + kind({k: n}) + kind(n); n = n - 1 end; s end;
+            f(10000)
+        """,
+        "params fib(18)": "def fib(n) do if n < 2 then n else fib(n - 1) + fib(n - 2) end end; fib(18)",
+    }
+    print(f"{'patterns':24} {'interpreted':>11} {'compiled':>11} {'speedup':>7}")
+    for name, compile, go in (("run", toil.compile, toil.execute), ("cwalk", toil.closure, toil.invoke)):
+        for label, src in programs.items():
+            ast = toil.ast(src)
+            interpreted, compiled = with_interpreted_patterns(lambda: compile(ast)), compile(ast)
+            assert go(interpreted) == go(compiled)
+            base, new = [], []
+            for _ in range(5):
+                base.append(best_of(lambda: go(interpreted), 1))
+                new.append(best_of(lambda: go(compiled), 1))
+            report(f"{label} {name}", min(base), min(new))
+
+class LinearSwitch(Switch):
+    def candidates(self, value): return self._binds
+
+def with_linear_cases(f):
+    switch, toil_final.Switch = toil_final.Switch, LinearSwitch
+    try: return f()
+    finally: toil_final.Switch = switch
+
+def bench_switch():
+    fib = "def fib(n) do if n < 2 then n else fib(n - 1) + fib(n - 2) end end"
+    setup = f"""
+        {{Interpreter}} := load('toil.toil'); tot := Interpreter().init_env().stdlib();
+        src := '{fib}; ' * 20 + 'fib(7)'; ast := tot.ast(src)
+    """
+    programs = {
+        "scan": "tot.scan(src)",
+        "parse": "tot.ast(src)",
+        "eval fib(7)": "tot.eval(ast)",
+    }
+    print(f"{'toil-on-toil':24} {'linear':>11} {'switch':>11} {'speedup':>7}")
+    for name in ("walk", "run", "cwalk"):
+        linear = with_linear_cases(lambda: Interpreter().init_env().stdlib())
+        switch = Interpreter().init_env().stdlib()
+        with_linear_cases(lambda: getattr(linear, name)(setup))
+        getattr(switch, name)(setup)
+        for label, src in programs.items():
+            go_linear, go_switch = (lambda: getattr(linear, name)(src)), (lambda: getattr(switch, name)(src))
+            assert repr(with_linear_cases(go_linear)) == repr(go_switch())
+            base, new = [], []
+            for _ in range(5):
+                base.append(with_linear_cases(lambda: best_of(go_linear, 1)))
+                new.append(best_of(go_switch, 1))
+            report(f"{label} {name}", min(base), min(new))
+
+if __name__ == "__main__":
+    sys.setrecursionlimit(200000)
+
+    match sys.argv[1] if len(sys.argv) > 1 else None:
+        case "--scanner": bench_scanner()
+        case "--stream": bench_stream()
+        case "--ident": bench_ident()
+        case "--columns": bench_columns()
+        case "--parser": bench_parser()
+        case "--syntax": bench_syntax()
+        case "--frontend": bench_frontend()
+        case "--nodes": bench_nodes()
+        case "--reload": bench_reload()
+        case "--modules": bench_modules()
+        case "--macros": bench_macros()
+        case "--macro-code": bench_macro_code()
+        case "--quote": bench_quote()
+        case "--macro-table": bench_macro_table()
+        case "--hash-cons": bench_hash_cons()
+        case "--fold": bench_fold()
+        case "--specialize": bench_specialize()
+        case "--engines": bench_engines()
+        case "--exits": bench_exits()
+        case "--tail-calls": bench_tail_calls()
+        case "--trampoline": bench_trampoline()
+        case "--lexical": bench_lexical()
+        case "--inline-caches": bench_inline_caches()
+        case "--patterns": bench_patterns()
+        case "--switch": bench_switch()
+        case _:
+            bench_scanner()
+            bench_stream()
+            bench_ident()
+            bench_columns()
+            bench_parser()
+            bench_syntax()
+            bench_frontend()
+            bench_nodes()
+            bench_reload()
+            bench_modules()
+            bench_macros()
+            bench_macro_code()
+            bench_quote()
+            bench_macro_table()
+            bench_hash_cons()
+            bench_fold()
+            bench_specialize()
+            bench_engines()
+            bench_exits()
+            bench_tail_calls()
+            bench_trampoline()
+            bench_lexical()
+            bench_inline_caches()
+            bench_patterns()
+            bench_switch()
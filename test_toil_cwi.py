@@ -0,0 +1,507 @@
+import pytest
+from toil_final import Interpreter, Ident
+
+toil = Interpreter()
+
+
+@pytest.fixture(autouse=True)
+def setup_toil():
+    global toil
+    toil = Interpreter().init_env().stdlib()
+
+class TestCWI:
+    def test_overall_structure(self):
+        assert toil.scan(r""" 2 """) == [2, Ident('$EOF')]
+        assert toil.parse([2, Ident('$EOF')]) == 2
+        assert toil.ast(r""" 2 """) == 2
+        assert toil.closure(toil.ast(""" 2 """))(None) == 2
+        assert toil.invoke(toil.closure(2)) == 2
+        assert toil.cwalk(r""" 2 """) == 2
+
+    def test_const(self):
+        assert toil.cwalk(r""" 2 """) == 2
+        assert toil.cwalk(r""" None """) is None
+        assert toil.cwalk(r""" True """) is True
+        assert toil.cwalk(r""" 'hello' """) == "hello"
+
+    def test_sequence(self, capsys):
+        assert toil.cwalk(r""" print(2); print(3); 4 """) == 4
+        assert capsys.readouterr().out == "2\n3\n"
+
+        assert toil.cwalk(r""" (2; 3); (4; 5) """) == 5
+
+        assert toil.invoke(toil.closure((Ident("seq"), []))) is None
+
+    def test_if(self):
+        assert toil.cwalk(r""" if 2 == 2 then 4 + 5 else 6 + 7  end """) == 9
+        assert toil.cwalk(r""" if 2 == 3 then 4 + 5 else 6 + 7  end """) == 13
+        assert toil.cwalk(r""" if False then 2 elif False then 3 else 4 end """) == 4
+
+    def test_scope(self, capsys):
+        assert toil.cwalk(r""" a := 2; scope a end """) == 2
+        assert toil.cwalk(r""" a := 2; scope scope a end end """) == 2
+
+        assert toil.cwalk(r""" a := 2; scope a := 3 end """) == 3
+        assert toil.cwalk(r""" a """) == 2
+
+        assert toil.cwalk(r""" a := 2; scope a = 3 end """) == 3
+        assert toil.cwalk(r""" a """) == 3
+
+        assert toil.cwalk(r""" a := 2; scope d := 3 end """) == 3
+        with pytest.raises(AssertionError, match="Undefined variable"):
+            toil.cwalk(r""" d """)
+
+    def test_while(self, capsys):
+        assert toil.cwalk(r""" i := 0; while i < 3 do i = i + 1 then i + 1 end """) == 4
+        assert toil.cwalk(r""" i := 0; while i < 3 do print(i); i = i + 1 end """) is None
+        assert capsys.readouterr().out == "0\n1\n2\n"
+
+    def test_continue(self, capsys):
+        toil.cwalk(r""" i := 0; while i < 3 do i = i + 1; if i == 2 then continue end; print(i) end """)
+        assert capsys.readouterr().out == "1\n3\n"
+
+        toil.cwalk(r"""
+            i := 0; while i < 2 do
+                j := 0; while j < 3 do
+                    j = j + 1; if j == 2 then continue end;
+                    print(i); print(j)
+                end;
+                i = i + 1
+            end
+        """)
+        assert capsys.readouterr().out == "0\n1\n0\n3\n1\n1\n1\n3\n"
+
+        toil.cwalk(r"""
+            i := 0; while i < 3 do
+                i = i + 1;
+                scope
+                    if i == 2 then continue end;
+                    print(i)
+                end
+            end
+        """)
+        assert capsys.readouterr().out == "1\n3\n"
+
+        with pytest.raises(AssertionError, match="Continue at top level"):
+            toil.cwalk(r""" continue """)
+
+    def test_break(self, capsys):
+        assert toil.cwalk(r""" i := 0; while i < 3 do if i == 1 then break end; print(i); i = i + 1 end """) is None
+        assert capsys.readouterr().out == "0\n"
+
+        assert toil.cwalk(r""" i := 0; while i < 3 do if i == 1 then break end; print(i); i = i + 1 then i * 2 else i * 3 end """) == 3
+        assert capsys.readouterr().out == "0\n"
+
+        toil.cwalk(r"""
+            i := 0; while i < 2 do
+                j := 0; while j < 3 do
+                    if i == 0 then if j == 1 then break end end;
+                    print(i); print(j);
+                    j = j + 1
+                end;
+                i = i + 1
+            end
+        """)
+        assert capsys.readouterr().out == "0\n0\n1\n0\n1\n1\n1\n2\n"
+
+        toil.cwalk(r"""
+            i := 0; while i < 2 do
+                j := 0; while j < 3 do
+                    if i == 1 then if j == 1 then break end end;
+                    print(i); print(j);
+                    j = j + 1
+                else break end;
+                i = i + 1
+            end
+        """)
+        assert capsys.readouterr().out == "0\n0\n0\n1\n0\n2\n1\n0\n"
+
+        toil.cwalk(r"""
+            i := 0; while i < 3 do
+                scope
+                    if i == 1 then break end;
+                    print(i)
+                end;
+                i = i + 1
+            end
+        """)
+        assert capsys.readouterr().out == "0\n"
+
+        with pytest.raises(AssertionError, match="Break at top level"):
+            toil.cwalk(r""" break """)
+
+    def test_builtins(self, capsys):
+        assert toil.cwalk(r""" add(mul(2, 3), 4) """) == 10
+
+        assert toil.cwalk(r""" tuple() """) == ()
+        assert toil.cwalk(r""" tuple(2, tuple(3, 4)) """) == (2, (3, 4))
+
+        toil.cwalk(r""" print() """)
+        assert capsys.readouterr().out == "\n"
+        toil.cwalk(r""" print(2, 3, 4) """)
+        assert capsys.readouterr().out == "2 3 4\n"
+
+        assert toil.cwalk(r""" myadd := add; myadd(2, 3) """) == 5
+
+    def test_list(self):
+        assert toil.cwalk(r""" [] """) == []
+        assert toil.cwalk(r""" [2, [3, 4]] """) == [2, [3, 4]]
+
+        assert toil.cwalk(r""" [2, [3, 4]][1] """) == [3, 4]
+        assert toil.cwalk(r""" [2, [3, 4]][1][0] """) == 3
+
+    def test_dict(self):
+        assert toil.cwalk(r""" {} """) == {}
+        assert toil.cwalk(r""" {a: 2, b: {c: 3, d: 4}} """) == {'a': 2, 'b': {'c': 3, 'd': 4}}
+
+        assert toil.cwalk(r""" {a: 2, b: {c: 3, d: 4}}["b"] """) == {'c': 3, 'd': 4}
+        assert toil.cwalk(r""" {a: 2, b: {c: 3, d: 4}}["b"]["c"] """) == 3
+
+        assert toil.cwalk(r""" {a: 2, b: {c: 3, d: 4}}.b """) == {'c': 3, 'd': 4}
+        assert toil.cwalk(r""" {a: 2, b: {c: 3, d: 4}}.b.c """) == 3
+
+    def test_ufcs(self):
+        assert toil.cwalk(r""" 2.add(3) """) == 5
+        assert toil.cwalk(r""" [2, 3, 4].len() """) == 3
+        assert toil.cwalk(r""" [2, 3, 4].len().add(5) """) == 8
+
+        toil.cwalk(r""" def myadd(a, b) do a + b end """)
+        assert toil.cwalk(r""" 2.myadd(3) """) == 5
+
+        with pytest.raises(AssertionError, match="Undefined variable"):
+            toil.cwalk(r""" 2.not_found() """)
+        with pytest.raises(AssertionError, match="Invalid operator"):
+            toil.cwalk(r""" foo := 2; 3.foo() """)
+
+    def test_method_notation(self):
+        toil.cwalk(r""" obj := {
+            set: func self, val do self.val = val end,
+            add: func self, a do self.val + a end,
+            val: None
+        } """)
+        toil.cwalk(r""" obj.set(2) """)
+        assert toil.cwalk(r""" obj.val """) == 2
+        assert toil.cwalk(r""" obj.add(3) """) == 5
+
+        assert toil.cwalk(r""" {a: 2, b: 3}.keys() """) == ['a', 'b']
+        assert toil.cwalk(r""" { len: func self do "local" end }.len() """) == "local"
+
+    def test_destructure_variable_and_literal(self):
+        # Variable pattern
+        assert toil.cwalk(r""" a := 2; a """) == 2
+        assert toil.cwalk(r""" _ := 2; _ """) == 2
+
+        # Literal pattern
+        assert toil.cwalk(r""" a := 2; 2 := a """) == 2
+        assert toil.cwalk(r""" None := None """) is None
+        assert toil.cwalk(r""" True := True """) is True
+        assert toil.cwalk(r""" "hello" := "hello" """) == "hello"
+
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" "hello" := "world" """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" a := 3; 2 := a """)
+
+    def test_destructure_list(self):
+        assert toil.cwalk(r""" [a, b] := [3, 4]; [a, b] """) == [3, 4]
+        assert toil.cwalk(r""" [] := [] """) == []
+        assert toil.cwalk(r""" [_, b, _] := [2, 3, 4]; b """) == 3
+
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" [a, b] := [2] """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" [a, b] := [4, 5, 6] """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" [] := [1] """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" [a] := 2 """)
+
+        # Rest parameters
+        assert toil.cwalk(r""" [a, *b] := [2]; [a, b] """) == [2, []]
+        assert toil.cwalk(r""" [a, *b] := [3, 4]; [a, b] """) == [3, [4]]
+        assert toil.cwalk(r""" [a, *b] := [4, 5, 6]; [a, b] """) == [4, [5, 6]]
+        assert toil.cwalk(r""" [*a] := [4, 5, 6]; a """) == [4, 5, 6]
+
+        assert toil.cwalk(r""" [*a, b] := [2]; [a, b] """) == [[], 2]
+        assert toil.cwalk(r""" [*a, b] := [2, 3]; [a, b] """) == [[2], 3]
+        assert toil.cwalk(r""" [*a, b] := [2, 3, 4]; [a, b] """) == [[2, 3], 4]
+
+        assert toil.cwalk(r""" [a, *b, c] := [3, 4]; [a, b, c] """) == [3, [], 4]
+        assert toil.cwalk(r""" [a, *b, c] := [4, 5, 6]; [a, b, c] """) == [4, [5], 6]
+        assert toil.cwalk(r""" [a, *b, c] := [5, 6, 7, 8]; [a, b, c] """) == [5, [6, 7], 8]
+
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" [a, *b] := [] """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" [*a, b] := [] """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" [a, *b, c] := [2] """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" [a, *b, *c, d] := [5, 6, 7, 8] """)
+
+    def test_destructure_dict(self):
+        assert toil.cwalk(r""" {a} := {a: 2, b: 3}; a """) == 2
+        assert toil.cwalk(r""" {a, b} := {a: 2, b: 3}; [a, b] """) == [2, 3]
+        assert toil.cwalk(r""" {a: c, b: d} := {a: 3, b: 4}; [c, d] """) == [3, 4]
+        assert toil.cwalk(r""" {a} := {"a": 5, b: 6}; a """) == 5
+        assert toil.cwalk(r""" {a: _, b} := {a: 2, b: 3}; b """) == 3
+        assert toil.cwalk(r""" {} := {a: 2, b: 3} """) == {'a': 2, 'b': 3}
+
+        assert toil.cwalk(r""" {a, *rest} := {a: 2}; [a, rest] """) == [2, {}]
+        assert toil.cwalk(r""" {a, *rest} := {a: 2, b: 3}; [a, rest] """) == [2, {'b': 3}]
+        assert toil.cwalk(r""" {a, *rest} := {a: 2, b: 3, c: 4}; [a, rest] """) == [2, {'b': 3, 'c': 4}]
+
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" {a} := {b: 2} """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" {a, b, c} := {a: 2, b: 3} """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" {a, *rest} := {b: 2} """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" {a} := 2 """)
+
+    def test_destructure_ident_and_expr(self):
+        assert toil.cwalk(r""" Ident("aaa") := Ident("aaa") """) == Ident("aaa")
+        assert toil.cwalk(r""" Ident(a) := Ident("aaa"); a """) == "aaa"
+
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" Ident("aaa") := Ident("bbb") """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" Ident(a) := "aaa" """)
+
+        assert toil.cwalk(r""" tuple(Ident("add"), [int(a), int(b)]) := tuple(Ident("add"), [2, 3]); [a, b] """) == [2, 3]
+        assert toil.cwalk(r""" tuple(Ident("add"), [Ident(name1), Ident(name2)]) := tuple(Ident("add"), [Ident("a"), Ident("b")]); [name1, name2] """) == ['a', 'b']
+
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" tuple(Ident("add"), [Ident(name1), Ident(name2)]) := 2 + 3 """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" tuple(Ident("add"), [Ident(name1), Ident(name2)]) := tuple(Ident("add")) """)
+
+    def test_destructure_type(self):
+        assert toil.cwalk(r""" int(a) := 2; a """) == 2
+        assert toil.cwalk(r""" str(a) := "aaa"; a """) == "aaa"
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" int(a) := "2" """)
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" str(a) := [] """)
+
+    def test_destructure_or(self):
+        assert toil.cwalk(r""" int(a) | str(a) := 2; a """) == 2
+        assert toil.cwalk(r""" int(a) | str(a) := "aaa"; a """) == "aaa"
+        assert toil.cwalk(r""" int(a) | str(a) | list(a):= [2]; a """) == [2]
+        with pytest.raises(Exception, match="Pattern mismatch"):
+            toil.cwalk(r""" int(a) | str(a) := [2] """)
+
+    def test_destructure_combination(self):
+        assert toil.cwalk(r""" [{a: b}, c] := [{a: 2, b: 3}, 4]; [b, c] """) == [2, 4]
+        assert toil.cwalk(r""" {a: [b, c]} := {a: [5, 6]}; [b, c] """) == [5, 6]
+
+    def test_list_assign(self):
+        toil.cwalk(r""" a := [2, [3, 4]] """)
+        assert toil.cwalk(r""" a[0] = 5; a """) == [5, [3, 4]]
+        assert toil.cwalk(r""" a[1][0] = 6; a """) == [5, [6, 4]]
+        assert toil.cwalk(r""" a[-1][1] = 7; a """) == [5, [6, 7]]
+        assert toil.cwalk(r""" l1 := [2, 3]; l2 := [4, 5]; l1[0] = l2[1] = 6; [l1, l2] """) == [[6, 3], [4, 6]]
+
+    def test_dict_assign(self):
+        toil.cwalk(r""" d := {a: 2, b: {c: 3, d: 4}} """)
+        assert toil.cwalk(r""" d["a"] = 5; d """) == {'a': 5, 'b': {'c': 3, 'd': 4}}
+        assert toil.cwalk(r""" d["b"]["c"] = 6; d """) == {'a': 5, 'b': {'c': 6, 'd': 4}}
+        assert toil.cwalk(r""" d.b.c = 7; d """) == {'a': 5, 'b': {'c': 7, 'd': 4}}
+        assert toil.cwalk(r""" d1 := {a: 2}; d2 := {b: 3}; d1.a = d2["b"] = 4; [d1, d2] """) == [{'a': 4}, {'b': 4}]
+
+    def test_func(self):
+        assert toil.cwalk(r""" myadd := [a, b] -> a + b; myadd(2, 3) """) == 5
+        assert toil.cwalk(r""" f := func do 2 end; f() """) == 2
+        assert toil.cwalk(r""" f := func a, *b do [a, b] end; f(2, 3, 4) """) == [2, [3, 4]]
+        assert toil.cwalk(r""" def twice(f, x) do f(f(x)) end; twice(a -> a * 2, 3) """) == 12
+
+    def test_return(self):
+        assert toil.cwalk(r""" f := func do return(2); 3 end; f() """) == 2
+
+        assert toil.cwalk(r"""
+            def early_return() do
+                2 + return(3)
+            end;
+            early_return() + 4
+        """) == 7
+
+    def test_closure(self):
+        toil.cwalk(r"""
+            def make_counter do
+                count := 0;
+                func do count = count + 1 end
+            end;
+            c1 := make_counter();
+            c2 := make_counter()
+        """)
+        assert toil.cwalk(r"""c1()""") == 1
+        assert toil.cwalk(r"""c1()""") == 2
+        assert toil.cwalk(r"""c2()""") == 1
+        assert toil.cwalk(r"""c2()""") == 2
+
+    def test_recursion_fib(self):
+        assert toil.cwalk(r"""
+            def fib(n) do
+                if n == 0 then return(0) end;
+                if n == 1 then return(1) end;
+                fib(n - 1) + fib(n - 2)
+            end;
+            fib(6)
+        """) == 8
+
+    def test_runtime_compile(self):
+        toil.walk(r""" add2 := a -> a + 2 """)
+        func = toil.cwalk(r""" add2 """)
+        assert func[0] == Ident("closure")
+        assert func[1][1] is not None # body_expr
+        assert func[1][2] is None     # body_code
+        assert toil.cwalk(r""" add2(3) """) == 5
+
+        toil.walk(r""" add2 := compile(add2) """)
+        compiled_func = toil.cwalk(r""" add2 """)
+        assert compiled_func[1][1] is not None # body_expr
+        assert len(compiled_func[1][2]) > 0    # body_code
+        assert toil.cwalk(r""" add2(3) """) == 5
+
+        toil.walk(r""" add2 := compile(add2) """)
+        assert toil.cwalk(r""" add2(3) """) == 5
+
+        toil.cwalk(r""" add3 := a -> a + 3 """)
+        func_cwalk = toil.cwalk(r""" add3 """)
+        assert func_cwalk[1][1] is not None # body_expr
+        assert func_cwalk[1][2] is None     # body_code
+        assert toil.cwalk(r""" add3(2) """) == 5
+        assert toil.run(r""" add3(2) """) == 5
+        assert toil.walk(r""" add3(2) """) == 5
+
+    def test_match(self):
+        toil.cwalk(r"""
+            def test_match(x) do
+                match x
+                    case int(a) then "int: " + to_str(a)
+                    case str(a) then "str: " + a
+                end
+            end
+        """)
+        assert toil.cwalk(r""" test_match(2) """) == "int: 2"
+        assert toil.cwalk(r""" test_match("hello") """) == "str: hello"
+        assert toil.cwalk(r""" test_match([]) """) is None
+
+        assert toil.cwalk(r""" match 2 end """) is None
+
+    def test_try_basic(self):
+        assert toil.cwalk(r""" try 2; 3 end """) == 3
+        assert toil.cwalk(r""" try 2; 3 except e then e end """) == 3
+        assert toil.cwalk(r""" try 2; raise(2 + 3); 3 except e then e end """) == 5
+
+        assert toil.cwalk(r"""
+            try
+                raise(["bar", 3])
+            except ["foo", val] then ["foo", val]
+            except ["bar", val] then ["bar", val]
+            end
+        """) == ["bar", 3]
+
+        with pytest.raises(AssertionError, match="ToilException"):
+            toil.cwalk(r"""
+                try
+                    raise(["baz", 3])
+                except ["foo", val] then ["foo", val]
+                end
+            """)
+
+    def test_try_nested(self):
+        assert toil.walk(r"""
+            try
+                try
+                    raise(2)
+                except e then
+                    raise(e + 1)
+                end
+            except e then
+                e
+            end
+        """) == 3
+
+        assert toil.walk(r"""
+            try
+                try
+                    raise("outer")
+                except "inner" then "caught inner"
+                end
+            except "outer" then "caught outer"
+            end
+        """) == "caught outer"
+
+    def test_try_rewind(self):
+        assert toil.cwalk(r"""
+            for a in range(0, 3, 1) do
+                try if a == 1 then break end
+                except _ then 1/0 end
+            then 1/0 else a end
+        """) == 1
+
+        assert toil.cwalk(r"""
+            a := 2; try scope a := 3; raise() end except _ then a end
+        """) == 2
+
+        assert toil.cwalk(r"""
+            a := 2; try scope a = 3; raise() end except _ then a end
+        """) == 3
+
+        assert toil.cwalk(r"""
+            for a in range(0, 3, 1) do
+                try scope
+                    if a == 0 then continue end;
+                    if a == 1 then break end
+                end except _ then 1/0 end
+            then 1/0 else a end
+        """) == 1
+
+    def test_raise_from_functions(self):
+        assert toil.cwalk(r"""
+            def f() do raise(2) end;
+            try f() except e then e end
+        """) == 2
+
+    def test_raise_over_boundary(self):
+        toil.walk(r""" def f() do raise(2) end """)
+        assert toil.cwalk(r""" try f() except e then e end """) == 2
+
+        toil.cwalk(r""" def f() do raise(2) end """)
+        assert toil.walk(r""" try f() except e then e end """) == 2
+
+    def test_inter_interpreter_mutual_recursion(self):
+        toil.walk(r""" def even(n) do if n == 0 then True else odd(n - 1) end end """)
+        toil.cwalk(r""" def odd(n) do if n == 0 then False else even(n - 1) end end """)
+
+        assert toil.walk(r"""even(2)""") is True
+        assert toil.walk(r"""even(3)""") is False
+        assert toil.cwalk(r"""odd(2)""") is False
+        assert toil.cwalk(r"""odd(3)""") is True
+
+    def test_jit_execution(self):
+        assert toil.cwalk(r"""
+            __jit__ := True;
+            def f(x) do x * 2 end;
+            f(3)
+        """) == 6
+
+        assert toil.cwalk(r"""
+            __jit__ := True;
+            def fib(n) do
+                if n < 2 then n else fib(n - 1) + fib(n - 2) end
+            end;
+            fib(6)
+        """) == 8
+
+    def test_body_closure_on_node(self):
+        f = toil.cwalk(r""" def f() do 2 end; f """)
+        body = f[1][1]._closure
+        assert toil.cwalk(r""" f() """) == 2
+        assert toil.cwalk(r""" f() """) == 2
+        assert f[1][1]._closure is body
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -1,5 +1,6 @@
+import pickle
 import pytest
-from toil_final import Interpreter, Ident
+from toil_final import Interpreter, Ident, InlineCache, Matcher, Switch
 
 toil = Interpreter()
 
@@ -297,6 +298,22 @@ class TestICI:
         assert toil.run(r""" [{a: b}, c] := [{a: 2, b: 3}, 4]; [b, c] """) == [2, 4]
         assert toil.run(r""" {a: [b, c]} := {a: [5, 6]}; [b, c] """) == [5, 6]
 
+    def test_destructure_compiled(self):
+        assert toil.code(r""" [a, *b] := [2, 3] """)[-2:] == [
+            ("def", Matcher([Ident("a"), (Ident("*"), [Ident("b")])])), ("ret",)]
+        toil.run(r"""
+            def f(x) do
+                [a, *b, c] := x; {k: d, *e} := {k: a, l: c};
+                match b case [] then [a, c, d, e] case [int(g) | str(g), *_] then [g, d, e] end
+            end
+        """)
+        assert toil.run(r""" f([2, 3]) """) == [2, 3, 2, {"l": 3}]
+        assert toil.run(r""" f([2, "s", 4, 3]) """) == ["s", 2, {"l": 3}]
+        with pytest.raises(AssertionError, match="Pattern mismatch"):
+            toil.run(r""" f([2]) """)
+        code = toil.code(r""" def g(a, [b, *c]) do [a, b, c] end; g(2, [3, 4, 5]) """)
+        assert toil.execute(pickle.loads(pickle.dumps(code))) == [2, 3, [4, 5]]
+
     def test_list_assign(self):
         toil.run(r""" a := [2, [3, 4]] """)
         assert toil.run(r""" a[0] = 5; a """) == [5, [3, 4]]
@@ -351,6 +368,71 @@ class TestICI:
             fib(6)
         """) == 8
 
+    def test_tail_call(self):
+        assert toil.run(r""" def count(n) do if n then count(n - 1) else "done" end end; count(1000000) """) == "done"
+        assert toil.run(r"""
+            def even(n) do if n == 0 then True else scope m := n - 1; odd(m) end end end;
+            def odd(n) do if n == 0 then False else return(even(n - 1)) end end;
+            [even(10001), odd(10001)]
+        """) == [False, True]
+        assert toil.run(r"""
+            def fail(n) do if n == 0 then raise("bottom") else fail(n - 1) end end;
+            def guard(n) do try fail(n) except e then [e] end end;
+            guard(5000)
+        """) == ["bottom"]
+        assert toil.run(r""" def down(n) do if n == 0 then 0 else (n - 1).down() end end; down(5000) """) == 0
+
+    def test_lexical_addressing(self):
+        code = toil.code(r""" func a do b := a; scope c := b; func do c + a end end end """)
+        assert code[0][3] == [
+            ("frame", {"a": 0, "b": 1}, Matcher([Ident("a")], {"a": 0, "b": 1})), ("get_local", 0, "a"), ("def_local", 1), ("pop",),
+            ("enter_scope", {"c": 0}), ("get_free", 1, 1, "b"), ("def_local", 0), ("pop",),
+            ("make_closure", code[0][3][8][1], code[0][3][8][2], [
+                ("frame", {}, Matcher([], {})), ("get_free", 1, 0, "c"), ("get_free", 2, 0, "a"),
+                ("get_global", "add", InlineCache()), ("tail_call", 2), ("ret",)]),
+            ("leave_scope",), ("ret",)]
+        assert toil.code(r""" scope 3 end """) == [("const", 3), ("ret",)]
+        assert toil.code(r""" func [a, *r] do int(n) := a; (x | y) := n end """)[0][3][0][1] == {
+            "a": 0, "n": 1, "r": 2, "x": 3, "y": 4}
+        assert toil.run(r""" x := 1; def f() do if False then x := 2 end; x end; f() """) == 1
+        assert toil.run(r""" x := 1; def f() do if False then x := 2 end; x = 3 end; [f(), x] """) == [3, 3]
+        assert toil.run(r"""
+            def mk() do c := 0; func do c = c + 1 end end; f := mk(); f(); f(); f()
+        """) == 3
+        assert toil.run(r""" def f(n) do def g(m) do m * n end; 5.g() end; f(3) """) == 15
+        assert toil.run(r""" def f(a, b) do c := a + b; c * 2 end; apply(f, [3, 4]) """) == 14
+
+    def test_inline_cache(self):
+        toil.run(r""" def f(a, b) do a + b end; def g() do n end """)
+        assert toil.run(r""" n := 1; [g(), scope n := 2; g() end, n = 3, g()] """) == [1, 1, 3, 3]
+        assert toil.run(r""" s := 0; for i in range(0, 5, 1) do s = s + i end; s """) == 10
+        assert toil.run(r""" [f(1, 2), f(3, 4)] """) == [3, 7]
+        toil.run(r""" plus := add; add = func a, b do plus(a, b) * 10 end """)
+        assert toil.run(r""" f(3, 4) """) == 70
+        toil.run(r""" def add(a, b) do a - b end """)
+        assert toil.run(r""" f(3, 4) """) == -1
+        assert toil.module("inline_cache").load(r""" def add(a, b) do a * b end; f(3, 4) """) == -1
+        assert toil.module("inline_cache").load(r""" def f(a, b) do a + b end; f(3, 4) """) == 12
+        assert toil.run(r""" f(3, 4) """) == -1
+
+        toil.walk(r""" k := func do n end """)
+        assert toil.walk(r""" compile(k) """)[1][2] == [("get", "n"), ("ret",)]
+        toil.run(r""" square := macro e do quote !e * !e end end; __jit__ := True """)
+        assert toil.run(r""" square(n) """) == 9
+        caches = [inst[2] for inst in toil._macros._macros["square"][1][2] if inst[0] == "get_global"]
+        assert caches and all(cache.env is toil._env for cache in caches)
+
+    def test_deep_nesting(self):
+        n = 20000
+        lst = toil.run("[" * n + "1" + "]" * n)
+        for _ in range(n): lst = lst[0]
+        assert lst == 1
+        assert toil.run("(" * n + "-" * n + "1" + ")" * n) == 1
+        assert toil.run(
+            "if False then 0 " + "elif False then 0 " * 5000 + "else 7 end") == 7
+        assert toil.run(
+            "f := " + "a -> " * 2000 + "a; " + "f" + "(0)" * 2000) == 0
+
     def test_runtime_compile(self):
         toil.walk(r""" add2 := a -> a + 2 """)
         func = toil.run(r""" add2 """)
@@ -389,6 +471,34 @@ class TestICI:
 
         assert toil.run(r""" match 2 end """) is None
 
+    def test_match_switch(self):
+        code = toil.code(r""" match x case int(a) then a case str(a) then 0 end """)
+        assert code[:2] == [("get", "x", InlineCache()), ("switch", Switch([
+            ((Ident("int"), [Ident("a")]), 2), ((Ident("str"), [Ident("a")]), 5)]), 8)]
+        assert code[8:] == [("pop",), ("const", None), ("ret",)]
+        toil.run(r"""
+            def kind(e) do
+                match e
+                    case tuple(Ident("add"), [a, b]) then "add"
+                    case Ident("x") then "x"
+                    case [n] then n
+                    case tuple(Ident("sub"), [a, b]) then "sub"
+                    case tuple(op, args) then "call"
+                    case Ident(name) then name
+                    case _ then "other"
+                end
+            end
+        """)
+        assert toil.run(r""" [quote 2 + 3 end, quote x end, [4], quote 2 - 3 end, quote f(2) end, quote y end, 5].map(kind) """) == \
+            ["add", "x", 4, "sub", "call", "y", "other"]
+        assert toil.run(r""" [tuple(Ident("add"), 2), tuple(2, 3), tuple()].map(kind) """) == ["call", "call", "other"]
+        assert toil.run(r"""
+            def catch(v) do try raise(v) except [a, b] then a + b except str(s) then s except int(n) then n end end;
+            [catch([2, 3]), catch("s"), catch(4)]
+        """) == [5, "s", 4]
+        with pytest.raises(AssertionError, match="ToilException"):
+            toil.run(r""" catch(None) """)
+
     def test_try_basic(self):
         assert toil.run(r""" try 2; 3 end """) == 3
         assert toil.run(r""" try 2; 3 except e then e end """) == 3
@@ -495,5 +605,48 @@ class TestICI:
             fib(6)
         """) == 8
 
+    def test_compile_modules(self, tmp_path):
+        (tmp_path / "a.toil").write_text("def f(x) do x * 2 end; f")
+        (tmp_path / "b.toil").write_text("for x in [1, 2] do print(x) end; 3")
+        paths = [str(tmp_path / "a.toil"), str(tmp_path / "b.toil")]
+        codes = toil.compile_modules(paths, 2)
+        assert [repr(c) for c in codes] == [repr(toil.code(p.read_text())) for p in
+                                             [tmp_path / "a.toil", tmp_path / "b.toil"]]
+        toil.execute(codes[0])
+        assert toil.run("f(3)") == 6
+        assert toil.execute(codes[1]) == 3
+
+    def test_compile_modules_isolated(self, tmp_path):
+        (tmp_path / "a.toil").write_text("defmacro m(x) do quote !x * 100 end end; 1")
+        (tmp_path / "b.toil").write_text("def m(x) do x + 1 end; m(2)")
+        paths = [str(tmp_path / "a.toil"), str(tmp_path / "b.toil")]
+        assert [toil.execute(c) for c in toil.compile_modules(paths, 1)] == [1, 3]
+        assert toil.compile_modules([]) == []
+
+    def test_fold(self):
+        folding = Interpreter(fold=True).init_env().stdlib()
+        code = folding.code(r""" 2 * 3 """)
+        assert code[0][0] == "guard" and code[1:3] == [("const", 6), ("jump", 7)]
+        assert folding.run(r""" if 1 < 2 then 2 * 3 else 4 end """) == 6
+        assert folding.run(r""" i := 0; while i < 3 do i = i + (5 - 4) then i * (1 + 1) end """) == 6
+        assert toil.code(r""" 2 * 3 """) == [
+            ("const", 2), ("const", 3), ("get", "mul", InlineCache()), ("tail_call", 2), ("ret",)]
+
+        for engine in ["run", "walk", "cwalk"]:
+            plain = Interpreter().init_env()
+            run = getattr(plain, engine)
+            run(r""" def g() do 2 + 3 end; add = func a, b do 100 end """)
+            assert run(r""" g() """) == 100
+
+        for engine in ["run", "walk", "cwalk", "twalk"]:
+            folding = Interpreter(fold=True).init_env()
+            run = getattr(folding, engine)
+            run(r""" def g() do if 1 < 2 then 2 + 3 else 4 end end """)
+            assert run(r""" g() """) == 5
+            run(r""" add = func a, b do 100 end """)
+            assert run(r""" g() """) == 100
+            run(r""" less = func a, b do False end """)
+            assert run(r""" g() """) == 4
+
 if __name__ == "__main__":
     pytest.main([__file__])
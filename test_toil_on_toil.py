@@ -6,7 +6,7 @@ from toil_on_toil import ToTWrapper
 toil_walk = Interpreter().init_env().stdlib()
 toil_walk.walk(r"""
     {
-        Interpreter, Environment,
+        Interpreter, Environment, Evaluator,
         isalpha, isdigit, isalnum, isspace, is_ident_first, is_ident_rest, is_ident
     } := load('toil.toil');
     tot_base := Interpreter().init_env().stdlib()
@@ -15,7 +15,7 @@ toil_walk.walk(r"""
 toil_run = Interpreter().init_env().stdlib()
 toil_run.run(r"""
     {
-        Interpreter, Environment,
+        Interpreter, Environment, Evaluator,
         isalpha, isdigit, isalnum, isspace, is_ident_first, is_ident_rest, is_ident
     } := load('toil.toil', True);
     tot_base := Interpreter().init_env().stdlib()
@@ -1413,5 +1413,15 @@ class TestExamples:
             take(5, count_from(1))
         """) == [1, 2, 3, 4, 5]
 
+class TestSpecialize:
+    def test_first_projection(self):
+        program = r""" i := 0; s := 0; while i < 5 do s = s + i * 2; i = i + 1 end; s """
+        assert tot._go(f"""
+            residual := specialize(Evaluator().eval, tot.ast('{program}'));
+            residual(tot._env)
+        """) == 20
+        assert tot._go(r""" residual(tot._env) """) == 20
+        assert tot.walk(program) == 20
+
 if __name__ == "__main__":
     pytest.main([__file__])
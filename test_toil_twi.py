@@ -1,5 +1,5 @@
 import pytest
-from toil_final import Interpreter, Ident
+from toil_final import Interpreter, Ident, If, Call, Compiler, to_node
 
 toil = Interpreter()
 
@@ -721,6 +721,23 @@ class TestToil:
         assert toil.walk(r""" match [2, 3] case [a, b] then "ok" end; a + b """) == 5
         assert toil.walk(r""" match [2, 3] case [a, 4] then "no" case _ then a end """) == 2
 
+    def test_match_switch(self):
+        kind = r"""
+            def kind(e) do
+                match e
+                    case tuple(Ident("add"), [a, b]) then "add"
+                    case Ident("x") then "x"
+                    case tuple(op, args) then "call"
+                    case tuple(Ident("sub"), [a, b]) then "sub"
+                    case Ident(name) then name
+                    case int(n) | [n] then n
+                end
+            end;
+            [quote 2 + 3 end, quote x end, quote 2 - 3 end, quote y end, 4, [5], "s"].map(kind)
+        """
+        expected = ["add", "x", "call", "y", 4, 5, None]
+        assert toil.walk(kind) == toil.twalk(kind) == toil.cwalk(kind) == expected
+
     def test_while(self):
         assert toil.walk(r""" i := 0; while i < 2 do i = i + 1 end """) == None
         assert toil.walk(r"""
@@ -1058,6 +1075,69 @@ class TestToil:
         assert toil.walk(r""" type(read("scripts/fib.toil")) """) == "str"
         assert toil.walk(r""" load("scripts/fib.toil")(4) """) == 3
 
+    def test_reload(self, tmp_path):
+        path = tmp_path / "mod.toil"
+        src = r"""
+            defmacro twice(x) do quote !x * 2 end end;
+            def f(a) do twice(a) end;
+            def g(a) do a + 1 end;
+            n := g(1);
+            {n, m: f(3)}
+        """
+        path.write_text(src)
+        assert toil.walk(f""" reload("{path}") """) == {"n": 2, "m": 6}
+        module = toil.module(str(path))
+        assert module.analyzed == [0, 1, 2, 3, 4]
+
+        src = src.replace("a + 1", "a + 10")
+        path.write_text(src)
+        assert toil.reload(str(path)) == {"n": 11, "m": 6}
+        assert module.analyzed == [2] and module.executed == [2, 3, 4]
+
+        src = src.replace("!x * 2", "!x * 3")
+        path.write_text(src)
+        assert toil.reload(str(path)) == {"n": 11, "m": 9}
+        assert module.analyzed == [0, 1] and module.executed == [0, 1, 4]
+
+        path.write_text(src.replace("def g", "# comment\n            def g"))
+        assert toil.reload(str(path)) == {"n": 11, "m": 9}
+        assert module.analyzed == [] and module.executed == []
+
+        path = tmp_path / "calls.toil"
+        path.write_text("a := 1; def f() do a + 1 end; def g() do f() end; b := g(); b")
+        assert toil.reload(str(path)) == 2
+        path.write_text("a := 5; def f() do a + 1 end; def g() do f() end; b := g(); b")
+        assert toil.reload(str(path)) == 6
+        assert toil.module(str(path)).executed == [0, 3, 4]
+
+    def test_stream(self):
+        tokens = toil.stream(["f := x -", "> x + 1", "0; s := 'a", "b'; [f(2", "3), s]"])
+        assert toil.eval(toil.expand(toil.parse(tokens))) == [33, "ab"]
+
+    def test_token_buffer(self):
+        src = r""" s := "a\"b"; 'c' + s """
+        buffer = toil.scan_columns(src)
+        assert list(buffer) == toil.scan(src)
+        assert buffer.kind(2) == "string" and buffer.text(2) == r'"a\"b"'
+        assert buffer.span(len(buffer) - 1) == (len(src), len(src))
+        assert toil.eval(toil.expand(toil.parse(buffer))) == 'ca"b'
+
+    def test_nodes(self):
+        src = r""" x := 2; if x == 2 then [x, {a: -x}] else x.len() end """
+        ast = toil.ast(src)
+        node = to_node(ast)
+        assert node.to_tuple() == ast and repr(node) == repr(ast)
+        assert toil.eval(node) == [2, {"a": -2}]
+        assert toil.execute(toil.compile(node)) == [2, {"a": -2}]
+
+        node = toil.nodes(src)
+        assert node.to_tuple() == ast
+        cond = node.exprs[1]
+        assert type(cond) is If and type(cond.cond) is Call
+        assert src[slice(*cond.span)] == "if x == 2 then [x, {a: -x}] else x.len() end"
+        assert src[slice(*cond.cond.span)] == "x == 2"
+        assert to_node((Ident("if"), [2])).to_tuple() == (Ident("if"), [2])
+
     def test_eval_apply(self):
         assert toil.walk(r""" eval("2 + 3") """) == 5
         assert toil.walk(r""" eval_expr(tuple(Ident("add"), [2, 3])) """) == 5
@@ -1088,6 +1168,12 @@ class TestToil:
         toil.walk(r""" when := macro cond, body do tuple(Ident('if'), [cond, body, None]) end """)
         toil.walk(r""" a := 2; b := 3 """)
         assert toil.walk(r""" when(a == b, 1 / 0) """) is None
+        assert toil._macros.lookup("when")[1][2] is None
+        toil.walk(r""" __jit__ := True """)
+        assert toil.walk(r""" when(a == b, 1 / 0) """) is None
+        assert toil._macros.lookup("when")[1][2] == Compiler(
+            toil.ast(r""" tuple(Ident('if'), [cond, body, None]) """),
+            [{"body": 0, "cond": 1}], [Ident("cond"), Ident("body")]).compile()
 
         toil.walk(r"""
             def test_macro_scope() do
@@ -1099,6 +1185,12 @@ class TestToil:
         with pytest.raises(AssertionError, match="Undefined variable"):
             toil.walk(" local_when(2 == 2, 3) ")
 
+        toil.walk(r""" defmacro m() do 1 end """)
+        assert toil.walk(r""" def g() do defmacro m() do 2 end; m() end; [g(), m()] """) == [2, 1]
+        with pytest.raises(AssertionError, match="Pattern mismatch"):
+            toil.walk(r""" scope defmacro m() do 3 end; m(4) end """)
+        assert toil.walk(r""" m() """) == 1
+
         toil.walk(r""" def when_func(cond, body) do if cond then body end end """)
         with pytest.raises(Exception):
             toil.walk(r""" when_func(a == b, 1 / 0) """)
@@ -1134,6 +1226,19 @@ class TestToil:
         assert toil.walk(r""" a := [3, 4]; quote [2, !!a, 5] end """) == [2, 3, 4, 5]
         assert toil.walk(r""" a := 2; quote {a: !a, b: 3} end """) == {'a': 2, 'b': 3}
         assert toil.walk(r""" a := [3, 4]; quote { list: [2, !!a, 5] } end """) == {'list': [2, 3, 4, 5]}
+        assert toil.walk(r""" a := [3]; b := [5, 6]; quote [!!a, 4, !!b, !!a] end """) == [3, 4, 5, 6, 3]
+
+        assert toil.ast(r""" quote [2, f] end """) == (
+            Ident("copy"), [(Ident("quote"), [[2, Ident("f")]])])
+        assert toil.ast(r""" quote [2, !a] end """) == [2, Ident("a")]
+        toil.walk(r""" def f() do quote [2, 3] end end; a := f(); push(a, 4) """)
+        assert toil.walk(r""" f() """) == [2, 3]
+        toil.walk(r""" def f() do quote [[1], 2] end end; a := f(); push(a[0], 9) """)
+        assert toil.walk(r""" f() """) == [[1], 2]
+        toil.walk(r""" def f() do quote {k: [1]} end end; a := f(); push(a.k, 9) """)
+        assert toil.walk(r""" f() """) == {'k': [1]}
+        toil.walk(r""" def f() do quote x + [1] end end; a := f(); push(a[1][1], 9) """)
+        assert toil.walk(r""" f() """) == (Ident("add"), [Ident("x"), [1]])
         with pytest.raises(AssertionError, match="Undefined variable"):
             toil.walk(r""" !(2 + 3) """)
 
@@ -1191,12 +1296,106 @@ class TestToil:
         with pytest.raises(AssertionError, match="Undefined variable"):
             toil.walk(r""" local_macro() """)
 
+    def test_macro_memoization(self):
+        toil = Interpreter(memoize_macros=True).init_env().stdlib()
+        stats = toil.macro_stats()
+        (_, [(_, [(_, [g1, _]), _, _]), (_, [(_, [g2, _]), _, _])]) = toil.ast(r""" (a and b) + (a and b) """)
+        assert g1 != g2
+        assert toil.macro_stats()["hits"] == stats["hits"] + 1
+        assert toil.walk(r""" a := 2; b := 3; [a and b, a and b, a or b] """) == [3, 3, 2]
+
+        toil.walk(r""" defmacro m(x) do quote !x + 1 end end """)
+        assert toil.walk(r""" m(2) """) == 3
+        toil.walk(r""" defmacro m(x) do quote !x + 2 end end """)
+        assert toil.walk(r""" m(2) """) == 4
+
+    def test_hash_cons(self):
+        toil = Interpreter(hash_cons=True).init_env().stdlib()
+        ast = toil.ast(r""" [f(x, [1]), f(x, [1]), quote g(y) end, quote g(y) end] """)
+        assert ast[0] is ast[1] and ast[2] is ast[3]
+        assert toil.walk(r""" def g() do [1, [2]] end; a := g(); push(a, 3); push(a[1], 4); [g(), a] """) == [
+            [1, [2]], [1, [2, 4], 3]]
+        assert toil.walk(r""" a := [quote [1] end, quote [1] end]; push(a[0], 2); a """) == [[1, 2], [1]]
+        assert toil.walk(r""" defmacro m(xs) do push(xs, 9); xs end; [m([1]), m([1])] """) == [[1, 9], [1, 9]]
+
+    def test_fold(self):
+        assert toil.folded(toil.ast(r""" if 2 == 2 then 4 + 5 else print(1) end """)).to_tuple() == 9
+        assert toil.folded(toil.ast(r""" while False do print(1) end """)).to_tuple() is None
+        assert toil.folded(toil.ast(r""" [len([1, 2]) * 2, a + 1] """)).to_tuple() == [
+            4, (Ident("add"), [Ident("a"), 1])]
+        assert toil.folded(toil.ast(r""" 1 / 0 """)).to_tuple() == (Ident("div"), [1, 0])
+        assert toil.folded(toil.ast(r""" def f(len) do len([1]) end """)).to_tuple() == (
+            Ident("define"), [Ident("f"), (Ident("func"), [[Ident("len")], (Ident("len"), [[1]])])])
+        assert toil.walk(r""" def f(len) do len([1]) end; f(func (x) do 5 end) """) == 5
+        assert toil.walk(r""" def g() do [1 + 1] end; a := g(); push(a, 3); g() """) == [2]
+        toil.walk(r""" len := func (x) do 42 end """)
+        assert toil.walk(r""" len([1]) """) == 42
+
+    def test_specialize(self):
+        assert toil.walk(r""" def f(a, b) do if a > 2 then a * b else b end end; g := specialize(f, 3); g(4) """) == 12
+        assert toil.walk(r""" g """)[1][1].to_tuple() == (Ident("mul"), [3, Ident("b")])
+        toil.walk(r""" def h(xs, y) do s := 0; for x in xs do s = s + x * y end; s end """)
+        assert toil.walk(r""" k := specialize(h, [1, 2, 3]); k(10) """) == 60
+        assert "while" not in repr(toil.walk(r""" k """)[1][1])
+        assert toil.walk(r""" def m(a) do a = a + 1; a end; specialize(m, 1)() """) == 2
+        assert toil.walk(r""" def c(n) do [] -> n end; specialize(c, 5)()() """) == 5
+        assert toil.walk(r""" def t(x) do match x case [a, *r] then [a, r] end end; specialize(t, [1, 2])() """) == [
+            1, [2]]
+        assert toil.walk(r""" specialize(func a do push(a, 1); len(a) end, [])() """) == 1
+        assert toil.walk(r""" l := []; g := specialize(func a do n := len(a); push(a, 1); n end, l); [g(), g()] """) == [0, 1]
+
+    def test_exits(self):
+        assert toil.walk(r""" def f(x) do match x case 1 then return(2) case _ then 3 end; 4 end; [f(1), f(5)] """) == [2, 4]
+        assert toil.walk(r""" def g() do scope try return(5) except _ then 6 end end; 7 end; g() """) == 5
+        assert toil.walk(r"""
+            def h() do
+                i := 0; while True do
+                    i = i + 1; j := 0;
+                    while True do j = j + 1; if j == 3 then break end end;
+                    if i < 4 then continue end;
+                    return([i, j])
+                end
+            end;
+            h()
+        """) == [4, 3]
+        assert toil.walk(r""" def k() do i := 0; while i < 1 do i = i + 1 then return(8) end; 9 end; k() """) == 8
+        assert toil.walk(r""" def m() do [if True then return(10) end, 11] end; m() """) == 10
+        assert toil.walk(r""" i := 0; while True do i = i + 1; x := if i > 2 then break end end; i """) == 3
+        assert toil.walk(r""" def n() do break end; i := 0; while True do i = i + 1; n() end; i """) == 1
+        assert toil.walk(r""" [if True then 12 end, scope 13 end] """) == [12, 13]
+
+    def test_tail_call(self):
+        assert toil.walk(r""" def count(n) do if n then count(n - 1) else "done" end end; count(1000000) """) == "done"
+        assert toil.walk(r"""
+            def even(n) do if n == 0 then True else scope m := n - 1; odd(m) end end end;
+            def odd(n) do if n == 0 then False else return(even(n - 1)) end end;
+            [even(10001), odd(10001)]
+        """) == [False, True]
+        assert toil.walk(r"""
+            def fail(n) do if n == 0 then raise("bottom") else fail(n - 1) end end;
+            def guard(n) do try fail(n) except e then [e] end end;
+            guard(5000)
+        """) == ["bottom"]
+        assert toil.walk(r""" def down(n) do if n == 0 then 0 else (n - 1).down() end end; down(5000) """) == 0
+
+    def test_trampoline(self):
+        assert toil.twalk(r""" def up(n) do if n == 0 then 0 else 1 + up(n - 1) end end; up(20000) """) == 20000
+        assert toil.twalk(r""" def nest(n) do if n == 0 then [] else [nest(n - 1)] end end; len(nest(5000)) """) == 1
+        assert toil.twalk(r"""
+            def dive(n) do if n == 0 then raise("bottom") else 1 + dive(n - 1) end end;
+            try dive(20000) except e then e end
+        """) == "bottom"
+        fib = r""" def fib(n) do if n < 2 then n else fib(n - 1) + fib(n - 2) end end; [fib(10), fib.apply([5])] """
+        assert toil.twalk(fib) == toil.walk(fib) == [55, 5]
+
     def test_syntax(self):
         assert toil.walk(r""" syntax myadd, EXPR, to, EXPR, end call add end """) is None
         assert toil.ast(r""" myadd 2 * 3 to 4 * 5 end """) == (
             Ident("add"), [(Ident("mul"), [2, 3]), (Ident("mul"), [4, 5])]
         )
         assert toil.walk(r""" myadd 2 * 3 to 4 * 5 end """) == 26
+        assert toil.walk(r""" syntax mysub, EXPR, "from", EXPR, end call sub end """) is None
+        assert toil.walk(r""" mysub 5 "from" 3 end """) == 2
 
         toil.walk(r"""
             defmacro_(when_(cond, body), quote if !cond then !body else None end end);
@@ -1225,6 +1424,11 @@ class TestToil:
         with pytest.raises(Exception, match="Expected do"):
             toil.ast(""" optstx opt 2 + 3 opt 4 + 5 do 6 end """)
 
+        toil.walk(r""" syntax lst, EXPR, *["and", EXPR], end call list end """)
+        assert toil.walk(r""" lst 1 "and" 2 end """) == [1, [[2]]]
+        toil.walk(r""" syntax opt_lst, EXPR, +["or", EXPR], end call list end """)
+        assert toil.walk(r""" opt_lst 1 "or" 2 end """) == [1, [2]]
+
     def test_whitespace(self):
         assert toil.walk(r"""   2 """) == 2
         assert toil.walk(r""" 2   """) == 2
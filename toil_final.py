@@ -1,14 +1,23 @@
-from typing import Any
+import re, sys, weakref
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from types import GeneratorType
+from typing import Any, Callable, Iterable, Iterator
 
 class Ident:
+    __slots__ = ("name", "__weakref__")
     __match_args__ = ("name",)
+    _table: weakref.WeakValueDictionary[str, 'Ident'] = weakref.WeakValueDictionary()
 
-    def __init__(self, name: str) -> None: self.name = name
-    def __hash__(self): return hash(self.name)
+    def __new__(cls, name: str) -> 'Ident':
+        if (ident := cls._table.get(name)) is None:
+            ident = cls._table[name] = super().__new__(cls)
+            ident.name = sys.intern(name)
+        return ident
+
+    def __reduce__(self): return (Ident, (self.name,))
     def __repr__(self): return self.name
     def __str__(self): return self.name
-    def __eq__(self, other):
-        return isinstance(other, Ident) and self.name == other.name
 
 type SyntaxElement = Ident | tuple[Ident, list[SyntaxElement]]
 type SyntaxForm = list[SyntaxElement]
@@ -21,6 +30,7 @@ type Inst = tuple
 type Code = list[Inst]
 type Value = Any
 type SymbolTable = dict[str, Value]
+type Spans = dict[int, tuple[int, int]]
 
 
 def is_ident_first(c): return c.isalpha() or c == "_"
@@ -28,176 +38,229 @@ def is_ident_rest(c): return c.isalnum() or c == "_"
 def is_ident(s): return is_ident_first(s[0])
 def toil_type(expr): return type(expr).__name__
 
+def trampoline(gen):
+    if type(gen) is not GeneratorType: return gen
+    stack, val = [gen], None
+    while stack:
+        try:
+            sub = stack[-1].send(val)
+        except StopIteration as stop:
+            stack.pop(); val = stop.value
+        else:
+            if type(sub) is GeneratorType: stack.append(sub); val = None
+            else: val = sub
+    return val
+
 
 class Scanner:
+    _pattern = re.compile(r"""
+        (?P<space>\s+|\#[^\n]*)
+        | (?P<operator>->|!!|[!=<>:]=|[-!=<>:+*/%()\[\]{}|.,;])
+        | (?P<ident>[^\W\d]\w*)
+        | (?P<number>\d+)
+        | '(?P<raw_string>[^']*)'
+        | "(?P<string>(?:[^"\\]|\\.)*)"
+        | (?P<unterminated>['"])
+        | (?P<invalid>.)
+    """, re.VERBOSE | re.DOTALL)
+    _escape = re.compile(r"\\(.)", re.DOTALL)
+    _keywords = {"None": None, "True": True, "False": False}
+
     def __init__(self, src: Source) -> None:
         self._src = src
-        self._pos = 0
         self._tokens: list[Token] = []
+        self._actions = {
+            "operator": Ident, "ident": self._ident, "number": int,
+            "raw_string": str, "string": self._string,
+            "unterminated": self._unterminated, "invalid": self._invalid
+        }
 
     def tokenize(self) -> list[Token]:
+        tokens, actions = self._tokens, self._actions
+        for m in self._pattern.finditer(self._src):
+            if (kind := m.lastgroup) != "space":
+                tokens.append(actions[kind](m[kind]))
+        tokens.append(Ident("$EOF"))
+        return tokens
+
+    def tokenize_columns(self) -> 'TokenBuffer':
+        buffer = TokenBuffer(self._src)
+        for m in self._pattern.finditer(self._src):
+            match m.lastgroup:
+                case "space": pass
+                case "string" if "\\" in (text := m["string"]):
+                    buffer.append("string", m.start(), m.end(), self._string(text))
+                case "unterminated" | "invalid" as kind: self._actions[kind](m[kind])
+                case kind: buffer.append(kind, m.start(), m.end())
+        buffer.append("eof", len(self._src), len(self._src))
+        return buffer
+
+    def _ident(self, text):
+        return self._keywords[text] if text in self._keywords else Ident(text)
+
+    def _string(self, text):
+        if "\\" not in text: return text
+        return self._escape.sub(lambda m: "\n" if m[1] == "n" else m[1], text)
+
+    def _unterminated(self, quote):
+        assert False, "Unterminated string @ " + \
+            ("_raw_string()" if quote == "'" else "_string()")
+
+    def _invalid(self, c):
+        assert False, f"Invalid character @ tokenize(): {c}"
+
+class StreamScanner(Scanner):
+    def __init__(self, source: Iterable[str], chunk_size: int = 1 << 16) -> None:
+        super().__init__("")
+        self._chunks = iter(lambda: source.read(chunk_size), "") \
+            if hasattr(source, "read") else iter(source)
+
+    def tokenize(self) -> Iterator[Token]:
+        buf, pos, eof = "", 0, False
         while True:
-            while self._current_char().isspace(): self._advance()
-
-            if self._current_char() == "#":
-                while self._current_char() not in ("\n", "$EOF"):
-                    self._advance()
+            m = self._pattern.match(buf, pos)
+            if not eof and (m is None or m.end() == len(buf) or
+                            m.lastgroup == "unterminated"):
+                if (chunk := next(self._chunks, None)) is None: eof = True
+                else: buf, pos = buf[pos:] + chunk, 0
                 continue
+            if m is None: break
+            pos = m.end()
+            if (kind := m.lastgroup) != "space":
+                yield self._actions[kind](m[kind])
+        yield Ident("$EOF")
 
-            match self._current_char():
-                case "$EOF":
-                    self._tokens.append(Ident("$EOF"))
-                    break
-                case c if c.isnumeric(): self._number()
-                case "'": self._raw_string()
-                case "\"": self._string()
-                case c if is_ident_first(c): self._ident()
-                case "-": self._two_char_operator(">")
-                case "!": self._two_char_operator("!=")
-                case c if c in "=<>:": self._two_char_operator("=")
-                case c if c in "+*/%()[]{}|.,;":
-                    self._tokens.append(Ident(c))
-                    self._advance()
-                case invalid:
-                    assert False, f"Invalid character @ tokenize(): {invalid}"
-
-        return self._tokens
-
-    def _number(self):
-        start = self._pos
-        while self._current_char().isnumeric(): self._advance()
-        self._tokens.append(int(self._src[start:self._pos]))
-
-    def _raw_string(self):
-        self._advance()
-        start = self._pos
-        while (c := self._current_char()) != "'":
-            assert c != "$EOF", f"Unterminated string @ _raw_string()"
-            self._advance()
-        self._tokens.append(self._src[start:self._pos])
-        self._advance()
-
-    def _string(self):
-        self._advance()
-        s = []
-        while (c := self._current_char()) != '"':
-            assert c != "$EOF", f"Unterminated string @ _string()"
-            if c == "\\":
-                self._advance()
-                c = self._current_char()
-                assert c != "$EOF", f"Unterminated string @ _string()"
-                match c:
-                    case "n": s.append("\n")
-                    case _: s.append(c)
-            else:
-                s.append(c)
-            self._advance()
-        self._advance()
-        self._tokens.append("".join(s))
-
-    def _ident(self):
-        start = self._pos
-        self._advance()
-        while is_ident_rest(self._current_char()): self._advance()
-        token = self._src[start:self._pos]
-        match token:
-            case "None": self._tokens.append(None)
-            case "True": self._tokens.append(True)
-            case "False": self._tokens.append(False)
-            case _: self._tokens.append(Ident(token))
-
-    def _two_char_operator(self, successors):
-        start = self._pos
-        self._advance()
-        if self._current_char() in successors: self._advance()
-        self._tokens.append(Ident(self._src[start:self._pos]))
-
-    def _advance(self): self._pos += 1
-
-    def _current_char(self):
-        if self._pos < len(self._src):
-            return self._src[self._pos]
-        else:
-            return "$EOF"
+class TokenBuffer:
+    _kinds = ["operator", "ident", "number", "raw_string", "string", "eof"]
+    _codes = {kind: code for code, kind in enumerate(_kinds)}
+
+    def __init__(self, src: Source) -> None:
+        self._src = src
+        self.kinds, self.starts, self.ends = array("B"), array("I"), array("I")
+        self._values: dict[int, Token] = {}
+        self._decoders = [Ident, self._ident, int, self._quoted, self._quoted, self._eof]
+
+    def __len__(self): return len(self.kinds)
+
+    def __getitem__(self, i: int) -> Token:
+        if i in self._values: return self._values[i]
+        return self._decoders[self.kinds[i]](self._src[self.starts[i]:self.ends[i]])
+
+    def __iter__(self) -> Iterator[Token]:
+        src, values, decoders = self._src, self._values, self._decoders
+        for i, (kind, start, end) in enumerate(zip(self.kinds, self.starts, self.ends)):
+            yield values[i] if i in values else decoders[kind](src[start:end])
+
+    def append(self, kind: str, start: int, end: int, value: Token = None) -> None:
+        if value is not None: self._values[len(self.kinds)] = value
+        self.kinds.append(self._codes[kind])
+        self.starts.append(start); self.ends.append(end)
+
+    def kind(self, i: int) -> str: return self._kinds[self.kinds[i]]
+    def span(self, i: int) -> tuple[int, int]: return (self.starts[i], self.ends[i])
+    def text(self, i: int) -> str: return self._src[self.starts[i]:self.ends[i]]
+
+    def _ident(self, text):
+        return Scanner._keywords[text] if text in Scanner._keywords else Ident(text)
+
+    def _quoted(self, text): return text[1:-1]
+    def _eof(self, text): return Ident("$EOF")
 
 
 class Parser:
-    def __init__(self, tokens: list[Token], syntax_rules: SyntaxRules) -> None:
-        self._tokens = tokens
+    _eof, _semicolon, _comma = Ident("$EOF"), Ident(";"), Ident(",")
+    _postfix_ops = (Ident("("), Ident("["), Ident("."))
+    _func, _syntax_keyword = Ident("func"), Ident("syntax")
+    _binary_ops = {
+        Ident(op): (level, right_level, Ident(name))
+        for level, right_level, ops in (
+            (1, 1, {":=": "define", "=": "assign"}),
+            (2, 2, {"->": "func"}),
+            (3, 4, {"and": "and", "or": "or"}),
+            (5, 6, {"==": "equal", "!=": "not_equal", "<": "less", ">": "greater",
+                    "<=": "less_equal", ">=": "greater_equal", "|": "|"}),
+            (6, 7, {"+": "add", "-": "sub"}),
+            (7, 8, {"*": "mul", "/": "div", "%": "mod"}),
+        )
+        for op, name in ops.items()
+    }
+    _prefix_ops = {
+        Ident(op): (level, Ident(name))
+        for level, ops in (
+            (4, {"not": "not"}),
+            (8, {"-": "neg", "+": "+", "*": "*", "!": "!", "!!": "!!"}),
+        )
+        for op, name in ops.items()
+    }
+
+    def __init__(self, tokens: Iterable[Token], syntax_rules: SyntaxRules) -> None:
+        self._tokens = iter(tokens)
         self._syntax_rules = syntax_rules
-        self._pos = 0
+        self._token = next(self._tokens)
 
     def parse(self) -> Expr:
-        expr = self._expression()
-        assert self._current_token() == Ident("$EOF"), \
+        expr = trampoline(self._expression())
+        assert self._current_token() is self._eof, \
             f"Extra token @ parse(): {self._current_token()}"
         return expr
 
-    def _expression(self): return self._sequence()
+    def _expression(self):
+        if type(first := self._binary(1)) is not GeneratorType and self._current_token() is not self._semicolon:
+            return first
+        return self._sequence_from(first)
 
-    def _sequence(self):
-        exprs = [self._define_assign()]
-        while self._current_token() == Ident(";"):
+    def _sequence_from(self, first):
+        exprs = [(yield first)]
+        while self._current_token() is self._semicolon:
             self._current_and_advance()
-            exprs.append(self._define_assign())
+            exprs.append((yield self._binary(1)))
         return exprs[0] if len(exprs) == 1 else (Ident("seq"), exprs)
 
-    def _define_assign(self):
-        return self._binary_right({
-            Ident(":="): Ident("define"), Ident("="): Ident("assign")
-        }, self._arrow)
+    def _binary(self, min_level):
+        token = self._current_token()
+        if (prefix := self._prefix_ops.get(token)) and prefix[0] >= min_level:
+            return self._operand(min_level)
+        if type(token) is Ident and (token is self._syntax_keyword or
+                                     token in self._syntax_rules or not is_ident(token.name)):
+            return self._operand(min_level)
+        left = self._current_and_advance()
+        if (token := self._current_token()) in self._postfix_ops or \
+                (binary := self._binary_ops.get(token)) and binary[0] >= min_level:
+            return self._operators(left, min_level)
+        return left
 
-    def _arrow(self):
-        left = self._and_or()
-        if self._current_token() == Ident("->"):
+    def _operand(self, min_level):
+        token = self._current_token()
+        if (prefix := self._prefix_ops.get(token)) and prefix[0] >= min_level:
             self._current_and_advance()
-            body_expr = self._arrow()
-            params = left if isinstance(left, list) else [left]
-            return (Ident("func"), [params, body_expr])
+            left = (prefix[1], [(yield self._binary(prefix[0]))])
+        else:
+            left = yield self._primary()
+        return (yield self._operators(left, min_level))
+
+    def _operators(self, left, min_level):
+        if self._current_token() in self._postfix_ops:
+            left = yield self._call_index_dot(left)
+        while (binary := self._binary_ops.get(self._current_token())) and \
+                binary[0] >= min_level:
+            level, right_level, op = binary
+            self._current_and_advance()
+            right = yield self._binary(right_level)
+            if op is self._func:
+                left = (op, [left if isinstance(left, list) else [left], right])
+            else:
+                left = (op, [left, right])
         return left
 
-    def _and_or(self):
-        return self._binary_left({
-            Ident("and"): Ident("and"), Ident("or"): Ident("or"),
-        }, self._not)
-
-    def _not(self):
-        return self._unary({ Ident("not"): Ident("not") }, self._comparison)
-
-    def _comparison(self):
-        return self._binary_left({
-            Ident("=="): Ident("equal"), Ident("!="): Ident("not_equal"),
-            Ident("<"): Ident("less"), Ident(">"): Ident("greater"),
-            Ident("<="): Ident("less_equal"), Ident(">="): Ident("greater_equal"),
-            Ident("|"): Ident("|")
-        }, self._add_sub)
-
-    def _add_sub(self):
-        return self._binary_left({
-            Ident("+"): Ident("add"), Ident("-"): Ident("sub")
-        }, self._mul_div_mod)
-
-    def _mul_div_mod(self):
-        return self._binary_left({
-            Ident("*"): Ident("mul"), Ident("/"): Ident("div"), Ident("%"): Ident("mod")
-        }, self._unaries)
-
-    def _unaries(self):
-        return self._unary({
-            Ident("-"): Ident("neg"), Ident("+"): Ident("+"), Ident("*"): Ident("*"),
-            Ident("!"): Ident("!"), Ident("!!"): Ident("!!")
-        }, self._call_index_dot)
-
-    def _call_index_dot(self):
-        target = self._primary()
-        while (op := self._current_token()) in (Ident("("), Ident("["), Ident(".")):
+    def _call_index_dot(self, target):
+        while (op := self._current_token()) in self._postfix_ops:
             self._current_and_advance()
             match op:
                 case Ident("("):
-                    target = (target, self._comma_separated_exprs(Ident(")")))
+                    target = (target, (yield self._comma_separated_exprs(Ident(")"))))
                     self._consume(Ident(")"))
                 case Ident("["):
-                    index = self._expression()
+                    index = yield self._expression()
                     self._consume(Ident("]"))
                     target = (Ident("index"), [target, index])
                 case Ident("."):
@@ -215,20 +278,20 @@ class Parser:
             case Ident("{"): return self._dict()
             case Ident("syntax"): return self._syntax()
             case Ident() as keyword  if keyword in self._syntax_rules:
-                return self._apply_syntax(self._syntax_rules[keyword])
+                return self._syntax_rules[keyword](self)
             case Ident(name) if is_ident(name): return self._current_and_advance()
             case unexpected:
                 assert False, f"Unexpected token @ _primary(): {unexpected}"
 
     def _group(self):
         self._current_and_advance()
-        expr = self._expression()
+        expr = yield self._expression()
         self._consume(Ident(")"))
         return expr
 
     def _list(self):
         self._current_and_advance()
-        exprs = self._comma_separated_exprs(Ident("]"))
+        exprs = yield self._comma_separated_exprs(Ident("]"))
         self._consume(Ident("]"))
         return exprs
 
@@ -242,97 +305,86 @@ class Parser:
                     self._current_and_advance()
                     if self._current_token() == Ident(":"):
                         self._current_and_advance()
-                        dic[key] = self._expression()
+                        dic[key] = yield self._expression()
                     else:
                         dic[key] = Ident(key)
                 case str():
                     key = self._current_and_advance()
                     self._consume(Ident(":"))
-                    dic[key] = self._expression()
+                    dic[key] = yield self._expression()
                 case invalid:
                     assert False, f"Invalid key @ _dict(): {invalid}"
 
         self._current_and_advance()
         dic = {}
         if self._current_token() != Ident("}"):
-            _parse_key_value(dic)
+            yield _parse_key_value(dic)
             while self._current_token() != Ident("}"):
                 self._consume(Ident(","))
-                _parse_key_value(dic)
+                yield _parse_key_value(dic)
         self._current_and_advance()
         return dic
 
     def _syntax(self):
         self._current_and_advance()
-        syntax = self._comma_separated_exprs(Ident("call"))
+        syntax = yield self._comma_separated_exprs(Ident("call"))
         keyword, *form = syntax
         assert isinstance(keyword, Ident), f"Invalid keyword @ _syntax(): {keyword}"
         self._consume(Ident("call"))
-        op = self._expression()
+        op = yield self._expression()
         assert isinstance(op, Ident), f"Invalid operator @ _syntax(): {op}"
         self._consume(Ident("end"))
-        self._syntax_rules[keyword] = (op, form)
+        self._syntax_rules[keyword] = self._compile_syntax(op, form)
         return None
 
-    def _apply_syntax(self, rule):
-        def match_args(form):
+    def _compile_syntax(self, operator, form):
+        match_args = self._compile_form(form)
+        def apply_syntax(parser):
+            parser._current_and_advance()
+            return (operator, (yield match_args(parser)))
+        return apply_syntax
+
+    def _compile_form(self, form):
+        steps = [self._compile_element(current, next)
+                 for current, next in zip(form, form[1:] + [None])]
+        def match_args(parser):
             args = []
-            for current, next in zip(form, form[1:] + [None]):
-                match current:
-                    case Ident("EXPR"):
-                        args.append(self._expression())
-                    case Ident("EXPRS"):
-                        args.append(self._comma_separated_exprs(next))
-                    case (Ident("*"), [subform]):
-                        subargs = []
-                        while self._current_token() == subform[0]:
-                            subargs.append(match_args(subform))
-                        args.append(subargs)
-                    case (Ident("+"), [subform]):
-                        if self._current_token() == subform[0]:
-                            args.append(match_args(subform))
-                        else:
-                            args.append([])
-                    case delimiter:
-                        self._consume(delimiter)
+            for step in steps:
+                if (arg := step(parser)) is not None: args.append((yield arg))
             return args
-
-        self._current_and_advance()
-        operator, form = rule
-        return (operator, match_args(form))
-
-    def _binary_left(self, ops, sub_elem):
-        left = sub_elem()
-        while type(op := self._current_token()) is Ident and op in ops:
-            self._current_and_advance()
-            right = sub_elem()
-            left = (ops[op], [left, right])
-        return left
-
-    def _binary_right(self, ops, sub_elem):
-        left = sub_elem()
-        if type(self._current_token()) is Ident and \
-                (op := self._current_token()) in ops:
-            self._current_and_advance()
-            right = self._binary_right(ops, sub_elem)
-            return (ops[op], [left, right])
-        return left
-
-    def _unary(self, ops, sub_elem):
-        if type(self._current_token()) is Ident and \
-                (op := self._current_token()) in ops:
-            self._current_and_advance()
-            return (ops[op], [self._unary(ops, sub_elem)])
-        else:
-            return sub_elem()
+        return match_args
+
+    def _compile_element(self, element, next):
+        match element:
+            case Ident("EXPR"):
+                return lambda parser: parser._sequence_from(parser._binary(1))
+            case Ident("EXPRS"):
+                return lambda parser: parser._comma_separated_exprs(next)
+            case (Ident("*"), [subform]):
+                first, match_subform = subform[0], self._compile_form(subform)
+                def repeat(parser):
+                    subargs = []
+                    while parser._current_token() == first:
+                        subargs.append((yield match_subform(parser)))
+                    return subargs
+                return repeat
+            case (Ident("+"), [subform]):
+                first, match_subform = subform[0], self._compile_form(subform)
+                def optional(parser):
+                    if parser._current_token() != first: return []
+                    return (yield match_subform(parser))
+                return optional
+            case delimiter:
+                def consume(parser): parser._consume(delimiter)
+                return consume
 
     def _comma_separated_exprs(self, terminator):
         cse = []
         if self._current_token() != terminator:
-            cse.append(self._expression())
-            while self._current_token() == Ident(","):
+            cse.append((yield self._expression()))
+            while self._current_token() is self._comma:
                 self._current_and_advance()
-                cse.append(self._expression())
+                cse.append((yield self._expression()))
         return cse
 
     def _consume(self, expected):
@@ -340,14 +392,114 @@ class Parser:
             f"Expected {expected} @ _consume(): {self._current_token()}"
         return self._current_and_advance()
 
-    def _current_token(self): return self._tokens[self._pos]
+    def _current_token(self): return self._token
 
     def _current_and_advance(self):
-        self._pos += 1
-        return self._tokens[self._pos - 1]
+        token = self._token
+        self._token = next(self._tokens, token)
+        return token
+
+
+class SpanParser(Parser):
+    def __init__(self, buffer: TokenBuffer, syntax_rules: SyntaxRules, spans: Spans) -> None:
+        super().__init__(buffer, syntax_rules)
+        self._buffer, self._spans, self._index = buffer, spans, 0
+
+    def _binary(self, min_level):
+        start = self._index
+        expr = yield super()._binary(min_level)
+        if type(expr) is tuple:
+            self._spans[id(expr)] = (self._buffer.starts[start],
+                                     self._buffer.ends[self._index - 1])
+        return expr
+
+    def parse_forms(self) -> list[tuple[Expr, int, int]]:
+        forms = []
+        if self._current_token() is not self._eof:
+            forms.append(self._form())
+            while self._current_token() is self._semicolon:
+                self._current_and_advance()
+                forms.append(self._form())
+        assert self._current_token() is self._eof, \
+            f"Extra token @ parse_forms(): {self._current_token()}"
+        return forms
+
+    def _form(self):
+        start = self._index
+        expr = trampoline(self._binary(1))
+        return expr, start, self._index
+
+    def _current_and_advance(self):
+        self._index += 1
+        return super()._current_and_advance()
+
+
+class HashCons:
+    def __init__(self) -> None:
+        self._table: dict[tuple, Expr] = {}
+        self._shared: set[int] = set()
+
+    def __len__(self) -> int: return len(self._table)
+
+    def share(self, expr: Expr) -> Expr:
+        stack, shared = [(expr, False)], []
+        while stack:
+            expr, built = stack.pop()
+            if (t := type(expr)) is not list and t is not tuple and t is not dict or id(expr) in self._shared:
+                shared.append(expr)
+            elif not built:
+                stack.append((expr, True))
+                stack.extend((elem, False) for elem in reversed(expr.values() if t is dict else expr))
+            else:
+                elems = shared[len(shared) - len(expr):]; del shared[len(shared) - len(expr):]
+                shared.append(self._intern(expr, elems))
+        return shared[0]
+
+    def _intern(self, expr, elems):
+        key, mask = [type(expr), tuple(expr) if type(expr) is dict else None, 0], 0
+        for i, e in enumerate(elems):
+            if (t := type(e)) is list or t is tuple or t is dict: key.append(id(e)); mask |= 1 << i
+            else: key.append((t, e) if t is bool else e)
+        key[2] = mask
+        if (canon := self._table.get(key := tuple(key))) is None:
+            olds = expr.values() if type(expr) is dict else expr
+            if any(new is not old for new, old in zip(elems, olds)):
+                match expr:
+                    case dict(): expr = dict(zip(expr, elems))
+                    case tuple(): expr = tuple(elems)
+                    case list(): expr = elems
+            canon = self._table[key] = expr
+            self._shared.add(id(canon))
+        return canon
+
+    def unshare(self, expr: Expr) -> Expr:
+        stack = []
+        expr = self._shallow(expr, stack)
+        while stack:
+            copied = stack.pop()
+            for key, elem in (copied.items() if type(copied) is dict else enumerate(copied)):
+                if (t := type(elem)) is list or t is dict: stack.append(elem := elem.copy()); copied[key] = elem
+                elif t is tuple: copied[key] = self._shallow(elem, stack)
+        return expr
+
+    def _shallow(self, expr, stack):
+        if (t := type(expr)) is list or t is dict: stack.append(expr := expr.copy())
+        elif t is tuple: expr = tuple([self._shallow(elem, stack) for elem in expr])
+        return expr
+
+
+class SharingParser(Parser):
+    def __init__(self, tokens: Iterable[Token], syntax_rules: SyntaxRules, hash_cons: HashCons) -> None:
+        super().__init__(tokens, syntax_rules)
+        self._hash_cons = hash_cons
+
+    def parse(self) -> Expr:
+        return self._hash_cons.share(super().parse())
 
 
 class Environment:
+    _versions: dict[str, list[int]] = {}
+
     def __init__(self, parent: 'Environment | None' = None) -> None:
         self._parent = parent
         self._vars = {}
@@ -360,12 +512,15 @@ class Environment:
 
     def define(self, name: str, val: Value) -> Value:
         self._vars[name] = val
+        if (version := Environment._versions.get(name)) is not None: version[0] += 1
         return val
 
     def lookup(self, name: str) -> SymbolTable | None:
-        if name in self._vars: return self._vars
-        elif self._parent is not None: return self._parent.lookup(name)
-        else: return None
+        env = self
+        while env is not None:
+            if name in env._vars: return env._vars
+            env = env._parent
+        return None
 
     def val(self, name: str) -> Value:
         vars = self.lookup(name)
@@ -376,6 +531,7 @@ class Environment:
         vars = self.lookup(name)
         assert vars is not None, f"Undefined variable @ assign(): {name}"
         vars[name] = val
+        if (version := Environment._versions.get(name)) is not None: version[0] += 1
         return val
 
     def bind(self, pattern, value):
@@ -455,101 +611,1305 @@ class Environment:
         return True
 
 
+class Slots:
+    __slots__ = ("_index", "_values")
+
+    def __init__(self, index: dict[str, int], values: list[Value]) -> None:
+        self._index, self._values = index, values
+
+    def __contains__(self, name):
+        return (i := self._index.get(name)) is not None and self._values[i] is not Slots.unset
+
+    def __getitem__(self, name): return self._values[self._index[name]]
+    def __setitem__(self, name, val): self._values[self._index[name]] = val
+
+    def __iter__(self):
+        return (name for name, i in self._index.items() if self._values[i] is not Slots.unset)
+
+    unset = object()
+
+
+class SlotEnvironment(Environment):
+    def __init__(self, parent: Environment | None, index: dict[str, int]) -> None:
+        self._parent = parent
+        self._globals = getattr(parent, "_globals", parent)
+        self._index = index
+        self._slots = [Slots.unset] * len(index)
+
+    @property
+    def _vars(self): return Slots(self._index, self._slots)
+
+    @staticmethod
+    def adopt(env: Environment, index: dict[str, int]) -> 'SlotEnvironment':
+        slot_env = SlotEnvironment(env._parent, index)
+        for name in env._vars: slot_env.define(name, env._vars[name])
+        return slot_env
+
+    def lookup(self, name: str) -> SymbolTable | None:
+        env = self
+        while type(env) is SlotEnvironment:
+            if (i := env._index.get(name)) is not None and env._slots[i] is not Slots.unset:
+                return env._vars
+            env = env._parent
+        return None if env is None else env.lookup(name)
+
+    def define(self, name: str, val: Value) -> Value:
+        i = self._index.get(name)
+        assert i is not None, f"Undeclared variable @ define(): {name}"
+        self._slots[i] = val
+        return val
+
+
+class InlineCache:
+    __slots__ = ("env", "version", "cell", "val")
+
+    def __init__(self) -> None:
+        self.env = self.version = self.cell = self.val = None
+
+    def __repr__(self): return "InlineCache()"
+    def __eq__(self, other): return type(other) is InlineCache
+    __hash__ = object.__hash__
+
+    def fill(self, env: Environment, name: str) -> Value:
+        holder = env
+        while type(holder) is Environment:
+            if name in holder._vars:
+                self.env, self.cell = env, Environment._versions.setdefault(name, [0])
+                self.version, self.val = self.cell[0], holder._vars[name]
+                return self.val
+            holder = holder._parent
+        return env.val(name)
+
+
+class Matcher:
+    __slots__ = ("pattern", "frame", "bind")
+
+    def __init__(self, pattern: Expr, frame: dict[str, int] | None = None) -> None:
+        self.pattern, self.frame, self.bind = pattern, frame, Matcher._compile(pattern, frame)
+
+    def __reduce__(self): return (Matcher, (self.pattern, self.frame))
+    def __repr__(self): return f"Matcher({self.pattern!r})"
+
+    def __eq__(self, other):
+        return type(other) is Matcher and self.pattern == other.pattern and self.frame == other.frame
+
+    @staticmethod
+    def _compile(pattern, frame):
+        match pattern:
+            case Ident(name) if frame is not None:
+                index = frame[name]
+                def bind_slot(env, value): env._slots[index] = value; return True
+                return bind_slot
+            case Ident(name):
+                def bind_name(env, value): env.define(name, value); return True
+                return bind_name
+            case list():
+                return Matcher._list(pattern, frame)
+            case dict():
+                return Matcher._dict(pattern, frame)
+            case (Ident("|"), [left_pat, right_pat]):
+                left, right = Matcher._compile(left_pat, frame), Matcher._compile(right_pat, frame)
+                return lambda env, value: left(env, value) or right(env, value)
+            case (Ident("Ident"), [name_pat]):
+                name = Matcher._compile(name_pat, frame)
+                return lambda env, value: type(value) is Ident and name(env, value.name)
+            case (Ident("tuple"), expr_pats):
+                elems, n = [Matcher._compile(p, frame) for p in expr_pats], len(expr_pats)
+                return lambda env, value: type(value) is tuple and len(value) == n and \
+                    all(elem(env, v) for elem, v in zip(elems, value))
+            case (Ident(typ), [val_pat]):
+                val = Matcher._compile(val_pat, frame)
+                return lambda env, value: type(value).__name__ == typ and val(env, value)
+            case _:
+                typ = type(pattern)
+                return lambda env, value: type(value) is typ and value == pattern
+
+    @staticmethod
+    def _list(pattern, frame):
+        stars = [i for i, p in enumerate(pattern) if Matcher._rest_name(p) is not None]
+        if len(stars) > 1: return lambda env, value: False
+
+        if not stars:
+            n = len(pattern)
+            if frame is not None and all(type(p) is Ident for p in pattern):
+                indexes = [frame[p.name] for p in pattern]
+                def bind_slots(env, value):
+                    if type(value) is not list or len(value) != n: return False
+                    slots = env._slots
+                    for index, v in zip(indexes, value): slots[index] = v
+                    return True
+                return bind_slots
+            elems = [Matcher._compile(p, frame) for p in pattern]
+            def bind_list(env, value):
+                if type(value) is not list or len(value) != n: return False
+                for elem, v in zip(elems, value):
+                    if not elem(env, v): return False
+                return True
+            return bind_list
+
+        star = stars[0]
+        before = [Matcher._compile(p, frame) for p in pattern[:star]]
+        after = [Matcher._compile(p, frame) for p in pattern[star + 1:]]
+        rest = Matcher._compile(Ident(Matcher._rest_name(pattern[star])), frame)
+        n = len(pattern) - 1
+        def bind_rest(env, value):
+            if type(value) is not list or len(value) < n: return False
+            for elem, v in zip(before, value):
+                if not elem(env, v): return False
+            end = len(value) - len(after)
+            rest(env, value[star:end])
+            for elem, v in zip(after, value[end:]):
+                if not elem(env, v): return False
+            return True
+        return bind_rest
+
+    @staticmethod
+    def _dict(pattern, frame):
+        items = [(key, Matcher._compile(p, frame)) for key, p in pattern.items() if key != "*"]
+        keys = {key for key, _ in items}
+        rest = Matcher._compile(pattern["*"], frame) if "*" in pattern else None
+        def bind_dict(env, value):
+            if type(value) is not dict: return False
+            for key, item in items:
+                if key not in value or not item(env, value[key]): return False
+            if rest is not None: rest(env, {key: val for key, val in value.items() if key not in keys})
+            return True
+        return bind_dict
+
+    @staticmethod
+    def _rest_name(pattern):
+        match pattern:
+            case (Ident("*"), [Ident(rest_name)]): return rest_name
+        return None
+
+
+class Switch:
+    __slots__ = ("cases", "frame", "_binds", "_shapes", "_tables")
+
+    def __init__(self, cases: list[tuple[Expr, Any]], frame: dict[str, int] | None = None) -> None:
+        self.cases, self.frame = cases, frame
+        self._binds = [(Matcher(pat, frame).bind, target) for pat, target in cases]
+        self._shapes = [Switch._shape(pat) for pat, _ in cases]
+        self._tables = ({}, {}, {}) if sum(shapes is not None for shapes in self._shapes) > 1 else None
+
+    def __reduce__(self): return (Switch, (self.cases, self.frame))
+    def __repr__(self): return f"Switch({[pat for pat, _ in self.cases]!r})"
+
+    def __eq__(self, other):
+        return type(other) is Switch and self.cases == other.cases and self.frame == other.frame
+
+    def candidates(self, value: Value) -> list[tuple[Callable[[Environment, Value], bool], Any]]:
+        if self._tables is None: return self._binds
+        typ = type(value)
+        if typ is tuple and value and type(value[0]) is Ident: table, key, kind = self._tables[0], value[0], "tuple"
+        elif typ is Ident: table, key, kind = self._tables[1], value, "Ident"
+        else: table, key, kind = self._tables[2], typ, typ.__name__
+        if (binds := table.get(key)) is None:
+            head = None if key is typ else key.name
+            binds = table[key] = [
+                bind for bind, shapes in zip(self._binds, self._shapes)
+                if shapes is None or (kind, None) in shapes or (kind, head) in shapes]
+        return binds
+
+    @staticmethod
+    def _shape(pattern):
+        match pattern:
+            case Ident(): return None
+            case list(): return [("list", None)]
+            case dict(): return [("dict", None)]
+            case (Ident("|"), [left_pat, right_pat]):
+                left, right = Switch._shape(left_pat), Switch._shape(right_pat)
+                return None if left is None or right is None else left + right
+            case (Ident("Ident"), [str(name)]): return [("Ident", name)]
+            case (Ident("tuple"), [(Ident("Ident"), [str(name)]), *_]): return [("tuple", name)]
+            case (Ident("tuple"), _): return [("tuple", None)]
+            case (Ident(typ), [_]): return [(typ, None)]
+            case _: return [(type(pattern).__name__, None)]
+
+
+class Node:
+    __slots__ = ("span", "_closure")
+
+    def __repr__(self): return repr(self.to_tuple())
+
+    def to_tuple(self) -> Expr: return trampoline(self._tuple())
+
+    @staticmethod
+    def _tuples(nodes):
+        exprs = []
+        for node in nodes: exprs.append((yield node._tuple()))
+        return exprs
+
+    @staticmethod
+    def _optional(node):
+        return [] if node is None else [(yield node._tuple())]
+
+class Const(Node):
+    __slots__ = ("value",)
+    def __init__(self, value, span=None): self.value, self.span = value, span
+    def _tuple(self): return self.value
+
+class Var(Node):
+    __slots__ = ("name",)
+    def __init__(self, name, span=None): self.name, self.span = name, span
+    def _tuple(self): return Ident(self.name)
+
+class Continue(Node):
+    __slots__ = ()
+    def __init__(self, span=None): self.span = span
+    def _tuple(self): return Ident("continue")
+
+class Break(Node):
+    __slots__ = ()
+    def __init__(self, span=None): self.span = span
+    def _tuple(self): return Ident("break")
+
+class ListExpr(Node):
+    __slots__ = ("elems",)
+    def __init__(self, elems, span=None): self.elems, self.span = elems, span
+    def _tuple(self): return self._tuples(self.elems)
+
+class DictExpr(Node):
+    __slots__ = ("items",)
+    def __init__(self, items, span=None): self.items, self.span = items, span
+    def _tuple(self):
+        dic = {}
+        for key, val in self.items.items(): dic[key] = yield val._tuple()
+        return dic
+
+class Quote(Node):
+    __slots__ = ("expr",)
+    def __init__(self, expr, span=None): self.expr, self.span = expr, span
+    def _tuple(self): return (Ident("quote"), [self.expr])
+
+class Func(Node):
+    __slots__ = ("params", "body")
+    def __init__(self, params, body, span=None):
+        self.params, self.body, self.span = params, body, span
+    def _tuple(self): return (Ident("func"), [self.params, (yield self.body._tuple())])
+
+class Return(Node):
+    __slots__ = ("value",)
+    def __init__(self, value, span=None): self.value, self.span = value, span
+    def _tuple(self): return (Ident("return"), (yield self._optional(self.value)))
+
+class Raise(Node):
+    __slots__ = ("value",)
+    def __init__(self, value, span=None): self.value, self.span = value, span
+    def _tuple(self): return (Ident("raise"), (yield self._optional(self.value)))
+
+class Define(Node):
+    __slots__ = ("pat", "expr")
+    def __init__(self, pat, expr, span=None): self.pat, self.expr, self.span = pat, expr, span
+    def _tuple(self): return (Ident("define"), [self.pat, (yield self.expr._tuple())])
+
+class Assign(Node):
+    __slots__ = ("target", "expr")
+    def __init__(self, target, expr, span=None):
+        self.target, self.expr, self.span = target, expr, span
+    def _tuple(self):
+        return (Ident("assign"), [(yield self.target._tuple()), (yield self.expr._tuple())])
+
+class Scope(Node):
+    __slots__ = ("body",)
+    def __init__(self, body, span=None): self.body, self.span = body, span
+    def _tuple(self): return (Ident("scope"), [(yield self.body._tuple())])
+
+class Seq(Node):
+    __slots__ = ("exprs",)
+    def __init__(self, exprs, span=None): self.exprs, self.span = exprs, span
+    def _tuple(self): return (Ident("seq"), (yield self._tuples(self.exprs)))
+
+class If(Node):
+    __slots__ = ("cond", "then", "else_")
+    def __init__(self, cond, then, else_, span=None):
+        self.cond, self.then, self.else_, self.span = cond, then, else_, span
+    def _tuple(self):
+        return (Ident("if"), (yield self._tuples([self.cond, self.then, self.else_])))
+
+class While(Node):
+    __slots__ = ("cond", "body", "then", "else_")
+    def __init__(self, cond, body, then, else_, span=None):
+        self.cond, self.body, self.then, self.else_, self.span = cond, body, then, else_, span
+    def _tuple(self):
+        return (Ident("while"), [
+            (yield self.cond._tuple()), (yield self.body._tuple()),
+            (yield self._optional(self.then)), (yield self._optional(self.else_))])
+
+class Match(Node):
+    __slots__ = ("value", "cases", "_switch")
+    def __init__(self, value, cases, span=None):
+        self.value, self.cases, self.span, self._switch = value, cases, span, None
+    @property
+    def switch(self):
+        if self._switch is None: self._switch = Switch(self.cases)
+        return self._switch
+    def _tuple(self):
+        cases = []
+        for pat, body in self.cases: cases.append((pat, (yield body._tuple())))
+        return (Ident("match"), [(yield self.value._tuple()), cases])
+
+class Try(Node):
+    __slots__ = ("body", "clauses", "_switch")
+    def __init__(self, body, clauses, span=None):
+        self.body, self.clauses, self.span, self._switch = body, clauses, span, None
+    @property
+    def switch(self):
+        if self._switch is None: self._switch = Switch(self.clauses)
+        return self._switch
+    def _tuple(self):
+        clauses = []
+        for pat, expr in self.clauses: clauses.append((pat, (yield expr._tuple())))
+        return (Ident("try"), [(yield self.body._tuple()), clauses])
+
+class Dot(Node):
+    __slots__ = ("target", "attr")
+    def __init__(self, target, attr, span=None):
+        self.target, self.attr, self.span = target, attr, span
+    def _tuple(self): return (Ident("dot"), [(yield self.target._tuple()), self.attr])
+
+class Call(Node):
+    __slots__ = ("op", "args")
+    def __init__(self, op, args, span=None): self.op, self.args, self.span = op, args, span
+    def _tuple(self): return ((yield self.op._tuple()), (yield self._tuples(self.args)))
+
+class Guard(Node):
+    __slots__ = ("value", "expr", "cells")
+    def __init__(self, value, expr, cells, span=None):
+        self.value, self.expr, self.cells, self.span = value, expr, cells, span
+    def choose(self):
+        for cell, version in self.cells:
+            if cell[0] != version: return self.expr
+        return self.value
+    def _tuple(self): return self.value._tuple()
+
+class NodeBuilder:
+    def __init__(self, spans: Spans | None = None) -> None:
+        self._spans = spans
+        self._leaves = {}
+
+    def build(self, expr: Expr) -> Node:
+        return trampoline(self._node(expr))
+
+    def _node(self, expr):
+        match expr:
+            case tuple() if len(expr) == 2: return self._form(expr)
+            case None | bool() | int() | str() | Ident():
+                key = (type(expr), expr)
+                if (node := self._leaves.get(key)) is None:
+                    node = self._leaves[key] = self._leaf(expr)
+                return node
+            case list() as exprs: return self._list(exprs)
+            case dict() as exprs: return self._dict(exprs)
+            case unexpected:
+                assert False, f"Unexpected expression @ to_node(): {unexpected}"
+
+    def _leaf(self, expr):
+        match expr:
+            case Ident("continue"): return Continue()
+            case Ident("break"): return Break()
+            case Ident(name): return Var(name)
+            case _: return Const(expr)
+
+    def _nodes(self, exprs):
+        nodes = []
+        for expr in exprs: nodes.append((yield self._node(expr)))
+        return nodes
+
+    def _list(self, exprs):
+        return ListExpr((yield self._nodes(exprs)))
+
+    def _dict(self, exprs):
+        items = {}
+        for key, val in exprs.items(): items[key] = yield self._node(val)
+        return DictExpr(items)
+
+    def _optional(self, args):
+        return (yield self._node(args[0])) if args else None
+
+    def _cases(self, cases):
+        nodes = []
+        for pat, expr in cases: nodes.append((pat, (yield self._node(expr))))
+        return nodes
+
+    def _form(self, expr):
+        op_expr, args_expr = expr
+        form = self._forms.get(op_expr) if type(op_expr) is Ident else None
+        if form is None or (node := (yield form(self, args_expr))) is None:
+            node = Call((yield self._node(op_expr)), (yield self._nodes(args_expr)))
+        if self._spans: node.span = self._spans.get(id(expr))
+        return node
+
+    def _quote(self, args):
+        match args:
+            case [quoted]: return Quote(quoted)
+
+    def _func(self, args):
+        match args:
+            case [params, body_expr]: return Func(params, (yield self._node(body_expr)))
+
+    def _return(self, args):
+        return Return((yield self._optional(args)))
+
+    def _raise(self, args):
+        return Raise((yield self._optional(args)))
+
+    def _define(self, args):
+        match args:
+            case [pat, expr]: return Define(pat, (yield self._node(expr)))
+
+    def _assign(self, args):
+        match args:
+            case [left_expr, right_expr]:
+                return Assign((yield self._node(left_expr)), (yield self._node(right_expr)))
+
+    def _scope(self, args):
+        match args:
+            case [body_expr]: return Scope((yield self._node(body_expr)))
+
+    def _seq(self, args):
+        return Seq((yield self._nodes(args)))
+
+    def _if(self, args):
+        match args:
+            case [_, _, _]: return If(*(yield self._nodes(args)))
+
+    def _while(self, args):
+        match args:
+            case [cond_expr, body_expr, then_expr, else_expr]:
+                return While((yield self._node(cond_expr)), (yield self._node(body_expr)),
+                             (yield self._optional(then_expr)), (yield self._optional(else_expr)))
+
+    def _match(self, args):
+        match args:
+            case [val_expr, cases]:
+                return Match((yield self._node(val_expr)), (yield self._cases(cases)))
+
+    def _try(self, args):
+        match args:
+            case [body_expr, clauses]:
+                return Try((yield self._node(body_expr)), (yield self._cases(clauses)))
+
+    def _dot(self, args):
+        match args:
+            case [target_expr, attr_name]: return Dot((yield self._node(target_expr)), attr_name)
+
+    _forms = {
+        Ident("quote"): _quote, Ident("func"): _func, Ident("return"): _return,
+        Ident("raise"): _raise, Ident("define"): _define, Ident("assign"): _assign,
+        Ident("scope"): _scope, Ident("seq"): _seq, Ident("if"): _if, Ident("while"): _while,
+        Ident("match"): _match, Ident("try"): _try, Ident("dot"): _dot,
+    }
+
+def to_node(expr: Expr, spans: Spans | None = None) -> Node:
+    return expr if isinstance(expr, Node) else NodeBuilder(spans).build(expr)
+
+
+class MacroTable:
+    def __init__(self, parent: 'MacroTable | None' = None) -> None:
+        self._parent = parent
+        self._macros, self._undo, self._depth = {}, [], 0
+
+    def lookup(self, name: str) -> Expr | None:
+        if (macro := self._macros.get(name)) is None and self._parent is not None:
+            return self._parent.lookup(name)
+        return macro
+
+    def define(self, name: str, macro: Expr) -> None:
+        if self._depth: self._undo.append((name, self._macros.get(name)))
+        self._macros[name] = macro
+
+    def enter(self) -> int:
+        self._depth += 1
+        return len(self._undo)
+
+    def leave(self, mark: int) -> None:
+        self._depth -= 1
+        while len(self._undo) > mark:
+            name, macro = self._undo.pop()
+            if macro is None: del self._macros[name]
+            else: self._macros[name] = macro
+
+    def save(self) -> tuple[int, int]:
+        return self._depth, len(self._undo)
+
+    def restore(self, state: tuple[int, int]) -> None:
+        depth, mark = state
+        self._depth = depth + 1; self.leave(mark); self._depth = depth
+
+
+class MacroCache:
+    def __init__(self, gensym: Callable[[str], Ident]) -> None:
+        self._new_gensym = gensym
+        self._shapes, self._entries, self._log = {}, {}, None
+        self.hits, self.misses = 0, 0
+
+    def key(self, shape: tuple) -> int:
+        if (key := self._shapes.get(shape)) is None: key = self._shapes[shape] = len(self._shapes)
+        return key
+
+    def gensym(self, name: str) -> Ident:
+        ident = self._new_gensym(name)
+        if self._log is not None: self._log.append((name, ident))
+        return ident
+
+    def lookup(self, macro: Expr, key: int) -> tuple[Expr, dict[Ident, Ident], set[int]] | None:
+        match self._entries.get((id(macro), key)):
+            case (cached, expanded, names, dirty) if cached is macro:
+                self.hits += 1
+                return expanded, {ident: self._new_gensym(name) for name, ident in names}, dirty
+            case _:
+                self.misses += 1
+                return None
+
+    def record(self, apply: Callable[[], Expr]) -> tuple[Expr, list[tuple[str, Ident]]]:
+        outer, self._log = self._log, []
+        try: return apply(), self._log
+        finally: self._log = outer
+
+    def store(self, macro: Expr, key: int, expanded: Expr, names: list, dirty: set[int]) -> None:
+        self._entries[(id(macro), key)] = (macro, expanded, names, dirty)
+
+
 class Expander:
+    _key_limit = 64
+
+    def __init__(self, macros: MacroTable, cache: MacroCache | None = None) -> None:
+        self._macros, self._cache, self._seen = macros, cache, {}
+        self._vm = VM([], None)
+
     def expand(self, expr: Expr, env: Environment) -> Expr:
+        state = self._macros.save()
+        try: return trampoline(self._expand(expr, env))
+        finally: self._macros.restore(state)
+
+    def _expand(self, expr, env):
         # print(expr)
         match expr:
             case None | bool() | int() | str() | Ident(): return expr
-            case list() as exprs:
-                return [self.expand(expr, env) for expr in exprs]
-            case dict() as exprs:
-                return {key: self.expand(val, env) for key, val in exprs.items()}
-            case (Ident("quote"), [expr]):
-                return self._quote(expr, env)
+            case list() as exprs: return self._expand_all(exprs, env)
+            case dict() as exprs: return self._expand_dict(exprs, env)
+            case (Ident("quote"), [expr]): return self._quote_root(expr, env)
             case (Ident("macro"), [params, body_expr]):
-                return (Ident("macro"), [params, self.expand(body_expr, env)])
+                return self._expand_last(Ident("macro"), [params], body_expr, env)
             case (Ident("func"), [params, body_expr]):
-                return (Ident("func"), [params, self.expand(body_expr, Environment(env))])
-            case (Ident("define"), [pat, expr]):
-                return self._define(pat, expr, env)
+                return self._expand_scoped(Ident("func"), [params], body_expr, env)
+            case (Ident("define"), [pat, expr]): return self._define(pat, expr, env)
             case (Ident("assign"), [pat, expr]):
-                return (Ident("assign"), [pat, self.expand(expr, env)])
+                return self._expand_last(Ident("assign"), [pat], expr, env)
             case (Ident("scope"), [body_expr]):
-                return (Ident("scope"), [self.expand(body_expr, Environment(env))])
+                return self._expand_scoped(Ident("scope"), [], body_expr, env)
             case (Ident("match"), [val_expr, cases]):
                 return self._match(val_expr, cases, env)
             case (Ident("try"), [body_expr, clauses]):
                 return self._try(body_expr, clauses, env)
             case (Ident("dot"), [target_expr, attr_name]):
-                return (Ident("dot"), [self.expand(target_expr, env), attr_name])
-            case (op_expr, args_expr):
-                return self._op(op_expr, args_expr, env)
+                return self._dot(target_expr, attr_name, env)
+            case (op_expr, args_expr): return self._op(op_expr, args_expr, env)
             case unexpected:
                 assert False, f"Unexpected expression @ expand(): {unexpected}"
 
+    def _expand_last(self, op, args, expr, env):
+        return (op, args + [(yield self._expand(expr, env))])
+
+    def _expand_scoped(self, op, args, expr, env):
+        mark = self._macros.enter()
+        expanded = yield self._expand(expr, env)
+        self._macros.leave(mark)
+        return (op, args + [expanded])
+
+    def _dot(self, target_expr, attr_name, env):
+        return (Ident("dot"), [(yield self._expand(target_expr, env)), attr_name])
+
+    def _expand_dict(self, exprs, env):
+        dic = {}
+        for key, val in exprs.items(): dic[key] = yield self._expand(val, env)
+        return dic
+
+    def _expand_all(self, exprs, env):
+        expanded = []
+        for expr in exprs: expanded.append((yield self._expand(expr, env)))
+        return expanded
+
     def _quote(self, expr, env):
         match expr:
-            case list() as exprs:
-                res = []
-                for e in exprs:
-                    match e:
-                        case (Ident("!!"), [unq]) if isinstance(e, tuple):
-                            res = (Ident("add"), [res, self.expand(unq, env)])
-                        case _:
-                            res = (Ident("add"), [res, [self._quote(e, env)]])
-                return res
-            case dict() as exprs:
-                return {key: self._quote(val, env) for key, val in exprs.items()}
-            case Ident(name):
-                return (Ident("Ident"), [name])
-            case (Ident("!"), [unquote_expr]):
-                return self.expand(unquote_expr, env)
-            case (op, args):
-                return (Ident("tuple"), [self._quote(op, env), self._quote(args, env)])
-            case _:
-                return expr
+            case list() as exprs: return self._quote_list(exprs, env)
+            case dict() as exprs: return self._quote_dict(exprs, env)
+            case Ident(): return (Ident("quote"), [expr])
+            case (Ident("!"), [unquote_expr]): return self._expand(unquote_expr, env)
+            case (op, args): return self._quote_tuple(op, args, env)
+            case _: return expr
+
+    def _quote_root(self, expr, env):
+        return self._copy_const((yield self._quote(expr, env)))
+
+    def _is_const(self, quoted):
+        match quoted:
+            case None | bool() | int() | str(): return True
+            case (Ident("quote"), [_]): return type(quoted) is tuple
+            case _: return False
+
+    def _const(self, quoted):
+        return quoted[1][0] if type(quoted) is tuple else quoted
+
+    def _is_frozen(self, quoted):
+        return self._is_const(quoted) and self._frozen(self._const(quoted))
+
+    def _frozen(self, val):
+        match val:
+            case list() | dict(): return False
+            case tuple(): return all(self._frozen(v) for v in val)
+            case _: return True
+
+    def _copy_const(self, quoted):
+        if type(quoted) is tuple and type(self._const(quoted)) in (list, dict) and self._is_const(quoted):
+            return (Ident("copy"), [quoted])
+        return quoted
+
+    def _quote_list(self, exprs, env):
+        segments, elems = [], []
+        for e in exprs:
+            match e:
+                case (Ident("!!"), [unq]) if isinstance(e, tuple):
+                    if elems: segments.append(elems)
+                    segments.append((yield self._expand(unq, env))); elems = []
+                case _:
+                    elems.append((yield self._quote(e, env)))
+        if not segments:
+            if all(self._is_frozen(q) for q in elems): return (Ident("quote"), [[self._const(q) for q in elems]])
+            return [self._copy_const(q) for q in elems]
+        if elems: segments.append(elems)
+        return (Ident("concat"), [[self._copy_const(q) for q in seg] if type(seg) is list else seg
+                                   for seg in segments])
+
+    def _quote_dict(self, exprs, env):
+        dic = {}
+        for key, val in exprs.items(): dic[key] = yield self._quote(val, env)
+        if all(self._is_frozen(q) for q in dic.values()):
+            return (Ident("quote"), [{key: self._const(q) for key, q in dic.items()}])
+        return {key: self._copy_const(q) for key, q in dic.items()}
+
+    def _quote_tuple(self, op, args, env):
+        op_quoted, args_quoted = (yield self._quote(op, env)), (yield self._quote(args, env))
+        if self._is_frozen(op_quoted) and self._is_frozen(args_quoted):
+            return (Ident("quote"), [(self._const(op_quoted), self._const(args_quoted))])
+        return (Ident("tuple"), [self._copy_const(op_quoted), self._copy_const(args_quoted)])
 
     def _define(self, pat, expr, env):
-        expanded = self.expand(expr, env)
+        expanded = yield self._expand(expr, env)
         match expanded:
             case (Ident("macro"), [params, body_expr]):
-                env.define(str(pat), (Ident("macro"), [params, body_expr]))
+                self._macros.define(str(pat), (Ident("macro"), [params, to_node(body_expr), None]))
                 return None
             case _:
                 return (Ident("define"), [pat, expanded])
 
     def _match(self, val_expr, cases, env):
-        return (Ident("match"), [
-            self.expand(val_expr, env),
-            [(pat, self.expand(body_expr, env)) for pat, body_expr in cases]
-        ])
+        val_expanded = yield self._expand(val_expr, env)
+        cases_expanded = []
+        for pat, body_expr in cases:
+            cases_expanded.append((pat, (yield self._expand(body_expr, env))))
+        return (Ident("match"), [val_expanded, cases_expanded])
 
     def _try(self, body_expr, clauses, env):
-        return (Ident("try"), [
-            self.expand(body_expr, env),
-            [(pat, self.expand(expr, env)) for pat, expr in clauses]
-        ])
+        body_expanded = yield self._expand(body_expr, env)
+        clauses_expanded = []
+        for pat, expr in clauses:
+            clauses_expanded.append((pat, (yield self._expand(expr, env))))
+        return (Ident("try"), [body_expanded, clauses_expanded])
 
     def _op(self, op_expr, args_expr, env):
-        op_expanded = self.expand(op_expr, env)
+        op_expanded = yield self._expand(op_expr, env)
 
         target_node = op_expanded
-        match op_expanded:
-            case Ident(name):
-                if (vars := env.lookup(name)) is not None:
-                    target_node = vars[name]
+        if type(op_expanded) is Ident and (macro := self._macros.lookup(op_expanded.name)) is not None:
+            target_node = macro
 
         match target_node:
-            case (Ident("macro"), [params, body_expr]):
-                new_env = Environment(env)
-                if new_env.bind(params, args_expr):
-                    expanded_ast = Evaluator().eval(body_expr, new_env)
-                    return self.expand(expanded_ast, env)
+            case (Ident("macro"), _):
+                expanded_ast = yield self._apply_macro(target_node, args_expr, env)
+                return (yield self._expand(expanded_ast, env))
+            case _:
+                return (op_expanded, (yield self._expand_all(args_expr, env)))
+
+    def _apply_macro(self, macro, args_expr, env):
+        if self._cache is None: return self._eval_macro(macro, args_expr, env)
+        return self._cached_macro(macro, args_expr, env)
+
+    def _eval_macro(self, macro, args_expr, env):
+        jit_vars = env.lookup("__jit__")
+        if jit_vars and jit_vars["__jit__"]: return self._run_macro(macro, args_expr, env)
+        params, body_expr = macro[1][:2]
+        new_env = Environment(env)
+        if not new_env.bind(params, args_expr):
+            assert False, f"Pattern mismatch @ apply(): {params}, {args_expr}"
+        return Evaluator().eval(body_expr, new_env)
+
+    def _run_macro(self, macro, args_expr, env):
+        match macro:
+            case (_, [params, body_expr, None]): body_code = macro[1][2] = self._compile_macro(params, body_expr)
+            case (_, [params, body_expr, body_code]): pass
+            case (_, [params, body_expr]): body_code = self._compile_macro(params, body_expr)
+        new_env = SlotEnvironment(env, body_code[0][1])
+        if not body_code[0][2].bind(new_env, args_expr):
+            assert False, f"Pattern mismatch @ apply(): {params}, {args_expr}"
+        vm = self._vm
+        vm._code, vm._env, vm._ip = body_code, new_env, 1
+        return vm.execute()
+
+    @staticmethod
+    def _compile_macro(params, body_expr):
+        body = to_node(body_expr)
+        return Compiler(body, [Compiler._frame(body, params)], params).compile()
+
+    def _cached_macro(self, macro, args_expr, env):
+        if (key := self._key(args_expr)) is None:
+            return self._eval_macro(macro, args_expr, env)
+        if (hit := self._cache.lookup(macro, key)) is not None:
+            expanded, renames, dirty = hit
+            return (yield self._rename(expanded, renames, dirty)) if renames else expanded
+        mark = len(self._seen)
+        expanded, names = self._cache.record(lambda: self._eval_macro(macro, args_expr, env))
+        dirty = self._dirty(expanded, {ident for _, ident in names}, mark) if names else set()
+        self._cache.store(macro, key, expanded, names, dirty)
+        return expanded
+
+    def _key(self, expr):
+        stack, keys, budget = [(expr, False)], [], self._key_limit
+        while stack:
+            if (budget := budget - 1) < 0: return None
+            expr, shaped = stack.pop()
+            if (t := type(expr)) is list or t is tuple or t is dict:
+                if shaped:
+                    n = len(expr)
+                    shape = (t, tuple(expr) if t is dict else n, *keys[len(keys) - n:])
+                    del keys[len(keys) - n:]
+                    keys.append(key := self._cache.key(shape))
+                    self._seen[id(expr)] = (expr, key, len(self._seen))
+                elif (seen := self._seen.get(id(expr))) is not None: keys.append(seen[1])
                 else:
-                    assert False, f"Pattern mismatch @ apply(): {params}, {args_expr}"
+                    stack.append((expr, True))
+                    stack.extend((elem, False) for elem in reversed(expr.values() if t is dict else expr))
+            elif expr is None or t is bool or t is int or t is str or t is Ident: keys.append((t, expr))
+            else: return None
+        return keys[0]
+
+    def _dirty(self, expr, gensyms, mark):
+        dirty, stack = set(), [(expr, False)] if type(expr) in (list, tuple, dict) else []
+        while stack:
+            expr, done = stack.pop()
+            elems = expr.values() if type(expr) is dict else expr
+            if done:
+                if any(id(e) in dirty or type(e) is Ident and e in gensyms for e in elems):
+                    dirty.add(id(expr))
+            elif (seen := self._seen.get(id(expr))) is None or seen[2] >= mark:
+                stack.append((expr, True))
+                stack.extend((e, False) for e in elems if type(e) in (list, tuple, dict))
+        return dirty
+
+    def _rename(self, expr, renames, dirty):
+        if type(expr) is Ident: return renames.get(expr, expr)
+        return self._rename_shape(expr, renames, dirty) if id(expr) in dirty else expr
+
+    def _rename_shape(self, expr, renames, dirty):
+        if type(expr) is dict:
+            dic = {}
+            for key, val in expr.items(): dic[key] = yield self._rename(val, renames, dirty)
+            return dic
+        elems = []
+        for elem in expr: elems.append((yield self._rename(elem, renames, dirty)))
+        return tuple(elems) if type(expr) is tuple else elems
+
+
+class SpanExpander(Expander):
+    def __init__(self, macros: MacroTable, spans: Spans) -> None:
+        super().__init__(macros)
+        self._spans = spans
+
+    def _expand(self, expr, env):
+        expanded = super()._expand(expr, env)
+        if type(expr) is not tuple or id(expr) not in self._spans: return expanded
+        return self._keep_span(expr, expanded)
+
+    def _keep_span(self, expr, expanded):
+        expanded = yield expanded
+        if type(expanded) is tuple: self._spans.setdefault(id(expanded), self._spans[id(expr)])
+        return expanded
+
+
+class SharingExpander(Expander):
+    def __init__(self, macros: MacroTable, hash_cons: HashCons, cache: MacroCache | None = None) -> None:
+        super().__init__(macros, cache)
+        self._hash_cons = hash_cons
+
+    def _expand(self, expr, env):
+        expanded = super()._expand(expr, env)
+        if type(expanded) is GeneratorType: return self._share(expanded)
+        if type(expanded) in (list, tuple, dict): return self._hash_cons.share(expanded)
+        return expanded
+
+    def _share(self, expanded):
+        return self._hash_cons.share((yield expanded))
+
+    def _apply_macro(self, macro, args_expr, env):
+        return super()._apply_macro(macro, self._hash_cons.unshare(args_expr), env)
+
+
+class Folder:
+    _max_size = 64
+
+    def __init__(self, env: Environment, pure: dict[str, Callable]) -> None:
+        self._env = env
+        self._pure = pure
+        self._bound = set()
+
+    def fold(self, expr: Expr) -> Node:
+        node = to_node(expr)
+        self._bound = self._bound_names(node)
+        return trampoline(self._fold(node))
+
+    def _fold(self, node):
+        return self._handlers[type(node)](self, node)
+
+    def _folds(self, nodes):
+        folded = []
+        for node in nodes: folded.append((yield self._fold(node)))
+        return folded
+
+    def _optional(self, node):
+        return None if node is None else (yield self._fold(node))
+
+    def _cases(self, cases):
+        folded = []
+        for pat, body in cases: folded.append((pat, (yield self._fold(body))))
+        return folded
+
+    def _leaf(self, node): return node
+
+    def _list(self, node):
+        return ListExpr((yield self._folds(node.elems)), node.span)
+
+    def _dict(self, node):
+        items = {}
+        for key, val in node.items.items(): items[key] = yield self._fold(val)
+        return DictExpr(items, node.span)
+
+    def _func(self, node):
+        return Func(node.params, (yield self._fold(node.body)), node.span)
+
+    def _return(self, node):
+        return Return((yield self._optional(node.value)), node.span)
+
+    def _raise(self, node):
+        return Raise((yield self._optional(node.value)), node.span)
+
+    def _define(self, node):
+        return Define(node.pat, (yield self._fold(node.expr)), node.span)
+
+    def _assign(self, node):
+        match node.target:
+            case Call(op=op, args=args) as call: target = Call(op, (yield self._folds(args)), call.span)
+            case Dot(target=coll, attr=attr) as dot: target = Dot((yield self._fold(coll)), attr, dot.span)
+            case target: pass
+        return Assign(target, (yield self._fold(node.expr)), node.span)
+
+    def _scope(self, node):
+        return Scope((yield self._fold(node.body)), node.span)
+
+    def _seq(self, node):
+        exprs = yield self._folds(node.exprs)
+        exprs = [expr for expr in exprs[:-1] if type(expr) is Guard or not self._is_const(expr)] + exprs[-1:]
+        return exprs[0] if len(exprs) == 1 else Seq(exprs, node.span)
+
+    def _if(self, node):
+        cond = yield self._fold(node.cond)
+        if type(cond) is Guard:
+            then, else_ = (yield self._fold(node.then)), (yield self._fold(node.else_))
+            return Guard(then if self._value(cond) else else_, If(cond.expr, then, else_, node.span), cond.cells)
+        if self._is_const(cond):
+            return (yield self._fold(node.then if self._value(cond) else node.else_))
+        return If(cond, (yield self._fold(node.then)), (yield self._fold(node.else_)), node.span)
+
+    def _while(self, node):
+        cond = yield self._fold(node.cond)
+        if self._is_const(cond) and not self._value(cond):
+            then = Const(None, node.span) if node.then is None else (yield self._fold(node.then))
+            if type(cond) is not Guard: return then
+            return Guard(then, While(cond.expr, (yield self._fold(node.body)), (yield self._optional(node.then)),
+                                     (yield self._optional(node.else_)), node.span), cond.cells)
+        return While(cond, (yield self._fold(node.body)),
+                     (yield self._optional(node.then)), (yield self._optional(node.else_)), node.span)
+
+    def _match(self, node):
+        return Match((yield self._fold(node.value)), (yield self._cases(node.cases)), node.span)
+
+    def _try(self, node):
+        return Try((yield self._fold(node.body)), (yield self._cases(node.clauses)), node.span)
+
+    def _dot(self, node):
+        return Dot((yield self._fold(node.target)), node.attr, node.span)
+
+    def _call(self, node):
+        op, args = (yield self._fold(node.op)), (yield self._folds(node.args))
+        match op:
+            case Var(name=name) if self._is_pure(name) and all(self._is_const(arg) for arg in args):
+                if (folded := self._apply(name, args, node.span)) is not None:
+                    return Guard(folded, Call(op, args, node.span), self._cells(name, args))
+        return Call(op, args, node.span)
+
+    @staticmethod
+    def _cells(name, args):
+        cell = Environment._versions.setdefault(name, [0])
+        cells, stack = {id(cell): (cell, cell[0])}, list(args)
+        while stack:
+            match stack.pop():
+                case Guard(cells=guarded): cells.update((id(cell), (cell, version)) for cell, version in guarded)
+                case ListExpr(elems=elems): stack.extend(elems)
+                case DictExpr(items=items): stack.extend(items.values())
+        return tuple(cells.values())
+
+    def _apply(self, name, args, span):
+        try:
+            val = self._pure[name]([self._value(arg) for arg in args])
+        except Exception: return None
+        return self._result(name, val, span)
+
+    def _result(self, name, val, span): return self._node(val, span)
+
+    def _is_pure(self, name):
+        if name in self._bound or name not in self._pure: return False
+        vars = self._env.lookup(name)
+        return vars is not None and vars[name] is self._pure[name]
+
+    def _is_const(self, node):
+        match node:
+            case Const() | Quote(): return True
+            case Guard(value=value): return self._is_const(value)
+            case ListExpr(elems=elems): return all(self._is_const(elem) for elem in elems)
+            case DictExpr(items=items): return all(self._is_const(val) for val in items.values())
+            case _: return False
+
+    def _value(self, node):
+        match node:
+            case Const(value=value): return value
+            case Quote(expr=expr): return expr
+            case Guard(value=value): return self._value(value)
+            case ListExpr(elems=elems): return [self._value(elem) for elem in elems]
+            case DictExpr(items=items): return {key: self._value(val) for key, val in items.items()}
+
+    def _node(self, val, span):
+        match val:
+            case None | bool() | int() | str(): return Const(val, span)
+            case Ident(): return Quote(val, span)
+            case list() if len(val) <= self._max_size:
+                elems = [self._node(elem, None) for elem in val]
+                return None if None in elems else ListExpr(elems, span)
+            case dict() if len(val) <= self._max_size and all(type(key) is str for key in val):
+                items = {key: self._node(elem, None) for key, elem in val.items()}
+                return None if None in items.values() else DictExpr(items, span)
+            case _: return None
+
+    def _bound_names(self, node):
+        names, stack = set(), [node]
+        while stack:
+            match stack.pop():
+                case Func(params=params, body=body):
+                    names |= Module._pattern_names(params); stack.append(body)
+                case Define(pat=pat, expr=expr):
+                    names |= Module._pattern_names(pat); stack.append(expr)
+                case Assign(target=Var(name=name), expr=expr):
+                    names.add(name); stack.append(expr)
+                case Match(value=value, cases=cases) | Try(body=value, clauses=cases):
+                    stack.append(value)
+                    for pat, body in cases:
+                        names |= Module._pattern_names(pat); stack.append(body)
+                case other: stack.extend(self._children(other))
+        return names
+
+    @staticmethod
+    def _children(node):
+        if type(node) is Quote: return
+        for name in node.__slots__:
+            match getattr(node, name):
+                case Node() as child: yield child
+                case list() | dict() as children:
+                    for child in (children.values() if type(children) is dict else children):
+                        match child:
+                            case Node(): yield child
+                            case (_, Node() as body): yield body
+
+    _handlers = {
+        Const: _leaf, Var: _leaf, Quote: _leaf, Continue: _leaf, Break: _leaf, Guard: _leaf,
+        ListExpr: _list, DictExpr: _dict, Func: _func, Return: _return, Raise: _raise,
+        Define: _define, Assign: _assign, Scope: _scope, Seq: _seq, If: _if, While: _while,
+        Match: _match, Try: _try, Dot: _dot, Call: _call,
+    }
+
+
+class Specializer(Folder):
+    _max_unroll = 256
+    _max_residuals = 1 << 12
+
+    def __init__(self, pure: dict[str, Callable]) -> None:
+        super().__init__(None, pure)
+        self._residuals = {}
+        self._fixed, self._store, self._shared = {}, {}, set()
+        self._escaped, self._clean = set(), set()
+
+    def specialize(self, func: Value, args: list[Value]) -> Value:
+        match func:
+            case (Ident("bound_method"), method, target): func, args = method, [target] + args
+        residual = trampoline(self._residual(func, dict(enumerate(args)), None))
+        assert residual is not None, f"Cannot specialize @ specialize(): {func}"
+        return residual
+
+    def _residual(self, func, static, nargs):
+        match func:
+            case (Ident("closure"), [params, body, _, env]) if \
+                    all(type(param) is Ident for param in params) and \
+                    all(i < len(params) for i in static) and nargs in (None, len(params)):
+                pass
+            case _: return None
+        key = (id(func), tuple((i, id(val)) for i, val in static.items()))
+        if (entry := self._residuals.get(key)) is not None and entry[1] in (None, len(self._escaped)):
+            return entry[0]
+        if entry is None and len(self._residuals) >= self._max_residuals: return None
+        residual = (Ident("closure"), [[p for i, p in enumerate(params) if i not in static], None, None, env])
+        self._residuals[key] = entry = [residual, None, func, static]
+
+        saved = self._env, self._bound, self._fixed, self._store, self._shared
+        body = to_node(body)
+        bound = self._bound_names(body)
+        self._env, self._bound, self._shared = env, bound | {p.name for p in params}, self._shared_names(body)
+        while True:
+            escaped = len(self._escaped)
+            self._fixed = {params[i].name: val for i, val in static.items() if params[i].name not in bound}
+            self._store = {params[i].name: val for i, val in static.items() if params[i].name not in self._shared}
+            defines = [Define(params[i], self._static(val)) for i, val in static.items()
+                       if params[i].name not in self._fixed]
+            folded = Seq(defines + [(yield self._fold(body))]) if defines else (yield self._fold(body))
+            self._escape(folded)
+            if len(self._escaped) == escaped: break
+        self._env, self._bound, self._fixed, self._store, self._shared = saved
+        residual[1][1], entry[1] = folded, len(self._escaped)
+        return residual
+
+    def _escape(self, node):
+        stack, vals, names, defined = [node], [], set(), []
+        while stack:
+            match stack.pop():
+                case Quote(expr=list() | dict() | tuple() as val): vals.append(val)
+                case Define(pat=Ident(name), expr=Quote(expr=list() | dict() | tuple() as val)):
+                    defined.append((name, val))
+                case Var(name=name): names.add(name)
+                case other: stack.extend(self._children(other))
+        vals.extend(val for name, val in defined if name in names)
+        while vals:
+            match vals.pop():
+                case (Ident("closure"), _): pass
+                case (Ident("bound_method"), _, target): vals.append(target)
+                case list() | dict() | tuple() as val if id(val) not in self._escaped:
+                    self._escaped.add(id(val)); self._clean.clear()
+                    vals.extend(val.values() if type(val) is dict else val)
+
+    def _trusted(self, val):
+        match val:
+            case list() | dict() | tuple():
+                if id(val) in self._clean: return True
+                if id(val) in self._escaped: return False
+                if not all(self._trusted(v) for v in (val.values() if type(val) is dict else val)): return False
+                self._clean.add(id(val))
+        return True
+
+    def _var(self, node):
+        for vars in (self._store, self._fixed):
+            if node.name in vars: return self._static(vars[node.name], node.span)
+        return node
+
+    def _func(self, node):
+        store, self._store = self._store, {}
+        body = yield self._fold(node.body)
+        self._store = store
+        return Func(node.params, body, node.span)
+
+    def _define(self, node):
+        expr = yield self._fold(node.expr)
+        self._bind(node.pat, expr)
+        return Define(node.pat, expr, node.span)
+
+    def _assign(self, node):
+        assign = yield super()._assign(node)
+        match assign:
+            case Assign(target=Var(name=name), expr=expr) if name in self._store:
+                if self._is_static(expr): self._store[name] = self._value(expr)
+                else: del self._store[name]
+        return assign
+
+    def _scope(self, node):
+        store = dict(self._store)
+        body = yield self._fold(node.body)
+        self._store = self._without(store, self._bound_names(node.body))
+        return Scope(body, node.span)
+
+    def _if(self, node):
+        cond = yield self._fold(node.cond)
+        match cond:
+            case Define(expr=expr) if self._is_static(expr): val, prefix = self._value(expr), [cond]
+            case _ if self._is_const(cond): val, prefix = self._value(cond), []
             case _:
-                args_expanded = [self.expand(expr, env) for expr in args_expr]
-                return (op_expanded, args_expanded)
+                store = dict(self._store)
+                then = yield self._fold(node.then)
+                store, self._store = self._store, store
+                else_ = yield self._fold(node.else_)
+                self._store = self._join([store, self._store])
+                return If(cond, then, else_, node.span)
+        branch = yield self._fold(node.then if val else node.else_)
+        return Seq(prefix + [branch], node.span) if prefix else branch
+
+    def _while(self, node):
+        if not self._breaks(node.body):
+            store = dict(self._store)
+            if (unrolled := (yield self._unroll(node))) is not None: return unrolled
+            self._store = store
+        self._store = self._without(self._store, self._bound_names(node))
+        cond = yield self._fold(node.cond)
+        if self._is_const(cond) and not self._value(cond):
+            return Const(None, node.span) if node.then is None else (yield self._fold(node.then))
+        store = dict(self._store)
+        body = yield self._fold(node.body)
+        self._store = self._without(store, self._bound_names(node.body))
+        then = yield self._optional(node.then)
+        store, self._store = self._store, self._without(store, self._bound_names(node.body))
+        else_ = yield self._optional(node.else_)
+        self._store = self._join([store, self._store])
+        return While(cond, body, then, else_, node.span)
+
+    def _unroll(self, node):
+        bodies = []
+        for _ in range(self._max_unroll):
+            cond = yield self._fold(node.cond)
+            if not self._is_const(cond): return None
+            if not self._value(cond):
+                then = Const(None, node.span) if node.then is None else (yield self._fold(node.then))
+                return Seq(bodies + [then], node.span)
+            bodies.append((yield self._fold(node.body)))
+        return None
+
+    def _match(self, node):
+        value = yield self._fold(node.value)
+        if self._is_static(value):
+            for pat, body in node.cases:
+                if (bindings := self._bindings(pat, self._value(value))) is None: continue
+                defines = [Define(Ident(name), self._static(val)) for name, val in bindings.items()]
+                self._bind(pat, value)
+                body = yield self._fold(body)
+                return Seq(defines + [body], node.span) if defines else body
+            return Const(None, node.span)
+        names = set().union(*(Module._pattern_names(pat) for pat, _ in node.cases))
+        store, cases, stores = self._without(self._store, names), [], []
+        for pat, body in node.cases:
+            self._store = dict(store)
+            cases.append((pat, (yield self._fold(body))))
+            stores.append(self._store)
+        self._store = self._join(stores + [store])
+        return Match(value, cases, node.span)
+
+    def _try(self, node):
+        store = self._without(self._store, self._bound_names(node))
+        self._store = dict(store)
+        body = yield self._fold(node.body)
+        clauses = []
+        for pat, expr in node.clauses:
+            self._store = dict(store)
+            clauses.append((pat, (yield self._fold(expr))))
+        self._store = store
+        return Try(body, clauses, node.span)
+
+    def _dot(self, node):
+        target = yield self._fold(node.target)
+        if self._is_static(target):
+            match self._value(target):
+                case dict() as obj if node.attr in obj:
+                    match obj[node.attr]:
+                        case (Ident("closure"), [[Ident("self"), *_], *_]) as method:
+                            return Quote((Ident("bound_method"), method, obj), node.span)
+                        case (Ident("closure"), _) as func:
+                            return Quote(func, node.span)
+        return Dot(target, node.attr, node.span)
+
+    def _call(self, node):
+        op, args = (yield self._fold(node.op)), (yield self._folds(node.args))
+        match op:
+            case Dot(target=target, attr=attr) if self._is_static(target) and not (
+                    type(obj := self._value(target)) is dict and attr in obj):
+                op, args = self._var(Var(attr, op.span)), [target] + args
+        match op:
+            case Var(name=name) if self._is_pure(name) and all(self._is_const(arg) for arg in args):
+                if (folded := self._apply(name, args, node.span)) is not None: return folded
+            case Quote(expr=func):
+                match func:
+                    case (Ident("bound_method"), method, target): func, args = method, [Quote(target)] + args
+                static = {i: self._value(arg) for i, arg in enumerate(args) if self._is_static(arg)}
+                if static and (residual := (yield self._residual(func, static, len(args)))) is not None:
+                    return Call(Quote(residual, op.span),
+                                [arg for i, arg in enumerate(args) if i not in static], node.span)
+        return Call(op, args, node.span)
+
+    def _result(self, name, val, span):
+        if name == "index" or type(val) not in (list, dict): return self._static(val, span)
+        return self._node(val, span)
+
+    def _static(self, val, span=None):
+        return Const(val, span) if val is None or type(val) in (bool, int, str) else Quote(val, span)
+
+    def _is_static(self, node):
+        return type(node) is Const or type(node) is Quote and self._trusted(node.expr)
+
+    def _is_const(self, node):
+        return self._trusted(node.expr) if type(node) is Quote else super()._is_const(node)
+
+    def _bind(self, pat, expr):
+        names = Module._pattern_names(pat)
+        self._store = self._without(self._store, names)
+        if self._is_static(expr) and (bindings := self._bindings(pat, self._value(expr))) is not None:
+            self._store.update((name, val) for name, val in bindings.items() if name not in self._shared)
+
+    def _bindings(self, pat, val):
+        scratch = Environment()
+        if not scratch.bind(pat, val): return None
+        return {name: vars[name] for name in Module._pattern_names(pat)
+                if (vars := scratch.lookup(name)) is not None}
+
+    def _shared_names(self, node):
+        names, stack = set(), [node]
+        while stack:
+            match stack.pop():
+                case Func() as func: names |= self._bound_names(func)
+                case other: stack.extend(self._children(other))
+        return names
+
+    def _breaks(self, node):
+        stack = [node]
+        while stack:
+            match stack.pop():
+                case Break() | Continue(): return True
+                case Func(): pass
+                case While(then=then, else_=else_): stack.extend(n for n in (then, else_) if n is not None)
+                case other: stack.extend(self._children(other))
+        return False
+
+    @staticmethod
+    def _without(store, names): return {name: val for name, val in store.items() if name not in names}
+
+    @staticmethod
+    def _join(stores):
+        return {name: val for name, val in stores[0].items()
+                if all(name in store and store[name] is val for store in stores[1:])}
+
+    _handlers = {
+        **Folder._handlers, Var: _var, Func: _func, Define: _define, Assign: _assign, Scope: _scope,
+        If: _if, While: _while, Match: _match, Try: _try, Dot: _dot, Call: _call,
+    }
 
 
 class ToilException(Exception):
@@ -561,111 +1921,180 @@ class ReturnException(Exception):
 class ContinueException(Exception): pass
 class BreakException(Exception): pass
 
+class Exit:
+    __slots__ = ("kind", "val")
+    def __init__(self, kind: str, val: Value = None) -> None: self.kind, self.val = kind, val
+
 
 class Evaluator:
     def eval(self, expr: Expr, env: Environment) -> Value:
-        # print(expr)
-        match expr:
-            case None | bool() | int() | str(): return expr
-            case list() as exprs:
-                return [self.eval(expr, env) for expr in exprs]
-            case dict() as exprs:
-                return {key: self.eval(val, env) for key, val in exprs.items()}
-            case Ident("continue"): raise ContinueException()
-            case Ident("break"): raise BreakException()
-            case Ident(name): return env.val(name)
-            case (Ident("quote"), [expr]): return expr
-            case (Ident("func"), [params, body_expr]):
-                return (Ident("closure"), [params, body_expr, None, env])
-            case (Ident("return"), args):
-                raise ReturnException(self.eval(args[0], env) if args else None)
-            case (Ident("define"), [pat, expr]):
-                return self._define(pat, expr, env)
-            case (Ident("assign"), [pat, expr]):
-                return self._assign(pat, expr, env)
-            case (Ident("scope"), [body_expr]):
-                return self.eval(body_expr, Environment(env))
-            case (Ident("seq"), exprs):
-                return self._seq(exprs, env)
-            case (Ident("if"), [cond_expr, then_expr, else_expr]):
-                return self._if(cond_expr, then_expr, else_expr, env)
-            case (Ident("match"), [val_expr, cases]):
-                return self._match(val_expr, cases, env)
-            case (Ident("while"), [cond_expr, body_expr, then_expr, else_expr]):
-                return self._while(cond_expr, body_expr, then_expr, else_expr, env)
-            case (Ident("try"), [body_expr, clauses]):
-                return self._try(body_expr, clauses, env)
-            case (Ident("raise"), args):
-                raise ToilException(self.eval(args[0], env) if args else None)
-            case (Ident("dot"), [target_expr, attr_name]):
-                return self._dot(target_expr, attr_name, env)
-            case (op_expr, args_expr) if isinstance(expr, tuple):
-                return self._op(op_expr, args_expr, env)
-            case unexpected:
-                assert False, f"Unexpected expression @ evaluate(): {unexpected}"
+        return self._eval(to_node(expr), env)
 
-    def _define(self, pat, expr, env):
-        val = self.eval(expr, env)
-        if env.bind(pat, val):
+    def exec(self, expr: Expr, env: Environment) -> Value | Exit:
+        return self._tail(to_node(expr), env)
+
+    def _eval(self, node, env):
+        # print(node)
+        return self._handlers[type(node)](self, node, env)
+
+    def _const(self, node, env): return node.value
+    def _var(self, node, env): return env.val(node.name)
+    def _continue(self, node, env): raise ContinueException()
+    def _break(self, node, env): raise BreakException()
+    def _quote(self, node, env): return node.expr
+
+    def _list(self, node, env):
+        return [self._eval(elem, env) for elem in node.elems]
+
+    def _dict(self, node, env):
+        return {key: self._eval(val, env) for key, val in node.items.items()}
+
+    def _func(self, node, env):
+        return (Ident("closure"), [node.params, node.body, None, env])
+
+    def _return(self, node, env):
+        raise ReturnException(self._eval_optional(node.value, env))
+
+    def _raise(self, node, env):
+        raise ToilException(self._eval_optional(node.value, env))
+
+    def _eval_optional(self, node, env):
+        return None if node is None else self._eval(node, env)
+
+    def _define(self, node, env):
+        val = self._eval(node.expr, env)
+        if env.bind(node.pat, val):
             return val
-        assert False, f"Pattern mismatch @ _define(): {pat}, {val}"
+        assert False, f"Pattern mismatch @ _define(): {node.pat}, {val}"
 
-    def _assign(self, left_expr, right_expr, env):
-        val = self.eval(right_expr, env)
-        match left_expr:
-            case Ident(name):
+    def _assign(self, node, env):
+        val = self._eval(node.expr, env)
+        match node.target:
+            case Var(name=name):
                 return env.assign(name, val)
-            case (Ident("index"), [coll_expr, index_expr]) | \
-                 (Ident("dot"), [coll_expr, index_expr]):
-                coll_val = self.eval(coll_expr, env)
-                index_val = self.eval(index_expr, env)
+            case Call(op=Var(name="index"), args=[coll_expr, index_expr]):
+                coll_val = self._eval(coll_expr, env)
+                index_val = self._eval(index_expr, env)
                 coll_val[index_val] = val
                 return val
+            case Dot(target=coll_expr, attr=attr_name):
+                coll_val = self._eval(coll_expr, env)
+                coll_val[attr_name] = val
+                return val
             case unexpected:
                 assert False, f"Invalid assign target @ _assign(): {unexpected}"
 
-    def _seq(self, exprs, env):
+    def _scope(self, node, env): return self._signal(self._exec_scope(node, env))
+    def _seq(self, node, env): return self._signal(self._exec_seq(node, env))
+    def _if(self, node, env): return self._signal(self._exec_if(node, env))
+    def _match(self, node, env): return self._signal(self._exec_match(node, env))
+    def _while(self, node, env): return self._signal(self._exec_while(node, env))
+    def _try(self, node, env): return self._signal(self._exec_try(node, env))
+
+    def _signal(self, val):
+        if type(val) is not Exit: return val
+        match val.kind:
+            case "return": raise ReturnException(val.val)
+            case "break": raise BreakException()
+            case "continue": raise ContinueException()
+
+    def _exec(self, node, env):
+        return self._statements[type(node)](self, node, env)
+
+    def _exec_optional(self, node, env):
+        return None if node is None else self._exec(node, env)
+
+    def _exec_continue(self, node, env): return self._CONTINUE
+    def _exec_break(self, node, env): return self._BREAK
+
+    def _exec_return(self, node, env):
+        return Exit("return", self._eval_optional(node.value, env))
+
+    def _exec_scope(self, node, env):
+        return self._exec(node.body, Environment(env))
+
+    def _exec_seq(self, node, env):
         val = None
-        for expr in exprs:
-            val = self.eval(expr, env)
+        for expr in node.exprs:
+            val = self._exec(expr, env)
+            if type(val) is Exit: return val
         return val
 
-    def _if(self, cond_expr, then_expr, else_expr, env):
-        if self.eval(cond_expr, env):
-            return self.eval(then_expr, env)
+    def _exec_if(self, node, env):
+        if self._eval(node.cond, env):
+            return self._exec(node.then, env)
         else:
-            return self.eval(else_expr, env)
+            return self._exec(node.else_, env)
 
-    def _match(self, val_expr, cases, env):
-        val = self.eval(val_expr, env)
-        for pattern, body_expr in cases:
-            if env.bind(pattern, val):
-                return self.eval(body_expr, env)
+    def _exec_match(self, node, env):
+        val = self._eval(node.value, env)
+        for bind, body_expr in node.switch.candidates(val):
+            if bind(env, val):
+                return self._exec(body_expr, env)
         return None
 
-    def _while(self, cond_expr, body_expr, then_expr, else_expr, env):
-        while self.eval(cond_expr, env):
+    def _exec_while(self, node, env):
+        while self._eval(node.cond, env):
             try:
-                self.eval(body_expr, env)
+                val = self._exec(node.body, env)
             except ContinueException: continue
             except BreakException:
-                return self._eval_optional_arg(else_expr, env)
-        return self._eval_optional_arg(then_expr, env)
+                return self._exec_optional(node.else_, env)
+            if type(val) is Exit:
+                if val is self._BREAK: return self._exec_optional(node.else_, env)
+                if val is not self._CONTINUE: return val
+        return self._exec_optional(node.then, env)
 
-    def _eval_optional_arg(self, args, env):
-        return None if len(args) == 0 else self.eval(args[0], env)
-
-    def _try(self, body_expr, clauses, env):
+    def _exec_try(self, node, env):
         try:
-            return self.eval(body_expr, env)
+            return self._exec(node.body, env)
         except ToilException as e:
-            for exc_pat, exc_expr in clauses:
-                if env.bind(exc_pat, e.e):
-                    return self.eval(exc_expr, env)
+            for bind, exc_expr in node.switch.candidates(e.e):
+                if bind(env, e.e):
+                    return self._exec(exc_expr, env)
             raise e
 
-    def _dot(self, target_expr, attr_name, env):
-        target_val = self.eval(target_expr, env)
+    def _tail(self, node, env):
+        return self._tails[type(node)](self, node, env)
+
+    def _tail_return(self, node, env):
+        val = None if node.value is None else self._tail(node.value, env)
+        return val if type(val) is Exit else Exit("return", val)
+
+    def _tail_scope(self, node, env):
+        return self._tail(node.body, Environment(env))
+
+    def _tail_seq(self, node, env):
+        exprs = node.exprs
+        for expr in exprs[:-1]:
+            val = self._exec(expr, env)
+            if type(val) is Exit: return val
+        return self._tail(exprs[-1], env) if exprs else None
+
+    def _tail_if(self, node, env):
+        if self._eval(node.cond, env):
+            return self._tail(node.then, env)
+        else:
+            return self._tail(node.else_, env)
+
+    def _tail_match(self, node, env):
+        val = self._eval(node.value, env)
+        for bind, body_expr in node.switch.candidates(val):
+            if bind(env, val):
+                return self._tail(body_expr, env)
+        return None
+
+    def _tail_call(self, node, env):
+        op_val = self._eval(node.op, env)
+        args_val = [self._eval(arg, env) for arg in node.args]
+        if callable(op_val): return op_val(args_val)
+        return Exit("call", (op_val, args_val))
+
+    def _dot(self, node, env):
+        return self.attr(self._eval(node.target, env), node.attr, env)
+
+    @staticmethod
+    def attr(target_val: Value, attr_name: str, env: Environment) -> Value:
         match target_val:
             case dict() if attr_name in target_val:
                 func_val = target_val[attr_name]
@@ -677,190 +2106,636 @@ class Evaluator:
         func_val = env.val(attr_name)
         return (Ident("bound_method"), func_val, target_val)
 
-    def _op(self, op_expr, args_expr, env):
-        op_val = self.eval(op_expr, env)
-        args_val = [self.eval(arg, env) for arg in args_expr]
+    def _call(self, node, env):
+        op_val = self._eval(node.op, env)
+        args_val = [self._eval(arg, env) for arg in node.args]
         return self.apply(op_val, args_val)
 
+    def _guard(self, node, env): return self._eval(node.choose(), env)
+    def _exec_guard(self, node, env): return self._exec(node.choose(), env)
+    def _tail_guard(self, node, env): return self._tail(node.choose(), env)
+
+    _handlers = {
+        Const: _const, Var: _var, ListExpr: _list, DictExpr: _dict, Quote: _quote,
+        Func: _func, Return: _return, Define: _define, Assign: _assign,
+        Scope: _scope, Seq: _seq, If: _if, While: _while, Match: _match, Try: _try,
+        Raise: _raise, Continue: _continue, Break: _break, Dot: _dot, Call: _call, Guard: _guard,
+    }
+
+    _statements = {
+        **_handlers, Return: _exec_return, Scope: _exec_scope, Seq: _exec_seq, If: _exec_if,
+        While: _exec_while, Match: _exec_match, Try: _exec_try, Continue: _exec_continue, Break: _exec_break,
+        Guard: _exec_guard,
+    }
+
+    _tails = {
+        **_statements, Return: _tail_return, Scope: _tail_scope, Seq: _tail_seq, If: _tail_if,
+        Match: _tail_match, Call: _tail_call, Guard: _tail_guard,
+    }
+
+    _CONTINUE, _BREAK = Exit("continue"), Exit("break")
+
     def apply(self, op_val: Value, args_val: list[Value]) -> Value:
-        match op_val:
-            case (Ident("bound_method"), func_val, target_val):
-                return self.apply(func_val, [target_val] + args_val)
-            case c if callable(c):
-                return c(args_val)
-            case (Ident("closure"), [params, body_expr, body_code, closure_env]):
-                new_env = Environment(closure_env)
-                if new_env.bind(params, args_val):
-                    jit_vars = closure_env.lookup("__jit__")
-                    if body_code:
-                        return VM(body_code, new_env).execute()
-                    elif jit_vars and jit_vars["__jit__"]:
-                        op_val[1][2] = Compiler(body_expr).compile()
-                        return VM(op_val[1][2], new_env).execute()
-                    else:
-                        try:
-                            return self.eval(body_expr, new_env)
-                        except ReturnException as e: return e.val
-                assert False, f"Pattern mismatch @ apply(): {params}, {args_val}"
-            case _:
-                assert False, f"Invalid operator @ apply(): {op_val}"
+        while True:
+            match op_val:
+                case (Ident("bound_method"), func_val, target_val):
+                    op_val, args_val = func_val, [target_val] + args_val
+                case c if callable(c):
+                    return c(args_val)
+                case (Ident("closure"), [params, body_expr, body_code, closure_env]):
+                    new_env = Environment(closure_env)
+                    if new_env.bind(params, args_val):
+                        jit_vars = closure_env.lookup("__jit__")
+                        if body_code:
+                            return VM(body_code, new_env).execute()
+                        elif jit_vars and jit_vars["__jit__"]:
+                            op_val[1][2] = Compiler(body_expr, body=True).compile()
+                            return VM(op_val[1][2], new_env).execute()
+                        else:
+                            try:
+                                val = self.exec(body_expr, new_env)
+                            except ReturnException as e: return e.val
+                            if type(val) is not Exit: return val
+                            match val.kind:
+                                case "call": op_val, args_val = val.val; continue
+                                case "return": return val.val
+                            return self._signal(val)
+                    assert False, f"Pattern mismatch @ apply(): {params}, {args_val}"
+                case _:
+                    assert False, f"Invalid operator @ apply(): {op_val}"
+
+
+
+class ClosureEvaluator(Evaluator):
+    def eval(self, expr: Expr, env: Environment) -> Value:
+        node = to_node(expr)
+        if (body := getattr(node, "_closure", None)) is None:
+            body = node._closure = self.closure(node)
+        return body(env)
+
+    exec = eval
+
+    def closure(self, expr: Expr) -> Callable[[Environment], Value]:
+        return ClosureCompiler(self).compile(expr)
 
+    def define_body(self, node: Node, body: Callable[[Environment], Value]) -> None:
+        if getattr(node, "_closure", None) is None: node._closure = body
+
+    def apply(self, op_val: Value, args_val: list[Value]) -> Value:
+        if callable(op_val): return op_val(args_val)
+        return super().apply(op_val, args_val)
+
+
+
+class ClosureCompiler:
+    def __init__(self, evaluator: ClosureEvaluator) -> None:
+        self._evaluator = evaluator
+
+    def compile(self, expr: Expr) -> Callable[[Environment], Value]:
+        return trampoline(self._closure(to_node(expr)))
+
+    def _closure(self, node):
+        return self._handlers[type(node)](self, node)
+
+    def _closures(self, nodes):
+        closures = []
+        for node in nodes: closures.append((yield self._closure(node)))
+        return closures
+
+    def _optional(self, node):
+        return (lambda env: None) if node is None else (yield self._closure(node))
+
+    def _const(self, node):
+        val = node.value
+        return lambda env: val
+
+    def _var(self, node):
+        name = node.name
+        return lambda env: env.val(name)
+
+    def _continue(self, node):
+        def continue_(env): raise ContinueException()
+        return continue_
+
+    def _break(self, node):
+        def break_(env): raise BreakException()
+        return break_
+
+    def _quote(self, node):
+        expr = node.expr
+        return lambda env: expr
+
+    def _list(self, node):
+        elems = yield self._closures(node.elems)
+        return lambda env: [elem(env) for elem in elems]
+
+    def _dict(self, node):
+        items = []
+        for key, val in node.items.items(): items.append((key, (yield self._closure(val))))
+        return lambda env: {key: val(env) for key, val in items}
+
+    def _func(self, node):
+        params, body_expr = node.params, node.body
+        self._evaluator.define_body(body_expr, (yield self._closure(body_expr)))
+        return lambda env: (Ident("closure"), [params, body_expr, None, env])
+
+    def _return(self, node):
+        value = yield self._optional(node.value)
+        def return_(env): raise ReturnException(value(env))
+        return return_
+
+    def _raise(self, node):
+        value = yield self._optional(node.value)
+        def raise_(env): raise ToilException(value(env))
+        return raise_
+
+    def _define(self, node):
+        pat, expr = node.pat, (yield self._closure(node.expr))
+        bind = Matcher(pat).bind
+        def define(env):
+            val = expr(env)
+            if bind(env, val): return val
+            assert False, f"Pattern mismatch @ _define(): {pat}, {val}"
+        return define
+
+    def _assign(self, node):
+        expr = yield self._closure(node.expr)
+        match node.target:
+            case Var(name=name):
+                return lambda env: env.assign(name, expr(env))
+            case Call(op=Var(name="index"), args=[coll_expr, index_expr]):
+                coll, index = (yield self._closure(coll_expr)), (yield self._closure(index_expr))
+            case Dot(target=coll_expr, attr=attr_name):
+                coll, index = (yield self._closure(coll_expr)), (lambda env: attr_name)
+            case unexpected:
+                assert False, f"Invalid assign target @ _assign(): {unexpected}"
+        def assign(env):
+            val = expr(env)
+            coll(env)[index(env)] = val
+            return val
+        return assign
+
+    def _scope(self, node):
+        body = yield self._closure(node.body)
+        return lambda env: body(Environment(env))
+
+    def _seq(self, node):
+        match (yield self._closures(node.exprs)):
+            case []: return lambda env: None
+            case [only]: return only
+            case [first, second]:
+                def seq2(env):
+                    first(env)
+                    return second(env)
+                return seq2
+            case [*exprs, last]:
+                def seq(env):
+                    for expr in exprs: expr(env)
+                    return last(env)
+                return seq
+
+    def _if(self, node):
+        cond, then, else_ = yield self._closures([node.cond, node.then, node.else_])
+        return lambda env: then(env) if cond(env) else else_(env)
+
+    def _match(self, node):
+        value = yield self._closure(node.value)
+        cases = []
+        for pat, body in node.cases: cases.append((pat, (yield self._closure(body))))
+        switch = Switch(cases)
+        def match(env):
+            val = value(env)
+            for bind, body in switch.candidates(val):
+                if bind(env, val): return body(env)
+            return None
+        return match
+
+    def _while(self, node):
+        cond, body = yield self._closures([node.cond, node.body])
+        then, else_ = (yield self._optional(node.then)), (yield self._optional(node.else_))
+        def while_(env):
+            while cond(env):
+                try:
+                    body(env)
+                except ContinueException: continue
+                except BreakException: return else_(env)
+            return then(env)
+        return while_
+
+    def _try(self, node):
+        body = yield self._closure(node.body)
+        clauses = []
+        for pat, expr in node.clauses: clauses.append((pat, (yield self._closure(expr))))
+        switch = Switch(clauses)
+        def try_(env):
+            try:
+                return body(env)
+            except ToilException as e:
+                for bind, exc_expr in switch.candidates(e.e):
+                    if bind(env, e.e): return exc_expr(env)
+                raise e
+        return try_
+
+    def _dot(self, node):
+        target, attr_name, attr = (yield self._closure(node.target)), node.attr, Evaluator.attr
+        return lambda env: attr(target(env), attr_name, env)
+
+    def _call(self, node):
+        op, args, apply = (yield self._closure(node.op)), (yield self._closures(node.args)), self._evaluator.apply
+        match args:
+            case []: return lambda env: apply(op(env), [])
+            case [arg]: return lambda env: apply(op(env), [arg(env)])
+            case [arg1, arg2]: return lambda env: apply(op(env), [arg1(env), arg2(env)])
+            case _: return lambda env: apply(op(env), [arg(env) for arg in args])
+
+    def _guard(self, node):
+        value, expr = (yield self._closure(node.value)), (yield self._closure(node.expr))
+        return lambda env: value(env) if node.choose() is node.value else expr(env)
+
+    _handlers = {
+        Const: _const, Var: _var, ListExpr: _list, DictExpr: _dict, Quote: _quote,
+        Func: _func, Return: _return, Define: _define, Assign: _assign,
+        Scope: _scope, Seq: _seq, If: _if, While: _while, Match: _match, Try: _try,
+        Raise: _raise, Continue: _continue, Break: _break, Dot: _dot, Call: _call, Guard: _guard,
+    }
+
+
+class TrampolineEvaluator(Evaluator):
+    def eval(self, expr: Expr, env: Environment) -> Value:
+        return self.drive(self._eval(to_node(expr), env))
+
+    def apply(self, op_val: Value, args_val: list[Value]) -> Value:
+        return self.drive(self._apply(op_val, args_val))
+
+    @staticmethod
+    def drive(gen: Any) -> Value:
+        if type(gen) is not GeneratorType: return gen
+        stack, val, exc = [gen], None, None
+        while stack:
+            try:
+                sub = stack[-1].send(val) if exc is None else stack[-1].throw(exc)
+            except StopIteration as stop:
+                stack.pop(); val, exc = stop.value, None
+            except Exception as e:
+                stack.pop(); exc = e
+                if not stack: raise
+            else:
+                exc = None
+                if type(sub) is GeneratorType: stack.append(sub); val = None
+                else: val = sub
+        return val
+
+    def _list(self, node, env):
+        elems = []
+        for elem in node.elems: elems.append((yield self._eval(elem, env)))
+        return elems
+
+    def _dict(self, node, env):
+        items = {}
+        for key, val in node.items.items(): items[key] = yield self._eval(val, env)
+        return items
+
+    def _return(self, node, env):
+        raise ReturnException((yield self._eval_optional(node.value, env)))
+
+    def _raise(self, node, env):
+        raise ToilException((yield self._eval_optional(node.value, env)))
+
+    def _define(self, node, env):
+        val = yield self._eval(node.expr, env)
+        if env.bind(node.pat, val):
+            return val
+        assert False, f"Pattern mismatch @ _define(): {node.pat}, {val}"
+
+    def _assign(self, node, env):
+        val = yield self._eval(node.expr, env)
+        match node.target:
+            case Var(name=name):
+                return env.assign(name, val)
+            case Call(op=Var(name="index"), args=[coll_expr, index_expr]):
+                coll_val = yield self._eval(coll_expr, env)
+                index_val = yield self._eval(index_expr, env)
+                coll_val[index_val] = val
+                return val
+            case Dot(target=coll_expr, attr=attr_name):
+                coll_val = yield self._eval(coll_expr, env)
+                coll_val[attr_name] = val
+                return val
+            case unexpected:
+                assert False, f"Invalid assign target @ _assign(): {unexpected}"
+
+    def _scope(self, node, env): return self._signal((yield self._exec_scope(node, env)))
+    def _seq(self, node, env): return self._signal((yield self._exec_seq(node, env)))
+    def _if(self, node, env): return self._signal((yield self._exec_if(node, env)))
+    def _match(self, node, env): return self._signal((yield self._exec_match(node, env)))
+    def _while(self, node, env): return self._signal((yield self._exec_while(node, env)))
+    def _try(self, node, env): return self._signal((yield self._exec_try(node, env)))
+
+    def _exec_return(self, node, env):
+        return Exit("return", (yield self._eval_optional(node.value, env)))
+
+    def _exec_seq(self, node, env):
+        val = None
+        for expr in node.exprs:
+            val = yield self._exec(expr, env)
+            if type(val) is Exit: return val
+        return val
+
+    def _exec_if(self, node, env):
+        if (yield self._eval(node.cond, env)):
+            return (yield self._exec(node.then, env))
+        else:
+            return (yield self._exec(node.else_, env))
+
+    def _exec_match(self, node, env):
+        val = yield self._eval(node.value, env)
+        for bind, body_expr in node.switch.candidates(val):
+            if bind(env, val):
+                return (yield self._exec(body_expr, env))
+        return None
+
+    def _exec_while(self, node, env):
+        while (yield self._eval(node.cond, env)):
+            try:
+                val = yield self._exec(node.body, env)
+            except ContinueException: continue
+            except BreakException:
+                return (yield self._exec_optional(node.else_, env))
+            if type(val) is Exit:
+                if val is self._BREAK: return (yield self._exec_optional(node.else_, env))
+                if val is not self._CONTINUE: return val
+        return (yield self._exec_optional(node.then, env))
+
+    def _exec_try(self, node, env):
+        try:
+            return (yield self._exec(node.body, env))
+        except ToilException as e:
+            for bind, exc_expr in node.switch.candidates(e.e):
+                if bind(env, e.e):
+                    return (yield self._exec(exc_expr, env))
+            raise e
+
+    def _tail_return(self, node, env):
+        val = None if node.value is None else (yield self._tail(node.value, env))
+        return val if type(val) is Exit else Exit("return", val)
+
+    def _tail_seq(self, node, env):
+        exprs = node.exprs
+        for expr in exprs[:-1]:
+            val = yield self._exec(expr, env)
+            if type(val) is Exit: return val
+        return (yield self._tail(exprs[-1], env)) if exprs else None
+
+    def _tail_if(self, node, env):
+        if (yield self._eval(node.cond, env)):
+            return (yield self._tail(node.then, env))
+        else:
+            return (yield self._tail(node.else_, env))
+
+    def _tail_match(self, node, env):
+        val = yield self._eval(node.value, env)
+        for bind, body_expr in node.switch.candidates(val):
+            if bind(env, val):
+                return (yield self._tail(body_expr, env))
+        return None
+
+    def _tail_call(self, node, env):
+        op_val = yield self._eval(node.op, env)
+        args_val = []
+        for arg in node.args: args_val.append((yield self._eval(arg, env)))
+        if callable(op_val): return op_val(args_val)
+        return Exit("call", (op_val, args_val))
+
+    def _dot(self, node, env):
+        return self.attr((yield self._eval(node.target, env)), node.attr, env)
+
+    def _call(self, node, env):
+        op_val = yield self._eval(node.op, env)
+        args_val = []
+        for arg in node.args: args_val.append((yield self._eval(arg, env)))
+        if callable(op_val): return op_val(args_val)
+        return (yield self._apply(op_val, args_val))
+
+    _handlers = {
+        **Evaluator._handlers, ListExpr: _list, DictExpr: _dict, Return: _return, Define: _define,
+        Assign: _assign, Scope: _scope, Seq: _seq, If: _if, While: _while, Match: _match, Try: _try,
+        Raise: _raise, Dot: _dot, Call: _call,
+    }
+
+    _statements = {
+        **_handlers, Return: _exec_return, Scope: Evaluator._exec_scope, Seq: _exec_seq, If: _exec_if,
+        While: _exec_while, Match: _exec_match, Try: _exec_try,
+        Continue: Evaluator._exec_continue, Break: Evaluator._exec_break, Guard: Evaluator._exec_guard,
+    }
+
+    _tails = {
+        **_statements, Return: _tail_return, Scope: Evaluator._tail_scope, Seq: _tail_seq, If: _tail_if,
+        Match: _tail_match, Call: _tail_call, Guard: Evaluator._tail_guard,
+    }
+
+    def _apply(self, op_val, args_val):
+        while True:
+            match op_val:
+                case (Ident("bound_method"), func_val, target_val):
+                    op_val, args_val = func_val, [target_val] + args_val
+                case c if callable(c):
+                    return c(args_val)
+                case (Ident("closure"), [params, body_expr, body_code, closure_env]):
+                    new_env = Environment(closure_env)
+                    if new_env.bind(params, args_val):
+                        jit_vars = closure_env.lookup("__jit__")
+                        if body_code:
+                            return VM(body_code, new_env).execute()
+                        elif jit_vars and jit_vars["__jit__"]:
+                            op_val[1][2] = Compiler(body_expr, body=True).compile()
+                            return VM(op_val[1][2], new_env).execute()
+                        else:
+                            try:
+                                val = yield self._tail(to_node(body_expr), new_env)
+                            except ReturnException as e: return e.val
+                            if type(val) is not Exit: return val
+                            match val.kind:
+                                case "call": op_val, args_val = val.val; continue
+                                case "return": return val.val
+                            return self._signal(val)
+                    assert False, f"Pattern mismatch @ apply(): {params}, {args_val}"
+                case _:
+                    assert False, f"Invalid operator @ apply(): {op_val}"
 
 
 class Compiler:
-    def __init__(self, expr: Expr):
-        self._expr = expr
+    def __init__(self, expr: Expr, frames: list[dict[str, int]] | None = None, params: Expr = None,
+                 body: bool = False):
+        self._expr = to_node(expr)
         self._code = []
         self._control_stack = []
+        self._frames = [] if frames is None else frames
+        self._params = params
+        self._body = body
 
     def compile(self) -> Code:
-        self._expression(self._expr)
+        return trampoline(self._compile())
+
+    def _compile(self):
+        if self._frames: self._code.append(("frame", self._frames[-1], Matcher(self._params, self._frames[-1])))
+        yield self._expression(self._expr)
         self._code.append(("ret",))
         assert self._control_stack == [], \
             f"Invalid control stack state @ compile(): {self._control_stack}"
+        self._tail_calls()
         return self._code
 
-    def _expression(self, expr):
-        match expr:
-            case None | bool() | int() | str(): self._code.append(("const", expr))
-            case list() as lst: self._list(lst)
-            case dict() as dic: self._dict(dic)
-            case Ident("continue"): self._continue()
-            case Ident("break"): self._break()
-            case Ident(name): self._code.append(("get", name))
-            case (Ident("func"), [params, body_expr]): self._func(params, body_expr)
-            case (Ident("return"), args): self._return(args)
-            case (Ident("define"), [pat, expr]):
-                self._expression(expr)
-                self._code.append(("def", pat))
-            case (Ident("assign"), [left_expr, right_expr]):
-                self._assign(left_expr, right_expr)
-            case (Ident("scope"), [body_expr]): self._scope(body_expr)
-            case (Ident('seq'), exprs): self._seq(exprs)
-            case (Ident('if'), [cond_expr, then_expr, else_expr]):
-                self._if(cond_expr, then_expr, else_expr)
-            case (Ident("while"), [cond_expr, body_expr, then_expr, else_expr]):
-                self._while(cond_expr, body_expr, then_expr, else_expr)
-            case (Ident("match"), [val_expr, cases]):
-                self._match(val_expr, cases)
-            case (Ident("try"), [body_expr, clauses]):
-                self._try(body_expr, clauses)
-            case (Ident("raise"), args):
-                self._raise(args)
-            case (Ident("dot"), [target_expr, attr_name]):
-                self._dot(target_expr, attr_name)
-            case (op_expr, args_expr) if isinstance(expr, tuple):
-                self._op(op_expr, args_expr)
-            case _: assert False, f"Unsupported expression @ compile(): {expr}"
-
-    def _list(self, lst):
-        for elem in lst: self._expression(elem)
-        self._code.append(("get", "list"))
-        self._code.append(("call", len(lst)))
-
-    def _dict(self, dic):
-        for key, val in dic.items(): self._list([key, val])
-        self._code.append(("get", "dict"))
-        self._code.append(("call", len(dic)))
+    def _tail_calls(self):
+        for ip, inst in enumerate(self._code):
+            if inst[0] == "call" and self._returns(ip + 1):
+                self._code[ip] = ("tail_call", inst[1])
 
-    def _func(self, params, body_expr):
-        body_code = Compiler(body_expr).compile()
-        self._code.append(("make_closure", params, body_expr, body_code))
-
-    def _return(self, args):
-        if args: self._expression(args[0])
-        else: self._code.append(("const", None))
+    def _returns(self, ip):
+        while True:
+            match self._code[ip]:
+                case ("jump", addr): ip = addr
+                case ("leave_scope",): ip += 1
+                case ("ret",): return True
+                case _: return False
+
+    def _expression(self, node):
+        return self._handlers[type(node)](self, node)
+
+    def _const(self, node):
+        self._code.append(("const", node.value))
+
+    def _var(self, node):
+        self._code.append(self._get(node.name))
+
+    def _list(self, node):
+        for elem in node.elems: yield self._expression(elem)
+        self._code.append(self._get("list"))
+        self._code.append(("call", len(node.elems)))
+
+    def _dict(self, node):
+        for key, val in node.items.items():
+            self._code.append(("const", key))
+            yield self._expression(val)
+            self._code.append(self._get("list"))
+            self._code.append(("call", 2))
+        self._code.append(self._get("dict"))
+        self._code.append(("call", len(node.items)))
+
+    def _quote(self, node):
+        self._code.append(("const", node.expr))
+
+    def _func(self, node):
+        frame = self._frame(node.body, node.params)
+        body_code = yield Compiler(node.body, self._frames + [frame], node.params, self._body)._compile()
+        self._code.append(("make_closure", node.params, node.body, body_code))
+
+    def _return(self, node):
+        yield self._optional(node.value)
         self._code.append(("ret",))
 
-    def _assign(self, left_expr, right_expr):
-        match left_expr:
-            case Ident(name):
-                self._expression(right_expr)
-                self._code.append(("set", name))
-            case (Ident("index"), [coll_expr, index_expr]):
-                self._expression(coll_expr)
-                self._expression(index_expr)
-                self._expression(right_expr)
+    def _optional(self, node):
+        if node is None: self._code.append(("const", None))
+        else: return self._expression(node)
+
+    def _define(self, node):
+        yield self._expression(node.expr)
+        match node.pat:
+            case Ident(name) if self._frames:
+                self._code.append(("def_local", self._frames[-1][name]))
+            case pat:
+                self._code.append(("def", self._matcher(pat)))
+
+    def _assign(self, node):
+        match node.target:
+            case Var(name=name):
+                yield self._expression(node.expr)
+                self._code.append(self._set(name))
+            case Call(op=Var(name="index"), args=[coll_expr, index_expr]):
+                yield self._expression(coll_expr)
+                yield self._expression(index_expr)
+                yield self._expression(node.expr)
                 self._code.append(("set_index",))
-            case (Ident("dot"), [coll_expr, attr_name]):
-                self._expression(coll_expr)
+            case Dot(target=coll_expr, attr=attr_name):
+                yield self._expression(coll_expr)
                 self._code.append(("const", attr_name))
-                self._expression(right_expr)
+                yield self._expression(node.expr)
                 self._code.append(("set_index",))
             case unexpected:
                 assert False, f"Invalid assign target @ compile(): {unexpected}"
 
-    def _scope(self, body_expr):
+    def _scope(self, node):
+        if not (frame := self._frame(node.body)):
+            yield self._expression(node.body); return
         self._control_stack.append(("scope",))
-        self._code.append(("enter_scope",))
-        self._expression(body_expr)
+        self._code.append(("enter_scope", frame))
+        self._frames.append(frame)
+        yield self._expression(node.body)
+        self._frames.pop()
         self._code.append(("leave_scope",))
         self._control_stack.pop()
 
-    def _seq(self, exprs):
+    def _seq(self, node):
+        exprs = node.exprs
         assert len(exprs) > 0, f"Empty sequence @ compile(): {exprs}"
         for expr in exprs[:-1]:
-            self._expression(expr)
+            yield self._expression(expr)
             self._code.append(("pop",))
-        self._expression(exprs[-1])
+        yield self._expression(exprs[-1])
 
-    def _if(self, cond_expr, then_expr, else_expr):
-        self._expression(cond_expr)
+    def _if(self, node):
+        yield self._expression(node.cond)
         else_jump = self._current_addr()
         self._code.append(("jump_if_false", None))
-        self._expression(then_expr)
+        yield self._expression(node.then)
         end_jump = self._current_addr()
         self._code.append(("jump", None))
         self._set_operand(else_jump, self._current_addr())
-        self._expression(else_expr)
+        yield self._expression(node.else_)
         self._set_operand(end_jump, self._current_addr())
 
-    def _while(self, cond_expr, body_expr, then_expr, else_expr):
+    def _while(self, node):
         loop_jump = self._current_addr()
         break_addrs = []
         self._control_stack.append(("while", loop_jump, break_addrs))
-        self._expression(cond_expr)
+        yield self._expression(node.cond)
         cond_jump = self._current_addr()
         self._code.append(("jump_if_false", None))
-        self._expression(body_expr)
+        yield self._expression(node.body)
         self._code.append(("pop",))
         self._code.append(("jump", loop_jump))
         self._set_operand(cond_jump, self._current_addr())
 
         self._control_stack.pop()
-        self._expression(then_expr[0] if then_expr else None)
+        yield self._optional(node.then)
         then_jump = self._current_addr()
         self._code.append(("jump", None))
         for break_addr in break_addrs:
             self._set_operand(break_addr, self._current_addr())
-        self._expression(else_expr[0] if else_expr else None)
+        yield self._optional(node.else_)
         self._set_operand(then_jump, self._current_addr())
 
-    def _match(self, val_expr, cases):
-        self._expression(val_expr)
-        end_jumps = []
-        for pat, body_expr in cases:
-            self._code.append(("match", pat))
-            next_case_jump = self._current_addr()
-            self._code.append(("jump_if_false", None))
-
+    def _match(self, node):
+        yield self._expression(node.value)
+        switch_addr, cases, end_jumps = self._current_addr(), [], []
+        self._code.append(("switch", None, None))
+        for pat, body_expr in node.cases:
+            cases.append((pat, self._current_addr()))
             self._code.append(("pop",))
-            self._expression(body_expr)
+            yield self._expression(body_expr)
             end_jumps.append(self._current_addr())
             self._code.append(("jump", None))
 
-            self._set_operand(next_case_jump, self._current_addr())
-
+        self._code[switch_addr] = ("switch", self._switch(cases), self._current_addr())
         self._code.append(("pop",))
         self._code.append(("const", None))
         for jmp in end_jumps:
             self._set_operand(jmp, self._current_addr())
 
-    def _try(self, body_expr, clauses):
+    def _try(self, node):
         handler_jump = self._current_addr()
         self._code.append(("enter_try", None))
         self._control_stack.append(("try",))
-        self._expression(body_expr)
+        yield self._expression(node.body)
         self._control_stack.pop()
         self._code.append(("leave_try",))
 
@@ -868,31 +2743,27 @@ class Compiler:
         self._code.append(("jump", None))
 
         self._set_operand(handler_jump, self._current_addr())
-        clause_end_jumps = []
-        for pat, expr in clauses:
-            self._code.append(("match", pat))
-            next_clause_jump = self._current_addr()
-            self._code.append(("jump_if_false", None))
-
+        switch_addr, clauses, clause_end_jumps = self._current_addr(), [], []
+        self._code.append(("switch", None, None))
+        for pat, expr in node.clauses:
+            clauses.append((pat, self._current_addr()))
             self._code.append(("pop",))
-            self._expression(expr)
+            yield self._expression(expr)
             clause_end_jumps.append(self._current_addr())
             self._code.append(("jump", None))
 
-            self._set_operand(next_clause_jump, self._current_addr())
-
+        self._code[switch_addr] = ("switch", self._switch(clauses), self._current_addr())
         self._code.append(("raise",))
 
         for jmp in clause_end_jumps:
             self._set_operand(jmp, self._current_addr())
         self._set_operand(end_jump, self._current_addr())
 
-    def _raise(self, args):
-        if args: self._expression(args[0])
-        else: self._code.append(("const", None))
+    def _raise(self, node):
+        yield self._optional(node.value)
         self._code.append(("raise",))
 
-    def _continue(self):
+    def _continue(self, node):
         for ctrl in reversed(self._control_stack):
             match ctrl:
                 case ("scope",):
@@ -904,7 +2775,7 @@ class Compiler:
                     return
         assert False, "Continue outside of loop @ _continue()"
 
-    def _break(self):
+    def _break(self, node):
         for ctrl in reversed(self._control_stack):
             match ctrl:
                 case ("scope",):
@@ -917,14 +2788,65 @@ class Compiler:
                     return
         assert False, "Break outside of loop @ _break()"
 
-    def _dot(self, target_expr, attr_name):
-        self._expression(target_expr)
-        self._code.append(("dot", attr_name))
+    def _dot(self, node):
+        yield self._expression(node.target)
+        self._code.append(("dot", node.attr))
+
+    def _call(self, node):
+        for arg in node.args: yield self._expression(arg)
+        yield self._expression(node.op)
+        self._code.append(("call", len(node.args)))
+
+    def _guard(self, node):
+        guard_addr = self._current_addr()
+        self._code.append(("guard", node.cells, None))
+        yield self._expression(node.value)
+        end_jump = self._current_addr()
+        self._code.append(("jump", None))
+        self._code[guard_addr] = ("guard", node.cells, self._current_addr())
+        yield self._expression(node.expr)
+        self._set_operand(end_jump, self._current_addr())
+
+    _handlers = {
+        Const: _const, Var: _var, ListExpr: _list, DictExpr: _dict, Quote: _quote,
+        Func: _func, Return: _return, Define: _define, Assign: _assign,
+        Scope: _scope, Seq: _seq, If: _if, While: _while, Match: _match, Try: _try,
+        Raise: _raise, Continue: _continue, Break: _break, Dot: _dot, Call: _call, Guard: _guard,
+    }
+
+    def _get(self, name):
+        for depth, frame in enumerate(reversed(self._frames)):
+            if (index := frame.get(name)) is not None:
+                return ("get_local", index, name) if depth == 0 else ("get_free", depth, index, name)
+        if self._body: return ("get", name)
+        return ("get_global", name, InlineCache()) if self._frames else ("get", name, InlineCache())
 
-    def _op(self, op, args):
-        for arg in args: self._expression(arg)
-        self._expression(op)
-        self._code.append(("call", len(args)))
+    def _set(self, name):
+        for depth, frame in enumerate(reversed(self._frames)):
+            if (index := frame.get(name)) is not None:
+                return ("set_local", index, name) if depth == 0 else ("set_free", depth, index, name)
+        return ("set", name)
+
+    def _matcher(self, pat):
+        return Matcher(pat, self._frames[-1] if self._frames else None)
+
+    def _switch(self, cases):
+        return Switch(cases, self._frames[-1] if self._frames else None)
+
+    @staticmethod
+    def _frame(body, params=None):
+        names, stack = Module._pattern_names(params) if params is not None else set(), [body]
+        while stack:
+            match stack.pop():
+                case Func() | Scope(): pass
+                case Define(pat=pat, expr=expr):
+                    names |= Module._pattern_names(pat); stack.append(expr)
+                case Match(value=value, cases=cases) | Try(body=value, clauses=cases):
+                    stack.append(value)
+                    for pat, expr in cases:
+                        names |= Module._pattern_names(pat); stack.append(expr)
+                case other: stack.extend(Folder._children(other))
+        return {name: index for index, name in enumerate(sorted(names))}
 
     def _set_operand(self, ip, operand):
         inst = self._code[ip]
@@ -947,28 +2869,47 @@ class VM:
             try:
                 inst = self._code[self._ip]; self._ip += 1
                 match inst:
-                    case ("halt",): break
+                    case ("get_local", index, name):
+                        val = self._env._slots[index]
+                        self._stack.append(self._env._parent.val(name) if val is Slots.unset else val)
+                    case ("get_global", name, cache):
+                        if cache.env is self._env._globals and cache.version == cache.cell[0]:
+                            self._stack.append(cache.val)
+                        else: self._stack.append(cache.fill(self._env._globals, name))
+                    case ("get", name, cache):
+                        if cache.env is self._env and cache.version == cache.cell[0]: self._stack.append(cache.val)
+                        else: self._stack.append(cache.fill(self._env, name))
+                    case ("get", name): self._stack.append(self._env.val(name))
+                    case ("call", nargs): self._call(nargs)
                     case ("const", val): self._stack.append(val)
                     case ("pop",): self._stack.pop()
-                    case ("def", pat): self._def(pat)
-                    case ("set", name): self._set(name)
-                    case ("set_index",): self._set_index()
-                    case ("get", name): self._stack.append(self._env.val(name))
-                    case ("jump", addr): self._ip = addr
                     case ("jump_if_false", addr):
                         if not self._stack.pop(): self._ip = addr
-                    case ("match", pat):
-                        val = self._stack[-1]
-                        self._stack.append(self._env.bind(pat, val))
+                    case ("jump", addr): self._ip = addr
+                    case ("set_local", index, name):
+                        if self._env._slots[index] is Slots.unset: self._env._parent.assign(name, self._stack[-1])
+                        else: self._env._slots[index] = self._stack[-1]
+                    case ("def_local", index): self._env._slots[index] = self._stack[-1]
+                    case ("tail_call", nargs): self._tail_call(nargs)
+                    case ("ret",): self._ret()
+                    case ("def", matcher): self._def(matcher)
+                    case ("get_free", depth, index, name): self._get_free(depth, index, name)
+                    case ("set_free", depth, index, name): self._set_free(depth, index, name)
+                    case ("halt",): break
+                    case ("set", name): self._set(name)
+                    case ("set_index",): self._set_index()
+                    case ("switch", switch, default): self._switch(switch, default)
+                    case ("guard", cells, addr):
+                        for cell, version in cells:
+                            if cell[0] != version: self._ip = addr; break
                     case ("dot", attr_name): self._dot(attr_name)
                     case ("make_closure", params, body_expr, body_code):
                         self._stack.append((Ident("closure"), [
                             params, body_expr, body_code, self._env]))
-                    case ("call", nargs): self._call(nargs)
-                    case ("ret",): self._ret()
-                    case ("enter_scope",):
+                    case ("enter_scope", frame):
                         self._ctrl_stack.append(("scope", self._env))
-                        self._env = Environment(self._env)
+                        self._env = SlotEnvironment(self._env, frame)
+                    case ("frame", frame, _): self._env = SlotEnvironment.adopt(self._env, frame)
                     case ("leave_scope",):
                         _, self._env = self._ctrl_stack.pop()
                     case ("enter_try", addr):
@@ -986,9 +2927,27 @@ class VM:
         assert len(self._stack) == 1, f"Invalid stack state @ execute(): {self._stack}"
         return self._stack.pop()
 
-    def _def(self, pat):
+    def _get_free(self, depth, index, name):
+        env = self._env
+        for _ in range(depth): env = env._parent
+        val = env._slots[index]
+        self._stack.append(env._parent.val(name) if val is Slots.unset else val)
+
+    def _switch(self, switch, default):
+        val = self._stack[-1]
+        for bind, addr in switch.candidates(val):
+            if bind(self._env, val): self._ip = addr; return
+        self._ip = default
+
+    def _def(self, matcher):
         val = self._stack[-1]
-        assert self._env.bind(pat, val), f"Pattern mismatch @ _def(): {pat}, {val}"
+        assert matcher.bind(self._env, val), f"Pattern mismatch @ _def(): {matcher.pattern}, {val}"
+
+    def _set_free(self, depth, index, name):
+        env = self._env
+        for _ in range(depth): env = env._parent
+        if env._slots[index] is Slots.unset: env._parent.assign(name, self._stack[-1])
+        else: env._slots[index] = self._stack[-1]
 
     def _set(self, name):
         val = self._stack[-1]
@@ -1019,7 +2978,8 @@ class VM:
 
     def _call(self, nargs):
         op = self._stack.pop()
-        args = list(reversed([self._stack.pop() for _ in range(nargs)]))
+        args = self._stack[len(self._stack) - nargs:]; del self._stack[len(self._stack) - nargs:]
+        if callable(op): self._stack.append(op(args)); return
         match op:
             case (Ident("bound_method"), func_val, target_val):
                 op = func_val
@@ -1027,14 +2987,19 @@ class VM:
         match op:
             case f if callable(f): self._stack.append(f(args))
             case (Ident("closure"), [params, body_expr, body_code, closure_env]):
-                new_env = Environment(closure_env)
-                if new_env.bind(params, args):
+                if framed := body_code and body_code[0][0] == "frame":
+                    new_env = SlotEnvironment(closure_env, body_code[0][1])
+                    bound = body_code[0][2].bind(new_env, args)
+                else:
+                    new_env = Environment(closure_env)
+                    bound = new_env.bind(params, args)
+                if bound:
                     if body_code:
                         self._ctrl_stack.append(
                             ("call", self._code, self._ip, len(self._stack), self._env))
                         self._env = new_env
                         self._code = body_code
-                        self._ip = 0
+                        self._ip = 1 if framed else 0
                     else:
                         try:
                             self._stack.append(Evaluator().eval(body_expr, new_env))
@@ -1045,6 +3010,14 @@ class VM:
             case unexpected:
                 assert False, f"Invalid call @ _call(): {unexpected}"
 
+    def _tail_call(self, nargs):
+        depth = len(self._ctrl_stack)
+        frame = depth - 1
+        while self._ctrl_stack[frame][0] == "scope": frame -= 1
+        self._call(nargs)
+        if self._ctrl_stack[frame][0] == "call" and len(self._ctrl_stack) > depth:
+            del self._ctrl_stack[frame + 1:]
+
     def _ret(self):
         result = self._stack.pop()
         while self._ctrl_stack:
@@ -1075,13 +3048,193 @@ class VM:
 
         raise ToilException(exc_val)
 
+class DependencyExpander(Expander):
+    def __init__(self, macros: MacroTable) -> None:
+        super().__init__(macros)
+        self.uses, self.macros = set(), set()
+
+    def _op(self, op_expr, args_expr, env):
+        if type(op_expr) is Ident: self.uses.add(op_expr.name)
+        return super()._op(op_expr, args_expr, env)
+
+    def _define(self, pat, expr, env):
+        expanded = yield super()._define(pat, expr, env)
+        if expanded is None: self.macros.add(str(pat))
+        return expanded
+
+class Form:
+    __slots__ = ("start", "end", "sep", "after", "tokens", "expr",
+                 "code", "uses", "macros", "reads", "captures", "defines", "value")
+
+    def __init__(self, expr, tokens):
+        self.expr, self.tokens, self.code = expr, tokens, None
+        self.uses, self.macros, self.reads, self.captures, self.defines = set(), set(), set(), set(), set()
+
+    def shift(self, delta):
+        self.start += delta; self.end += delta
+        if self.sep is not None: self.sep += delta; self.after += delta
+
+class Module:
+    _syntax = Ident("syntax")
+
+    def __init__(self, syntax_rules: SyntaxRules, macros: MacroTable, env: Environment) -> None:
+        self._syntax_rules = syntax_rules
+        self._macros = macros
+        self._env = env
+        self._src = ""
+        self._forms = []
+        self.analyzed, self.executed = [], []
+
+    def load(self, src: Source) -> Value:
+        old, forms = self._src, self._forms
+        prefix = self._common_prefix(old, src)
+        old_hi = len(old) - self._common_suffix(old, src, prefix)
+        delta = len(src) - len(old)
+
+        i = 0
+        while i < len(forms) and forms[i].sep is not None and forms[i].after <= prefix: i += 1
+        m = len(forms)
+        while m - 1 > i and forms[m - 2].sep >= old_hi: m -= 1
+        start = forms[i - 1].after if i > 0 else 0
+        end = (forms[m - 1].sep if m < len(forms) else len(old)) + delta
+
+        region = self._parse_region(src, start, end, forms[i:m])
+        if m < len(forms) and any(
+                form.code is None and (Ident, self._syntax) in form.tokens for form in region):
+            m, end = len(forms), len(src)
+            region = self._parse_region(src, start, end, forms[i:m])
+        assert region or (i == 0 and m == len(forms)), f"Empty form @ load(): {start}"
+        if m < len(forms): region[-1].sep, region[-1].after = end, end + 1
+        for form in forms[m:]: form.shift(delta)
+
+        kept = {id(form) for form in region}
+        removed = [form for form in forms[i:m] if id(form) not in kept]
+        self._src, self._forms = src, forms[:i] + region + forms[m:]
+        return self._update(removed)
+
+    def _parse_region(self, src, start, end, old_forms):
+        reusable = {}
+        for form in old_forms: reusable.setdefault(form.tokens, []).append(form)
+        buffer = Scanner(src[start:end]).tokenize_columns()
+        for k in range(len(buffer) - 1):
+            if buffer[k] is self._syntax: self._syntax_rules.pop(buffer[k + 1], None)
+        region, syntax_changed = [], False
+        for expr, first, last in SpanParser(buffer, self._syntax_rules, {}).parse_forms():
+            tokens = tuple((type(buffer[k]), buffer[k]) for k in range(first, last))
+            if reusable.get(tokens) and not syntax_changed: form = reusable[tokens].pop(0)
+            else:
+                form = Form(expr, tokens)
+                syntax_changed = syntax_changed or (Ident, self._syntax) in tokens
+            form.start = start + buffer.starts[first]
+            form.end = start + buffer.ends[last - 1]
+            form.sep, form.after = (start + buffer.starts[last], start + buffer.ends[last]) \
+                if buffer.kind(last) == "operator" else (None, None)
+            region.append(form)
+        return region
+
+    def _update(self, removed):
+        changed_macros, changed_names = set(), set()
+        for form in removed:
+            changed_macros |= form.macros; changed_names |= form.defines
+        self.analyzed, self.executed = [], []
+        stale, spread = set(), 0
+        for index, form in enumerate(self._forms):
+            if form.code is None or (form.uses | form.macros) & changed_macros:
+                self._analyze(form)
+                changed_macros |= form.macros
+                self.analyzed.append(index)
+            elif not form.defines & changed_names:
+                if spread != len(changed_names): stale, spread = self._spread(changed_names), len(changed_names)
+                if not form.reads & stale: continue
+            form.value = VM(form.code, self._env).execute()
+            changed_names |= form.defines
+            self.executed.append(index)
+        return self._forms[-1].value if self._forms else None
+
+    def _spread(self, changed_names):
+        stale, grown = set(changed_names), True
+        while grown:
+            grown = False
+            for form in self._forms:
+                if form.captures & stale and not form.defines <= stale:
+                    stale |= form.defines; grown = True
+        return stale
+
+    def _analyze(self, form):
+        expander = DependencyExpander(self._macros)
+        node = to_node(expander.expand(form.expr, self._env))
+        form.uses, form.macros = expander.uses, expander.macros
+        form.reads, form.captures, form.defines = self._names(node)
+        form.code = Compiler(node).compile()
+
+    def _names(self, node):
+        reads, captures, defines, stack = set(), set(), set(), [node]
+        while stack:
+            match stack.pop():
+                case Var(name=name): reads.add(name)
+                case Func(body=body): captures.update(*self._names(body)[:2])
+                case Define(pat=pat, expr=expr):
+                    defines |= self._pattern_names(pat); stack.append(expr)
+                case Assign(target=Var(name=name), expr=expr):
+                    defines.add(name); stack.append(expr)
+                case Node() as other:
+                    for name in other.__slots__:
+                        match getattr(other, name):
+                            case Node() as child: stack.append(child)
+                            case list() | dict() as children:
+                                for child in (children.values() if type(children) is dict
+                                              else children):
+                                    match child:
+                                        case Node(): stack.append(child)
+                                        case (_, Node() as body): stack.append(body)
+        return reads, captures, defines
+
+    @staticmethod
+    def _pattern_names(pat):
+        names, stack = set(), [pat]
+        while stack:
+            match stack.pop():
+                case Ident(name): names.add(name)
+                case list() as pats: stack.extend(pats)
+                case dict() as pats: stack.extend(pats.values())
+                case (Ident(), list() as pats): stack.extend(pats)
+        return names
+
+    @staticmethod
+    def _common_prefix(a, b):
+        lo, hi = 0, min(len(a), len(b))
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if a[:mid] == b[:mid]: lo = mid
+            else: hi = mid - 1
+        return lo
+
+    @staticmethod
+    def _common_suffix(a, b, prefix):
+        lo, hi = 0, min(len(a), len(b)) - prefix
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if a[len(a) - mid:] == b[len(b) - mid:]: lo = mid
+            else: hi = mid - 1
+        return lo
+
+
 class Interpreter:
-    def __init__(self) -> None:
+    def __init__(self, memoize_macros: bool = False, hash_cons: bool = False, fold: bool = False) -> None:
         self._syntax_rules = {}
+        self._macros = MacroTable()
         self._env = Environment()
+        self._modules = {}
+        self._memoize_macros = memoize_macros
+        self._macro_cache = None
+        self._hash_cons = hash_cons
+        self._fold = fold
+        self._pure = {}
+        self._closure_evaluator = ClosureEvaluator()
 
     def init_env(self) -> 'Interpreter':
         self._gensym_counter = 0
+        self._macros = MacroTable()
         self._env = Environment()
         self._builtins()
         self._corelib()
@@ -1117,6 +3270,7 @@ class Interpreter:
         self._env.define("pop", lambda args: args[0].pop() if len(args) == 1 else args[0].pop(args[1]))
         self._env.define("in", lambda args: args[0] in args[1])
         self._env.define("copy", lambda args: args[0].copy())
+        self._env.define("concat", lambda args: [elem for seg in args for elem in seg])
 
         self._env.define("join", lambda args: str(args[1]).join(map(str, args[0])))
         self._env.define("format", lambda args: args[0].format(*args[1:]))
@@ -1132,17 +3286,24 @@ class Interpreter:
         self._env.define("to_dict", lambda args: dict(args[0]))
         self._env.define("to_tuple", lambda args: tuple(args[0]))
 
+        self._pure = {name: self._env.val(name) for name in (
+            "add", "sub", "mul", "div", "mod", "neg",
+            "equal", "not_equal", "less", "greater", "less_equal", "greater_equal", "not",
+            "len", "index", "slice", "in", "join", "format",
+            "type", "to_bool", "to_int", "to_str")}
+
         self._env.define("print", lambda args: print(*args))
 
         self._env.define("read", lambda args: open(args[0], "r").read())
 
         def _load(path, ici=False):
-            with open(path, "r") as f: src = f.read()
+            with open(path, "r") as f: ast = self.expand(self.parse(self.stream(f)))
             if ici:
-                return VM(self.code(src), Environment(self._env)).execute()
+                return VM(self.compile(ast), Environment(self._env)).execute()
             else:
-                return Evaluator().eval(self.ast(src), Environment(self._env))
+                return Evaluator().eval(self._optimized(ast), Environment(self._env))
         self._env.define("load", lambda args: _load(args[0], args[1] if len(args) > 1 else False))
+        self._env.define("reload", lambda args: self.reload(args[0]))
 
         self._env.define("eval", lambda args: Evaluator().eval(self.ast(args[0]), self._env))
         self._env.define("eval_expr", lambda args: Evaluator().eval(args[0], self._env))
@@ -1153,17 +3314,18 @@ class Interpreter:
             match func:
                 case (Ident("closure"), [params, body_expr, body_code, closure_env]):
                     if not body_code:
-                        func[1][2] = Compiler(body_expr).compile()
+                        func[1][2] = Compiler(body_expr, body=True).compile()
                     return func
                 case _:
                     assert False, f"Expected a closure @ compile(): {func}"
         self._env.define("compile", _compile)
+        self._env.define("specialize", lambda args: Specializer(self._pure).specialize(args[0], args[1:]))
 
-        def _gensym(args):
+        def _gensym(name):
             self._gensym_counter += 1
-            name = args[0] if args else "gensym"
             return Ident(f"__{name}_{self._gensym_counter}")
-        self._env.define("gensym", lambda args: _gensym(args))
+        self._macro_cache = MacroCache(_gensym)
+        self._env.define("gensym", lambda args: self._macro_cache.gensym(args[0] if args else "gensym"))
 
         self._env = Environment(self._env)
 
@@ -1346,18 +3508,48 @@ class Interpreter:
     def scan(self, src: Source) -> list[Token]:
         return Scanner(src).tokenize()
 
-    def parse(self, tokens: list[Token]) -> Expr:
-        return Parser(tokens, self._syntax_rules).parse()
+    def scan_columns(self, src: Source) -> TokenBuffer:
+        return Scanner(src).tokenize_columns()
+
+    def stream(self, source: Iterable[str]) -> Iterator[Token]:
+        return StreamScanner(source).tokenize()
+
+    def parse(self, tokens: Iterable[Token]) -> Expr:
+        return self._parse(tokens, HashCons() if self._hash_cons else None)
+
+    def _parse(self, tokens, hash_cons):
+        if hash_cons is None: return Parser(tokens, self._syntax_rules).parse()
+        return SharingParser(tokens, self._syntax_rules, hash_cons).parse()
 
     def expand(self, ast: Expr) -> Expr:
-        return Expander().expand(ast, self._env)
+        return self._expand(ast, HashCons() if self._hash_cons else None)
+
+    def _expand(self, ast, hash_cons):
+        cache = self._macro_cache if self._memoize_macros else None
+        if hash_cons is None: return Expander(self._macros, cache).expand(ast, self._env)
+        return SharingExpander(self._macros, hash_cons, cache).expand(ast, self._env)
+
+    def macro_stats(self) -> dict[str, int]:
+        return {"hits": self._macro_cache.hits, "misses": self._macro_cache.misses}
 
     def ast(self, src: Source) -> Expr:
-        return self.expand(self.parse(self.scan(src)))
+        hash_cons = HashCons() if self._hash_cons else None
+        return self._expand(self._parse(self.scan(src), hash_cons), hash_cons)
+
+    def nodes(self, src: Source) -> Node:
+        spans = {}
+        ast = SpanParser(self.scan_columns(src), self._syntax_rules, spans).parse()
+        return to_node(SpanExpander(self._macros, spans).expand(ast, self._env), spans)
+
+    def folded(self, ast: Expr) -> Node:
+        return Folder(self._env, self._pure).fold(ast)
+
+    def _optimized(self, ast):
+        return self.folded(ast) if self._fold else ast
 
-    def eval(self, ast: Expr) -> Value:
+    def eval(self, ast: Expr, evaluator: type[Evaluator] = Evaluator) -> Value:
         try:
-            return Evaluator().eval(ast, self._env)
+            return evaluator().eval(self._optimized(ast), self._env)
         except ToilException as e: assert False, f"ToilException @ evaluate(): {e.e}"
         except ReturnException as e: return e.val
         except ContinueException: assert False, "Continue at top level @ evaluate()"
@@ -1366,8 +3558,25 @@ class Interpreter:
     def walk(self, src: Source) -> Value:
         return self.eval(self.ast(src))
 
+    def twalk(self, src: Source) -> Value:
+        return self.eval(self.ast(src), TrampolineEvaluator)
+
+    def closure(self, ast: Expr) -> Callable[[Environment], Value]:
+        return self._closure_evaluator.closure(self._optimized(ast))
+
+    def invoke(self, closure: Callable[[Environment], Value]) -> Value:
+        try:
+            return closure(self._env)
+        except ToilException as e: assert False, f"ToilException @ invoke(): {e.e}"
+        except ReturnException as e: return e.val
+        except ContinueException: assert False, "Continue at top level @ invoke()"
+        except BreakException: assert False, f"Break at top level @ invoke()"
+
+    def cwalk(self, src: Source) -> Value:
+        return self.invoke(self.closure(self.ast(src)))
+
     def compile(self, ast: Expr) -> Code:
-        return Compiler(ast).compile()
+        return Compiler(self._optimized(ast)).compile()
 
     def code(self, src: Source) -> Code:
         return self.compile(self.ast(src))
@@ -1380,6 +3589,33 @@ class Interpreter:
     def run(self, src: Source) -> Value:
         return self.execute(self.code(src))
 
+    def module(self, path: str) -> Module:
+        if path not in self._modules:
+            self._modules[path] = Module(self._syntax_rules, MacroTable(self._macros), Environment(self._env))
+        return self._modules[path]
+
+    def reload(self, path: str) -> Value:
+        with open(path, "r") as f: return self.module(path).load(f.read())
+
+    def compile_modules(self, paths: list[str], workers: int | None = None) -> list[Code]:
+        with ProcessPoolExecutor(workers, initializer=CompileWorker.init) as pool:
+            return list(pool.map(CompileWorker.compile, paths))
+
+
+class CompileWorker:
+    toil: Interpreter | None = None
+
+    @staticmethod
+    def init() -> None:
+        CompileWorker.toil = Interpreter().init_env().stdlib()
+
+    @staticmethod
+    def compile(path: str) -> Code:
+        base, toil = CompileWorker.toil, Interpreter()
+        toil._syntax_rules, toil._macros, toil._env = \
+            dict(base._syntax_rules), MacroTable(base._macros), Environment(base._env)
+        with open(path, "r") as f: return toil.code(f.read())
+
 if __name__ == "__main__":
     import sys
 
@@ -1396,6 +3632,12 @@ if __name__ == "__main__":
                 if walk_or_run == "walk":
                     print("Output:")
                     result = toil.eval(expr)
+                elif walk_or_run == "cwalk":
+                    print("Output:")
+                    result = toil.invoke(toil.closure(expr))
+                elif walk_or_run == "twalk":
+                    print("Output:")
+                    result = toil.eval(expr, TrampolineEvaluator)
                 else:
                     code = toil.code(src)
                     print("Code:", code, "Output:", sep="\n")
@@ -1408,16 +3650,36 @@ if __name__ == "__main__":
         with open(filename, "r") as f:
             if walk_or_run == "walk":
                 result = toil.walk(f.read())
+            elif walk_or_run == "cwalk":
+                result = toil.cwalk(f.read())
+            elif walk_or_run == "twalk":
+                result = toil.twalk(f.read())
             else:
                 result = toil.run(f.read())
         exit(result if isinstance(result, int) else 0)
 
+    def go_folded(filename):
+        with open(filename, "r") as f: print(toil.folded(toil.ast(f.read())))
+        exit(0)
+
+    def go_modules(filenames):
+        result = None
+        for code in toil.compile_modules(filenames):
+            result = toil.execute(code)
+        exit(result if isinstance(result, int) else 0)
+
     if len(sys.argv) > 1:
         match sys.argv[1]:
             case "--repl": repl("walk")
             case "--rcepl": repl("run")
+            case "--cwrepl": repl("cwalk")
+            case "--twrepl": repl("twalk")
             case "--walk": go_file("walk", sys.argv[2])
             case "--run": go_file("run", sys.argv[2])
+            case "--cwalk": go_file("cwalk", sys.argv[2])
+            case "--twalk": go_file("twalk", sys.argv[2])
+            case "--modules": go_modules(sys.argv[2:])
+            case "--folded": go_folded(sys.argv[2])
 
     def print_code(code):
         print()